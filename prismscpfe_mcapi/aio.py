@@ -0,0 +1,159 @@
+"""Asyncio facade over the blocking Materials Commons client calls"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from prismscpfe_mcapi.uploads import upload_and_attach, replace_changed_files, unique_files
+from prismscpfe_mcapi.scheduler import get_scheduler
+
+# Default number of Materials Commons calls in flight at the same time
+DEFAULT_CLIENT_WORKERS = 16
+
+
+class AsyncClient(object):
+    """
+    Run blocking Materials Commons calls from coroutines, so that independent
+    calls (e.g. adding measurements and uploading files for one process) can
+    be awaited together and their network latency overlaps.
+
+    The mcapi client is synchronous, so calls run on a bounded pool of
+    threads shared by every coroutine using this client. Single requests
+    (request, request_idempotent) also go through the shared RequestScheduler,
+    which sets how many of them are actually in flight.
+
+    Arguments:
+
+        max_workers: int
+          Maximum number of calls running at the same time
+
+    """
+
+    def __init__(self, max_workers=DEFAULT_CLIENT_WORKERS):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(max_workers)))
+
+    async def call(self, func, *args, **kwargs):
+        """
+        Await func(*args, **kwargs) run on the client's threads. Use for
+        functions making several requests, which schedule each of them.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def request(self, func, *args, **kwargs):
+        """Await a single Materials Commons request, admitted by the RequestScheduler"""
+        return await self.call(get_scheduler().call, func, *args, **kwargs)
+
+    async def request_idempotent(self, func, *args, **kwargs):
+        """Await a single Materials Commons request that is safe to repeat, retried on transient errors"""
+        return await self.call(get_scheduler().call_idempotent, func, *args, **kwargs)
+
+    async def create_process(self, expt, template_id, name, sample_names, input_samples=None, operation=None):
+        """
+        Create a process from a template, then rename it, create its output
+        samples and add its input samples concurrently.
+
+        With an operation (see journal.begin_operation), each of these steps
+        is recorded when it completes, and the steps recorded by a previous
+        run of the operation are skipped: its process is fetched instead of
+        created, and its output samples are reused.
+
+        Returns:
+
+            proc: mcapi.Process, fetched again so that it lists its samples
+
+            samples: list of mcapi.Sample, the new output samples
+
+        """
+        if operation is not None and operation.process_id is not None:
+            proc = await self.get_process(expt, operation.process_id)
+        else:
+            proc = await self.request(expt.create_process_from_template, template_id)
+            if operation is not None:
+                operation.set_process(proc.id)
+
+        async def create_samples():
+            if operation is not None and len(operation.sample_ids):
+                return None
+            samples = await self.request(proc.create_samples, sample_names)
+            if operation is not None:
+                operation.set_samples([s.id for s in samples])
+            return samples
+
+        async def step(name, func, *args):
+            if operation is not None and operation.is_done(name):
+                return
+            await func(*args)
+            if operation is not None:
+                operation.done(name)
+
+        calls = [create_samples(), step('rename', self.request_idempotent, proc.rename, name)]
+        if input_samples is not None:
+            calls.append(step('inputs', self.request, proc.add_input_samples_to_process, input_samples))
+        results = await asyncio.gather(*calls)
+        proc = await self.get_process(expt, proc.id)
+        samples = results[0]
+        if samples is None:
+            # a process fetched by id does not necessarily list its output samples
+            await self.request_idempotent(proc.decorate_with_output_samples)
+            samples = [s for s in proc.output_samples if s.id in operation.sample_ids]
+        return proc, samples
+
+    async def get_process(self, expt, proc_id):
+        return await self.request_idempotent(expt.get_process_by_id, proc_id)
+
+    async def get_sample(self, proj, sample_id):
+        """Fetch a sample with its properties (measurements)"""
+        return await self.request_idempotent(proj.get_sample_by_id, sample_id)
+
+    async def upload_and_attach(self, proj, proc, local_paths, **kwargs):
+        """uploads.upload_and_attach as a coroutine"""
+        return await self.call(upload_and_attach, proj, proc, local_paths, **kwargs)
+
+    async def replace_changed_files(self, proj, proc, local_paths, **kwargs):
+        """uploads.replace_changed_files as a coroutine"""
+        return await self.call(replace_changed_files, proj, proc, local_paths, **kwargs)
+
+    async def flush(self, batch, operation=None, step='measurements'):
+        """
+        Send the measurements queued on a MeasurementBatch. With an
+        operation, they are not sent if step is recorded as done, and step is
+        recorded once they are sent.
+        """
+        if operation is not None and operation.is_done(step):
+            return 0
+        n = await self.call(batch.flush)
+        if operation is not None:
+            operation.done(step)
+        return n
+
+    async def link_files(self, samples, files):
+        """Link files to each sample, concurrently"""
+        files = unique_files(files)
+        await asyncio.gather(*[self.request_idempotent(sample.link_files, files) for sample in samples])
+
+    def close(self):
+        self._executor.shutdown()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the AsyncClient shared by this process, creating it on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = AsyncClient()
+        return _client
+
+
+def run_sync(coro):
+    """
+    Run a coroutine to completion from synchronous code and return its
+    result. Each call uses a new event loop, so sync entry points may be
+    called from any thread that is not already running an event loop.
+    """
+    return asyncio.run(coro)
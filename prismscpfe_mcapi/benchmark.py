@@ -0,0 +1,309 @@
+"""Benchmarks of the --create paths against the in-process MockServer"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# --create paths benchmarked, named after their subcommands
+CASES = ['numerical-parameters', 'GrainId', 'Orientations', 'BoundaryConditions', 'simulation', 'full-simulation']
+
+# Example app directory shipped with the repository
+TEST_FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'TestFiles')
+
+# Default size of each synthetic result file, and number of them per unit of scale
+DEFAULT_RESULT_BYTES = 4 * 1024 * 1024
+DEFAULT_RESULT_FILES = 4
+
+# Relative increase of wall time, bytes or peak RSS over a baseline reported as a regression
+DEFAULT_TOLERANCE = 0.25
+
+_GRAIN_COUNT_RE = re.compile(r"^\s*(\d+)\s", re.MULTILINE)
+
+
+def make_synthetic_app_dir(app_dir, scale=1, result_files=None, result_bytes=DEFAULT_RESULT_BYTES, seed=0):
+    """
+    Write a copy of TestFiles scaled up by scale: a GrainId volume of
+    (20 scale) x (20 scale) x 22 voxels with random grain ids, parameters.in
+    updated to match, and scale * DEFAULT_RESULT_FILES VTK result files of
+    result_bytes each.
+
+    Returns:
+
+        app_dir: str
+
+    """
+    import numpy as np
+    rng = np.random.RandomState(seed)
+
+    shutil.copytree(TEST_FILES, app_dir)
+    # not a VTK file; replaced by the synthetic results
+    os.remove(os.path.join(app_dir, '123.vtu'))
+
+    with open(os.path.join(TEST_FILES, 'orientations.txt')) as f:
+        grain_count = len(_GRAIN_COUNT_RE.findall(f.read()))
+    nx, ny, nz = 20 * scale, 20 * scale, 22
+    with open(os.path.join(app_dir, 'GrainId.txt'), 'w') as f:
+        f.write("**Total header lines = 5\n")
+        f.write("**Grain ID File \n")
+        f.write("**3D Volume has dimensions [{} x {} x {}] voxels\n".format(nx, ny, nz))
+        f.write("**Data arranged in a 2D array of {} x {} integer values\n".format(nx * ny, nz))
+        f.write("**\n")
+        np.savetxt(f, rng.randint(1, grain_count + 1, size=(nx * ny, nz)), fmt='%d', delimiter='\t')
+
+    parameters_path = os.path.join(app_dir, 'parameters.in')
+    with open(parameters_path) as f:
+        parameters = f.read()
+    for axis, n in zip('XYZ', (nx, ny, nz)):
+        parameters = re.sub(r"(set Voxels in " + axis + r" direction\s*=\s*)\d+", r"\g<1>" + str(n), parameters)
+    with open(parameters_path, 'w') as f:
+        f.write(parameters)
+
+    if result_files is None:
+        result_files = DEFAULT_RESULT_FILES * scale
+    for step in range(result_files):
+        _write_vtu(os.path.join(app_dir, 'solution-{:04d}.vtu'.format(step)), step, result_bytes, rng)
+    return app_dir
+
+
+def _write_vtu(file_name, step, nbytes, rng):
+    """Write a VTK XML unstructured grid with nbytes of raw appended data"""
+    points = max(1, nbytes // 32)
+    with open(file_name, 'wb') as f:
+        f.write((
+            '<?xml version="1.0"?>\n'
+            '<VTKFile type="UnstructuredGrid" version="0.1" byte_order="LittleEndian" header_type="UInt32">\n'
+            '  <UnstructuredGrid>\n'
+            '    <FieldData>\n'
+            '      <DataArray type="Float64" Name="TIME" NumberOfTuples="1" format="ascii">' + str(0.01 * step) + '</DataArray>\n'
+            '    </FieldData>\n'
+            '    <Piece NumberOfPoints="' + str(points) + '" NumberOfCells="' + str(points // 8) + '">\n'
+            '      <PointData>\n'
+            '        <DataArray type="Float64" Name="Displacement" NumberOfComponents="3" format="appended" offset="0"/>\n'
+            '      </PointData>\n'
+            '    </Piece>\n'
+            '  </UnstructuredGrid>\n'
+            '  <AppendedData encoding="raw">\n'
+            '_').encode('ascii'))
+        remaining = nbytes
+        while remaining > 0:
+            n = min(remaining, 1 << 20)
+            f.write(rng.bytes(n))
+            remaining -= n
+        f.write(b'\n  </AppendedData>\n</VTKFile>\n')
+
+
+def _peak_rss():
+    """Peak resident set size of this process in bytes, or None if unknown"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def run_case(case, source_dir, latency=0.0, bandwidth=None, upload_workers=None):
+    """
+    Copy source_dir into a new local project and run the --create path of
+    case on it against a new MockServer, in this process.
+
+    Returns:
+
+        result: dict
+          'case', 'wall_time' (s), 'requests' (round trips), 'bytes_sent',
+          'bytes_received' (by the client), 'peak_rss' (bytes, of this process)
+
+    """
+    from prismscpfe_mcapi.mock_server import MockServer
+    from prismscpfe_mcapi.cache import set_cache_options, CACHE_NAME
+    from prismscpfe_mcapi.uploads import DEFAULT_UPLOAD_WORKERS
+    from prismscpfe_mcapi.numerical_parameters import create_parameters_sample
+    from prismscpfe_mcapi.grainid import create_GrainId_sample
+    from prismscpfe_mcapi.orientations import create_Orientations_sample
+    from prismscpfe_mcapi.boundaryconditions import create_BoundaryConditions_sample
+    from prismscpfe_mcapi.simulation import create_simulation_sample
+    from prismscpfe_mcapi.full_simulation import create_full_simulation
+
+    if upload_workers is None:
+        upload_workers = DEFAULT_UPLOAD_WORKERS
+    project_dir = tempfile.mkdtemp(prefix='prismscpfe_benchmark_')
+    try:
+        app_dir = os.path.join(project_dir, 'run')
+        shutil.copytree(source_dir, app_dir)
+        set_cache_options(path=os.path.join(project_dir, '.materialscommons', CACHE_NAME))
+
+        with MockServer(latency=latency, bandwidth=bandwidth) as server, server.install():
+            proj = server.create_project(project_dir)
+            expt = proj.create_experiment('benchmark', case)
+            if case == 'simulation':
+                proc = expt.create_process_from_template('benchmark inputs')
+                input_samples = proc.create_samples(['Benchmark Input'])
+
+            create = {
+                'numerical-parameters': lambda: create_parameters_sample(expt, upload_workers=upload_workers, app_dir=app_dir),
+                'GrainId': lambda: create_GrainId_sample(expt, app_dir=app_dir),
+                'Orientations': lambda: create_Orientations_sample(expt, app_dir=app_dir),
+                'BoundaryConditions': lambda: create_BoundaryConditions_sample(expt, app_dir=app_dir),
+                'simulation': lambda: create_simulation_sample(expt, input_samples, upload_workers=upload_workers, app_dir=app_dir),
+                'full-simulation': lambda: create_full_simulation(expt, upload_workers=upload_workers, app_dir=app_dir, out=sys.stdout)
+            }[case]
+
+            before = server.counters()
+            start = time.perf_counter()
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                create()
+            wall_time = time.perf_counter() - start
+            after = server.counters()
+    finally:
+        shutil.rmtree(project_dir, ignore_errors=True)
+
+    return {
+        'case': case,
+        'wall_time': wall_time,
+        'requests': after['requests'] - before['requests'],
+        'bytes_sent': after['bytes_received'] - before['bytes_received'],
+        'bytes_received': after['bytes_sent'] - before['bytes_sent'],
+        'peak_rss': _peak_rss()
+    }
+
+
+def run_benchmarks(datasets, cases=CASES, latency=0.0, bandwidth=None, upload_workers=None, out=sys.stdout):
+    """
+    Run every case on every dataset, each in a new Python process so that
+    the peak RSS and in-process caches of one case do not affect another.
+
+    Arguments:
+
+        datasets: list of (name, app_dir)
+
+        cases: list of str, from CASES
+
+        latency, bandwidth: MockServer settings
+
+    Returns:
+
+        results: list of dict
+          run_case results, with 'dataset' added
+
+    """
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for dataset, app_dir in datasets:
+        for case in cases:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = pool.submit(run_case, case, app_dir, latency, bandwidth, upload_workers).result()
+            result['dataset'] = dataset
+            write_results([result], out, header=not len(results))
+            results.append(result)
+    return results
+
+
+def _mb(nbytes):
+    return '-' if nbytes is None else '{:.2f}'.format(nbytes / float(1 << 20))
+
+
+def write_results(results, out=sys.stdout, header=True):
+    if header:
+        out.write('{:16} {:22} {:>10} {:>10} {:>10} {:>10} {:>10}\n'.format(
+            'dataset', 'case', 'wall (s)', 'requests', 'sent (MB)', 'recv (MB)', 'RSS (MB)'))
+    for r in results:
+        out.write('{:16} {:22} {:10.3f} {:10d} {:>10} {:>10} {:>10}\n'.format(
+            r['dataset'], r['case'], r['wall_time'], r['requests'], _mb(r['bytes_sent']), _mb(r['bytes_received']), _mb(r['peak_rss'])))
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare results with the results of an earlier run.
+
+    Round trips are deterministic and must not increase at all; wall time,
+    bytes and peak RSS may increase by the fraction tolerance.
+
+    Returns:
+
+        regressions: list of str
+
+    """
+    regressions = []
+    base = {(r['dataset'], r['case']): r for r in baseline}
+    for r in results:
+        b = base.get((r['dataset'], r['case']))
+        if b is None:
+            continue
+        name = r['dataset'] + ' ' + r['case']
+        if r['requests'] > b['requests']:
+            regressions.append(name + ': requests ' + str(b['requests']) + ' -> ' + str(r['requests']))
+        for key in ['wall_time', 'bytes_sent', 'bytes_received', 'peak_rss']:
+            if r[key] is not None and b.get(key) is not None and r[key] > b[key] * (1 + tolerance):
+                regressions.append(name + ': ' + key + ' {:.4g} -> {:.4g}'.format(b[key], r[key]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Runs the PRISMS-CPFE --create paths against an in-process Materials Commons stand-in and reports wall time, round trips, bytes transferred and peak RSS',
+        prog='python -m prismscpfe_mcapi.benchmark')
+
+    cases_help = "Create paths to run (default: all)"
+    parser.add_argument('--cases', nargs='*', choices=CASES, default=CASES, help=cases_help)
+
+    scale_help = "Also run on synthetic inputs scaled up by these factors (default: 4)"
+    parser.add_argument('--scale', nargs='*', type=int, default=[4], help=scale_help)
+
+    result_bytes_help = "Size of each synthetic result file (default: " + str(DEFAULT_RESULT_BYTES) + ")"
+    parser.add_argument('--result-bytes', type=int, default=DEFAULT_RESULT_BYTES, help=result_bytes_help)
+
+    latency_help = "Seconds of latency added to every round trip (default: 0.02)"
+    parser.add_argument('--latency', type=float, default=0.02, help=latency_help)
+
+    bandwidth_help = "Bytes per second for request and response bodies (default: unlimited)"
+    parser.add_argument('--bandwidth', type=float, default=None, help=bandwidth_help)
+
+    upload_workers_help = "Maximum number of files uploaded concurrently"
+    parser.add_argument('--upload-workers', type=int, default=None, help=upload_workers_help)
+
+    json_help = "Write the results to this JSON file"
+    parser.add_argument('--json', type=str, default=None, help=json_help)
+
+    baseline_help = "JSON file of an earlier run; exit with status 1 if any result regressed"
+    parser.add_argument('--baseline', type=str, default=None, help=baseline_help)
+
+    tolerance_help = "Allowed relative increase of wall time, bytes and peak RSS over the baseline (default: " + str(DEFAULT_TOLERANCE) + ")"
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help=tolerance_help)
+
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix='prismscpfe_benchmark_inputs_')
+    try:
+        datasets = [('TestFiles', TEST_FILES)]
+        for scale in args.scale:
+            app_dir = make_synthetic_app_dir(os.path.join(work_dir, 'x' + str(scale)), scale=scale, result_bytes=args.result_bytes)
+            datasets.append(('synthetic-x' + str(scale), app_dir))
+        results = run_benchmarks(datasets, args.cases, latency=args.latency, bandwidth=args.bandwidth, upload_workers=args.upload_workers)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if len(regressions):
+            sys.stdout.write('\nRegressions:\n')
+            for r in regressions:
+                sys.stdout.write('  ' + r + '\n')
+            exit(1)
+
+
+if __name__ == '__main__':
+    main()
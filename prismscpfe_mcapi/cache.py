@@ -0,0 +1,267 @@
+"""On-disk cache of Materials Commons process and sample metadata"""
+
+import os
+import json
+import time
+import sqlite3
+import calendar
+import datetime
+import argparse
+import threading
+from materials_commons.api import Process, Sample
+from prismscpfe_mcapi.scheduler import get_scheduler
+
+CACHE_NAME = "prismscpfe_cache.sqlite"
+
+# Seconds before a cached process or sample list is fetched again
+DEFAULT_TTL = 300
+
+# Total size of cached entries before least recently used entries are evicted
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def set_cache_options(ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES, refresh=False, path=None):
+    """
+    Set the options used by cached lookups in this process.
+
+    Arguments:
+
+        ttl: float
+          Seconds a cached entry stays valid; 0 disables reading from the cache
+
+        max_bytes: int
+          Size limit of the cache file contents, enforced by LRU eviction
+
+        refresh: bool
+          If True, ignore existing entries and fetch everything again
+
+        path: str, optional
+          Location of the cache database, default is ~/.materialscommons/prismscpfe_cache.sqlite
+
+    """
+    global cache_options, _cache
+    cache_options = {
+        'ttl': ttl,
+        'max_bytes': max_bytes,
+        'refresh': refresh,
+        'path': path or os.path.join(os.path.expanduser('~'), '.materialscommons', CACHE_NAME)
+    }
+    _cache = None
+
+set_cache_options()
+
+
+def add_cache_options(parser):
+    """Add --refresh and --cache-ttl to a subcommand argument parser"""
+    refresh_help = "Ignore cached process and sample metadata and fetch it again"
+    parser.add_argument('--refresh', action="store_true", default=False, help=refresh_help)
+    cache_ttl_help = "Seconds cached process and sample metadata stays valid (default: " + str(DEFAULT_TTL) + ")"
+    parser.add_argument('--cache-ttl', type=float, default=DEFAULT_TTL, help=cache_ttl_help)
+
+
+def set_cache_options_from_argv(argv):
+    """Apply --refresh and --cache-ttl from argv, ignoring all other arguments"""
+    parser = argparse.ArgumentParser(add_help=False)
+    add_cache_options(parser)
+    args, unknown = parser.parse_known_args(argv)
+    set_cache_options(ttl=args.cache_ttl, max_bytes=cache_options['max_bytes'], refresh=args.refresh, path=cache_options['path'])
+
+
+class MetadataCache(object):
+    """
+    SQLite key-value store of JSON metadata with a time-to-live and
+    least-recently-used eviction once the stored size exceeds max_bytes.
+
+    Only plain values are stored, never mcapi objects, which hold the remote
+    and its apikey.
+
+    Arguments:
+
+        db_path: str
+          Path to the SQLite database, created if it does not exist
+
+        ttl: float
+          Seconds an entry stays valid
+
+        max_bytes: int
+          Size limit of the stored entries
+
+    """
+
+    def __init__(self, db_path, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        dirname = os.path.dirname(db_path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            # pickled mcapi objects of earlier versions, including the apikey
+            self._conn.execute("DROP TABLE IF EXISTS entries")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS metadata ("
+                " key TEXT PRIMARY KEY,"
+                " created REAL NOT NULL,"
+                " accessed REAL NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " payload TEXT NOT NULL)")
+
+    def get(self, key):
+        """Return the cached value for key, or None if it is missing or expired"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT created, payload FROM metadata WHERE key=?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[0] > self.ttl:
+                with self._conn:
+                    self._conn.execute("DELETE FROM metadata WHERE key=?", (key,))
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE metadata SET accessed=? WHERE key=?", (now, key))
+        return json.loads(row[1])
+
+    def put(self, key, value):
+        """Store value, of JSON types only, under key and evict least recently used entries if needed"""
+        payload = json.dumps(value)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO metadata (key, created, accessed, size, payload) VALUES (?, ?, ?, ?, ?)",
+                (key, now, now, len(payload), payload))
+            self._evict()
+
+    def invalidate(self, key_prefix):
+        """Remove every entry whose key starts with key_prefix"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM metadata WHERE substr(key, 1, ?) = ?", (len(key_prefix), key_prefix))
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM metadata").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM metadata ORDER BY accessed ASC").fetchall():
+            self._conn.execute("DELETE FROM metadata WHERE key=?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+def get_cache():
+    """Return the MetadataCache configured by set_cache_options"""
+    global _cache
+    if _cache is None:
+        _cache = MetadataCache(cache_options['path'], ttl=cache_options['ttl'], max_bytes=cache_options['max_bytes'])
+    return _cache
+
+
+def _container_key(kind, container):
+    # experiments and projects are cached separately; their ids do not collide
+    return kind + ':' + type(container).__name__ + ':' + container.id
+
+
+def _project_and_experiment(container):
+    """Return (project, experiment) of a project or experiment; experiment is None for a project"""
+    project = getattr(container, 'project', None)
+    if project is None:
+        return container, None
+    return project, container
+
+
+def _sample_fields(sample):
+    return {'id': sample.id, 'name': sample.name, 'property_set_id': sample.property_set_id}
+
+
+def _make_sample(fields, project, experiment):
+    sample = Sample(data=fields)
+    sample.project = project
+    sample.experiment = experiment
+    return sample
+
+
+def _timestamp(mtime):
+    # mcapi objects hold their times as UTC datetimes; listings also accept seconds
+    if isinstance(mtime, datetime.datetime):
+        return calendar.timegm(mtime.utctimetuple())
+    return mtime
+
+
+def _process_fields(proc):
+    return {
+        'id': proc.id,
+        'name': proc.name,
+        'owner': getattr(proc, 'owner', None),
+        'template_id': proc.template_id,
+        'template_name': getattr(proc, 'template_name', None),
+        'mtime': _timestamp(getattr(proc, 'mtime', None)),
+        'output_samples': [_sample_fields(sample) for sample in getattr(proc, 'output_samples', None) or []]
+    }
+
+
+def _make_process(fields, project, experiment):
+    proc = Process(data={key: value for key, value in fields.items() if key != 'output_samples'})
+    proc.project = project
+    proc.experiment = experiment
+    proc.output_samples = [_make_sample(sample, project, experiment) for sample in fields['output_samples']]
+    return proc
+
+
+def processes_by_template(container, refresh=None):
+    """
+    Return {template_id: [mcapi.Process, ...]} for every process in a project
+    or experiment, from the cache if possible.
+
+    Processes read from the cache are rebuilt from their id, name, owner,
+    template, mtime and output samples only.
+
+    Arguments:
+
+        container: mcapi.Project or mcapi.Experiment
+
+        refresh: bool, optional
+          Fetch from the server even if cached; default from set_cache_options
+
+    """
+    if refresh is None:
+        refresh = cache_options['refresh']
+    key = _container_key('processes', container)
+    cache = get_cache()
+    if not refresh and cache_options['ttl'] > 0:
+        fields = cache.get(key)
+        if fields is not None:
+            project, experiment = _project_and_experiment(container)
+            return {template_id: [_make_process(f, project, experiment) for f in procs] for template_id, procs in fields.items()}
+    value = {}
+    for proc in get_scheduler().call_idempotent(container.get_all_processes):
+        value.setdefault(proc.template_id, []).append(proc)
+    cache.put(key, {template_id: [_process_fields(proc) for proc in procs] for template_id, procs in value.items()})
+    return value
+
+
+def processes_with_template(container, template_id, refresh=None):
+    """Return the processes in a project or experiment created from template_id"""
+    return list(processes_by_template(container, refresh=refresh).get(template_id, []))
+
+
+def samples_by_id(expt, refresh=None):
+    """Return {sample_id: mcapi.Sample} for every sample in an experiment, from the cache if possible"""
+    if refresh is None:
+        refresh = cache_options['refresh']
+    key = _container_key('samples', expt)
+    cache = get_cache()
+    if not refresh and cache_options['ttl'] > 0:
+        fields = cache.get(key)
+        if fields is not None:
+            return {sample_id: _make_sample(f, expt.project, expt) for sample_id, f in fields.items()}
+    value = {sample.id: sample for sample in get_scheduler().call_idempotent(expt.get_all_samples)}
+    cache.put(key, {sample_id: _sample_fields(sample) for sample_id, sample in value.items()})
+    return value
+
+
+def invalidate(*containers):
+    """Drop cached metadata for projects or experiments that were just modified"""
+    cache = get_cache()
+    for container in containers:
+        cache.invalidate(_container_key('processes', container))
+        cache.invalidate(_container_key('samples', container))
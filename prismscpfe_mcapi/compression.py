@@ -0,0 +1,109 @@
+"""Streaming compression of files before upload"""
+
+import os
+import gzip
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+# Codec name -> extension appended to compressed files. The extension is the
+# only record of the codec of an uploaded copy; a downloaded copy is
+# decompressed with gunzip or zstd -d like any other compressed file
+CODEC_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+_COPY_BLOCK_SIZE = 1 << 20
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compression requires the 'zstandard' package (pip install zstandard)")
+    return zstandard
+
+
+def check_codec(codec):
+    """
+    Raise ValueError for an unknown codec, or ImportError if the package it
+    needs is not installed; call before creating anything on the server
+    """
+    if codec not in CODEC_EXTENSIONS:
+        raise ValueError("Unknown compression codec: " + str(codec))
+    if codec == 'zstd':
+        _zstandard()
+
+
+def remove_compressed(paths):
+    """Delete compressed copies once they are uploaded"""
+    for path in paths:
+        if codec_of(path) is not None and os.path.exists(path):
+            os.remove(path)
+
+
+def compressed_path(path, codec):
+    """Return the path of the compressed copy of path"""
+    return path + CODEC_EXTENSIONS[codec]
+
+
+def codec_of(path):
+    """Return the codec a file was compressed with, from its extension, or None"""
+    for codec, ext in CODEC_EXTENSIONS.items():
+        if path.endswith(ext):
+            return codec
+    return None
+
+
+def compress_file(path, codec, level=None):
+    """
+    Compress path to path + '.gz' or '.zst', streaming in 1 MB blocks.
+
+    The compressed file is reused if it is newer than path.
+
+    Arguments:
+
+        path: str
+
+        codec: str
+          'gzip' or 'zstd'
+
+        level: int, optional
+          Compression level; default 6 for gzip, 3 for zstd
+
+    Returns:
+
+        out_path: str
+          Path of the compressed file
+
+    """
+    out_path = compressed_path(path, codec)
+    if os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(path):
+        return out_path
+    tmp_path = out_path + '.part'
+    with open(path, 'rb') as src:
+        if codec == 'gzip':
+            with gzip.open(tmp_path, 'wb', compresslevel=6 if level is None else level) as dst:
+                shutil.copyfileobj(src, dst, _COPY_BLOCK_SIZE)
+        elif codec == 'zstd':
+            zstandard = _zstandard()
+            cctx = zstandard.ZstdCompressor(level=3 if level is None else level, threads=-1)
+            with open(tmp_path, 'wb') as dst:
+                cctx.copy_stream(src, dst, read_size=_COPY_BLOCK_SIZE, write_size=_COPY_BLOCK_SIZE)
+        else:
+            raise ValueError("Unknown compression codec: " + str(codec))
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def compress_files(paths, codec, workers=4):
+    """
+    Compress several files on a pool of worker threads (zlib and zstd release
+    the GIL while compressing).
+
+    Returns:
+
+        out_paths: list of str
+          Compressed file paths, in the same order as paths
+
+    """
+    with ThreadPoolExecutor(max_workers=max(1, int(workers))) as pool:
+        return list(pool.map(lambda path: compress_file(path, codec), paths))
+
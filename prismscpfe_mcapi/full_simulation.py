@@ -1,14 +1,92 @@
-"""mc prismspf full-simulation subcommand"""
+"""mc prismscpfe full-simulation subcommand"""
 
 import sys
 import argparse
-import prismscpfe_mcapi
-from prismscpfe_mcapi.numerical_parameters import get_parameters_sample
-from materials_commons.cli import ListObjects
+from prismscpfe_mcapi.numerical_parameters import create_parameters_sample
+from prismscpfe_mcapi.grainid import create_GrainId_sample
+from prismscpfe_mcapi.orientations import create_Orientations_sample
+from prismscpfe_mcapi.boundaryconditions import create_BoundaryConditions_sample
+from prismscpfe_mcapi.simulation import create_simulation_sample
+from prismscpfe_mcapi.stages import Stage, run_stages
+from prismscpfe_mcapi.uploads import DEFAULT_UPLOAD_WORKERS
+from prismscpfe_mcapi.scheduler import add_scheduler_options
+from prismscpfe_mcapi.cache import add_cache_options, invalidate
+from prismscpfe_mcapi.tracing import add_profile_options
+from prismscpfe_mcapi.journal import add_resume_options
+from prismscpfe_mcapi.validation import add_validation_options, check_app_directory
 from materials_commons.cli.functions import make_local_project, make_local_expt
 
+# Input processes created before the simulation; all of them are independent
+INPUT_STAGES = ['numerical-parameters', 'GrainId', 'Orientations', 'BoundaryConditions']
+
+
+def _output_samples(proc):
+    if not getattr(proc, 'output_samples', None):
+        proc.decorate_with_output_samples()
+    return list(proc.output_samples)
+
+
+def create_full_simulation(expt, workers=4, upload_workers=DEFAULT_UPLOAD_WORKERS, verbose=False, app_dir='.', resume=False, out=sys.stdout):
+    """
+    Create the numerical parameters, GrainId, Orientations and Boundary
+    Conditions processes concurrently, then the Simulation process with their
+    output samples as inputs.
+
+    Arguments:
+
+        expt: mcapi.Experiment object
+
+        workers: int
+          Maximum number of processes created at the same time
+
+        upload_workers: int
+          Maximum number of files uploaded concurrently per process
+
+        verbose: bool
+          Print messages about uploads, etc.
+
+        app_dir: str
+          PRISMS-CPFE app directory containing the input files, default is the
+          current directory
+
+        resume: bool
+          Continue the last create of each process for app_dir in expt from
+          its last completed step; processes already created are reused
+
+    Returns:
+
+        procs: dict
+          Stage name ('numerical-parameters', 'GrainId', 'Orientations',
+          'BoundaryConditions', 'Simulation') -> mcapi.Process instance
+
+    """
+    def input_stage(name, create_func, **kwargs):
+        def run(results):
+            proc = create_func(expt, verbose=verbose, app_dir=app_dir, resume=resume, **kwargs)
+            out.write('Created process: ' + proc.name + ' ' + proc.id + '\n')
+            return proc
+        return Stage(name, run)
+
+    def simulation_stage(results):
+        sample_list = []
+        for name in INPUT_STAGES:
+            sample_list.extend(_output_samples(results[name]))
+        proc = create_simulation_sample(expt, sample_list, verbose=verbose, upload_workers=upload_workers, app_dir=app_dir, resume=resume)
+        out.write('Created process: ' + proc.name + ' ' + proc.id + '\n')
+        return proc
+
+    stages = [
+        input_stage('numerical-parameters', create_parameters_sample, upload_workers=upload_workers),
+        input_stage('GrainId', create_GrainId_sample),
+        input_stage('Orientations', create_Orientations_sample),
+        input_stage('BoundaryConditions', create_BoundaryConditions_sample),
+        Stage('Simulation', simulation_stage, requires=INPUT_STAGES)
+    ]
+    return run_stages(stages, workers=workers)
+
+
 class FullSimulationSubcommand:
-    desc = "(sample) PRISMS-CPFE Simulation"
+    desc = "(samples) All PRISMS-CPFE input processes and the simulation"
 
     def __init__(self, argv):
 
@@ -21,28 +99,29 @@ class FullSimulationSubcommand:
         num_cores_help = "Add the number of cores to be used in the simulation"
         parser.add_argument('--num-cores', default=-1, help=num_cores_help)
 
+        workers_help = "Maximum number of input processes created concurrently (default: 4)"
+        parser.add_argument('--workers', type=int, default=4, help=workers_help)
 
-        if argv[3] == '--create':
-            self.create(parser, argv)
+        upload_workers_help = "Maximum number of files uploaded concurrently (default: " + str(DEFAULT_UPLOAD_WORKERS) + ")"
+        parser.add_argument('--upload-workers', type=int, default=DEFAULT_UPLOAD_WORKERS, help=upload_workers_help)
+
+        add_validation_options(parser)
+        add_cache_options(parser)
+        add_profile_options(parser)
+        add_scheduler_options(parser)
+        add_resume_options(parser)
+
+        args = parser.parse_args(argv[3:])
+
+        if args.create:
+            self.create(args)
         else:
             parser.print_help()
 
-    def create(self, parser):
-        out = sys.stdout
-
+    def create(self, args, out=sys.stdout):
+        if not args.skip_validation and not check_app_directory('full-simulation', out=out):
+            return
         proj = make_local_project()
         expt = make_local_expt(proj)
-
-        sample_list = []
-
-        proc = prismscpfe_mcapi.numerical_parameters.create_parameters_sample(expt, verbose=True)
-        out.write('Created process: ' + proc.name + ' ' + proc.id + '\n')
-        sample_list.extend(proc.output_samples)
-
-        proc = prismscpfe_mcapi.GrainID.create_GrainID_sample(expt, verbose=True)
-        out.write('Created process: ' + proc.name + ' ' + proc.id + '\n')
-        sample_list.extend(proc.output_samples)
-		
-        proc = prismscpfe_mcapi.Orientations.create_Orientations_sample(expt, verbose=True)
-        out.write('Created process: ' + proc.name + ' ' + proc.id + '\n')
-        sample_list.extend(proc.output_samples)
+        create_full_simulation(expt, workers=args.workers, upload_workers=args.upload_workers, verbose=True, resume=args.resume, out=out)
+        invalidate(expt, proj)
@@ -2,13 +2,23 @@
 
 import sys
 import os.path
+import asyncio
 import subprocess
 import prismscpfe_mcapi
+from prismscpfe_mcapi.aio import get_client, run_sync
+from prismscpfe_mcapi.journal import begin_operation, add_resume_options
+from prismscpfe_mcapi.cache import add_cache_options, invalidate, processes_with_template
+from prismscpfe_mcapi.scheduler import add_scheduler_options
+from prismscpfe_mcapi.tracing import add_profile_options
+from prismscpfe_mcapi.samples import SampleIndex
+from prismscpfe_mcapi.measurements import MeasurementBatch
+from prismscpfe_mcapi.compression import CODEC_EXTENSIONS, check_codec, compress_files, remove_compressed
+from prismscpfe_mcapi.validation import add_validation_options, check_app_directory
 from materials_commons.cli import ListObjects
 from materials_commons.cli.functions import make_local_project, make_local_expt
 
 
-def get_GrainId_sample(expt, GrainId_id=None, out=sys.stdout):
+def get_GrainId_sample(expt, sample_id=None, index=None, out=sys.stdout):
     """
     Return a PRISMS-CPFE GrainId sample from provided Materials Commons
     experiment and optionally explicit sample id. Returns None if sample_id is None
@@ -18,8 +28,11 @@ def get_GrainId_sample(expt, GrainId_id=None, out=sys.stdout):
 
         expt: mcapi.Experiment object
 
-        sample_id: str, optional (default=None)
-          Sample id to use explicitly
+        sample_id: list of str, optional (default=None)
+          Sample id to use explicitly, as sample_id[0]
+
+        index: SampleIndex, optional
+          Index of the experiment samples to reuse; built if not given
 
     Returns:
 
@@ -28,7 +41,7 @@ def get_GrainId_sample(expt, GrainId_id=None, out=sys.stdout):
 
     """
     if sample_id is None:
-        candidate_GrainId = [proc for proc in expt.get_all_processes() if proc.template_id == prismscpfe_mcapi.templates['GrainId']]
+        candidate_GrainId = processes_with_template(expt, prismscpfe_mcapi.templates['GrainId'])
         if len(candidate_GrainId) == 0:
             out.write('Did not find a GrainId sample.\n')
             out.write('Use \'mc prismscpfe GrainId --create\' to create a GrainId sample, or --GrainId-id <id> to specify explicitly.\n')
@@ -45,27 +58,14 @@ def get_GrainId_sample(expt, GrainId_id=None, out=sys.stdout):
         GrainId_proc.decorate_with_output_samples()
         return GrainId_proc.output_samples[0]
     else:
-        # print("The sample id is: ")
-        # print(sample_id[0])
-
-        # This is broken, temporarily replaced by a more complicated work-around
-        # GrainId = expt.get_sample_by_id(sample_id)
-
-        sample_found = False
-        for proc in expt.get_all_processes():
-            for sample in proc.get_all_samples():
-                if sample.id == sample_id[0]:
-                    # print("Sample found with id of: ", sample.id)
-                    GrainId = sample
-                    sample_found = True
-                    break
-            if sample_found:
-                break
+        if index is None:
+            index = SampleIndex(expt)
+        GrainId = index.get(sample_id[0])
 
     return GrainId
 
 
-def create_GrainId_sample(expt, sample_name=None, verbose=False):
+def create_GrainId_sample(expt, sample_name=None, verbose=False, compress=None, statistics=True, binary=None, app_dir='.', resume=False):
     """
     Create a PRISMS-CPFE GrainId Sample
 
@@ -81,31 +81,85 @@ def create_GrainId_sample(expt, sample_name=None, verbose=False):
         verbose: bool
           Print messages about uploads, etc.
 
+        compress: str, optional
+          'gzip' or 'zstd' to upload a compressed copy of GrainId.txt instead
+          (GrainId.txt.gz or GrainId.txt.zst), deleted once uploaded
+
+        statistics: bool
+          Parse the voxel data and add the grain count, per-grain voxel counts
+          and grain size distribution as measurements
+
+        binary: str, optional
+          'none', 'rle' or 'zstd' to also attach a losslessly verified binary
+          copy of GrainId.txt (GrainId.gid) with that compression
+
+        app_dir: str
+          PRISMS-CPFE app directory containing the input files, default is the
+          current directory
+
+        resume: bool
+          Continue the last create of this sample for app_dir in expt, as
+          recorded in the project's operation journal, repeating only the
+          steps that did not complete
+
     Returns:
 
         proc: mcapi.Process instance
           The Process that created the sample
     """
+    return run_sync(create_GrainId_sample_async(expt, sample_name, verbose, compress, statistics, binary, app_dir, resume))
+
+
+async def create_GrainId_sample_async(expt, sample_name=None, verbose=False, compress=None, statistics=True, binary=None, app_dir='.', resume=False, client=None):
+    """Coroutine version of create_GrainId_sample; client defaults to the shared get_client()"""
+    if client is None:
+        client = get_client()
     template_id = prismscpfe_mcapi.templates['GrainId']
+    if compress is not None:
+        check_codec(compress)
+    if binary == 'zstd':
+        check_codec(binary)
+
+    operation = begin_operation(expt, 'GrainId', app_dir, resume)
+    if operation.finished:
+        print("Already created: process " + operation.process_id)
+        operation.journal.close()
+        return await client.get_process(expt, operation.process_id)
 
     print("The template ID is: " + template_id)
 
-    file_name = "GrainId.txt"
-    proc = expt.create_process_from_template(template_id)
-    proc.rename('GrainId Input')
-    
+    # imported here so that NumPy is only loaded when a sample is created
+    from prismscpfe_mcapi.grainid_data import GrainId_file_statistics, add_GrainId_measurements
+    from prismscpfe_mcapi.grainid_binary import convert_GrainId
+
+    file_name = os.path.join(app_dir, "GrainId.txt")
+    upload_names = [file_name]
+    if binary is not None:
+        # converted first so the statistics below are read from the binary copy
+        upload_names.append(convert_GrainId(file_name, compression=binary))
+    if statistics:
+        header, stats = GrainId_file_statistics(file_name)
+
     if sample_name is None:
         sample_name = "GrainId Input"
-    new_sample = proc.create_samples([sample_name])
-    proc = expt.get_process_by_id(proc.id)
-    GrainId_file = expt.project.add_file_by_local_path(file_name, verbose=verbose)
-    proc.add_files([GrainId_file])
-    
-  
+    proc, new_sample = await client.create_process(expt, template_id, 'GrainId Input', [sample_name], operation=operation)
+
+    batch = MeasurementBatch(expt, proc, samples=new_sample)
+    if statistics:
+        add_GrainId_measurements(batch, header, stats)
+
+    if compress is not None:
+        upload_names = compress_files([file_name], compress) + upload_names[1:]
+
+    # the measurements and the files do not depend on each other
+    await asyncio.gather(client.upload_and_attach(expt.project, proc, upload_names, operation=operation, verbose=verbose), client.flush(batch, operation))
+    if compress is not None:
+        remove_compressed(upload_names[:1])
 
         # new_sample_list[-1][0].pretty_print(shift=0, indent=2, out=sys.stdout)
 
-    return expt.get_process_by_id(proc.id)
+    operation.finish()
+    return await client.get_process(expt, proc.id)
 
 
 class GrainIdSubcommand(ListObjects):
@@ -115,21 +169,37 @@ class GrainIdSubcommand(ListObjects):
         super(GrainIdSubcommand, self).__init__(["prismscpfe", "GrainId"], "GrainId", "GrainId", desc="Creates a set of entities (samples) representing the GrainId.", expt_member=True, list_columns=['name', 'owner', 'template_name', 'id', 'mtime'], creatable=True)
 
     def get_all_from_experiment(self, expt):
-        return [proc for proc in expt.get_all_processes() if proc.template_id == prismscpfe_mcapi.templates[self.cmdname[-1]]]
+        return processes_with_template(expt, prismscpfe_mcapi.templates[self.cmdname[-1]])
 
     def get_all_from_project(self, proj):
-        return [proc for proc in proj.get_all_processes() if proc.template_id == prismscpfe_mcapi.templates[self.cmdname[-1]]]
+        return processes_with_template(proj, prismscpfe_mcapi.templates[self.cmdname[-1]])
 
     def create(self, args, out=sys.stdout):
+        if not args.skip_validation and not check_app_directory('GrainId', out=out):
+            return
         proj = make_local_project()
         expt = make_local_expt(proj)
-        proc = create_GrainId_sample(expt, verbose=True)
+        proc = create_GrainId_sample(expt, verbose=True, compress=args.compress, statistics=not args.no_statistics, binary=args.binary, resume=args.resume)
+        invalidate(expt, proj)
         out.write('Created process: ' + proc.name + ' ' + proc.id + '\n')
 
 
     def add_create_options(self, parser):
-        """
-        """
+        compress_help = "Upload GrainId.txt compressed with the given codec"
+        parser.add_argument('--compress', choices=sorted(CODEC_EXTENSIONS), default=None, help=compress_help)
+
+        binary_help = "Also upload a binary copy of GrainId.txt (GrainId.gid) with the given compression"
+        # grainid_binary.COMPRESSIONS, not imported here to keep NumPy out of CLI startup
+        parser.add_argument('--binary', choices=['none', 'rle', 'zstd'], default=None, help=binary_help)
+
+        no_statistics_help = "Do not parse GrainId.txt for grain statistics measurements"
+        parser.add_argument('--no-statistics', action="store_true", default=False, help=no_statistics_help)
+
+        add_validation_options(parser)
+        add_cache_options(parser)
+        add_profile_options(parser)
+        add_scheduler_options(parser)
+        add_resume_options(parser)
 
     def list_data(self, obj):
         return {
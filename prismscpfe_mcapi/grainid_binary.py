@@ -0,0 +1,263 @@
+"""Compact binary format for GrainId voxel fields
+
+Layout of a .gid file:
+
+    bytes 0-7       magic b'PCPFEGID'
+    bytes 8-11      format version (uint32, little endian)
+    bytes 12-63     zero padding
+    bytes 64-       data section
+    ...             JSON metadata (utf-8)
+    last 16 bytes   metadata length (uint64, little endian), magic b'PCPFEGID'
+
+The metadata holds the GrainId header lines, dimensions, array shape and
+dtype, the compression ('none', 'rle' or 'zstd') and a table of chunks
+[offset, nbytes, nvalues, nruns]. With compression 'none' the data section is
+the raw array in C order starting at byte 64, so it can be memory-mapped.
+'rle' chunks store the run values followed by uint32 run lengths; 'zstd'
+chunks are the raw array bytes compressed with zstandard.
+"""
+
+import os
+import json
+import shutil
+import struct
+import tempfile
+import numpy as np
+from prismscpfe_mcapi.grainid_data import MMAP_THRESHOLD_VOXELS, read_GrainId_header, load_GrainId
+from prismscpfe_mcapi.compression import _zstandard
+
+MAGIC = b'PCPFEGID'
+FORMAT_VERSION = 1
+DATA_OFFSET = 64
+COMPRESSIONS = ['none', 'rle', 'zstd']
+
+# Voxels per compressed chunk
+CHUNK_VALUES = 16 * 1024 * 1024
+
+_FOOTER = struct.Struct('<Q8s')
+
+
+def binary_path(file_name):
+    """Path of the binary copy of a GrainId text file, e.g. GrainId.gid"""
+    return os.path.splitext(file_name)[0] + '.gid'
+
+
+def _smallest_dtype(grain_ids):
+    if grain_ids.size == 0:
+        return np.dtype('<u1')
+    lo, hi = int(grain_ids.min()), int(grain_ids.max())
+    for dtype in ['<u1', '<u2', '<u4'] if lo >= 0 else ['<i1', '<i2', '<i4']:
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return np.dtype(dtype)
+    return np.dtype('<i8')
+
+
+def write_GrainId_binary(out_path, grain_ids, header, compression='rle'):
+    """
+    Write a GrainId array and its text header to a .gid file.
+
+    Arguments:
+
+        out_path: str
+
+        grain_ids: numpy.ndarray of integers
+          The voxel array, as returned by load_GrainId
+
+        header: dict
+          Result of read_GrainId_header
+
+        compression: str
+          'none' (memory-mappable), 'rle' or 'zstd'
+
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError("Unknown compression: " + str(compression))
+    dtype = _smallest_dtype(grain_ids)
+    flat = grain_ids.reshape(-1)
+    chunks = []
+    if compression == 'zstd':
+        cctx = _zstandard().ZstdCompressor(level=3)
+    tmp_path = out_path + '.part'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', FORMAT_VERSION))
+        f.write(b'\0' * (DATA_OFFSET - f.tell()))
+        for start in range(0, max(len(flat), 1), CHUNK_VALUES):
+            values = flat[start:start+CHUNK_VALUES].astype(dtype)
+            offset = f.tell()
+            nruns = 0
+            if compression == 'none':
+                f.write(values.tobytes())
+            elif compression == 'rle':
+                starts = np.concatenate(([0], np.flatnonzero(np.diff(values)) + 1)) if len(values) else np.zeros(0, np.int64)
+                lengths = np.diff(np.append(starts, len(values))).astype('<u4')
+                f.write(values[starts].tobytes())
+                f.write(lengths.tobytes())
+                nruns = len(starts)
+            else:
+                f.write(cctx.compress(values.tobytes()))
+            chunks.append([offset, f.tell() - offset, len(values), nruns])
+
+        metadata = {
+            'header_lines': header['lines'],
+            'dimensions': list(header['dimensions']) if header['dimensions'] is not None else None,
+            'shape': list(grain_ids.shape),
+            'dtype': dtype.str,
+            'compression': compression,
+            'chunks': chunks
+        }
+        data = json.dumps(metadata).encode('utf-8')
+        f.write(data)
+        f.write(_FOOTER.pack(len(data), MAGIC))
+    os.replace(tmp_path, out_path)
+
+
+def read_GrainId_binary_metadata(file_name):
+    """Return the metadata dict of a .gid file"""
+    with open(file_name, 'rb') as f:
+        if f.read(8) != MAGIC:
+            raise ValueError(file_name + ": not a binary GrainId file")
+        version = struct.unpack('<I', f.read(4))[0]
+        if version > FORMAT_VERSION:
+            raise ValueError(file_name + ": unsupported binary GrainId format version " + str(version))
+        f.seek(-_FOOTER.size, os.SEEK_END)
+        length, magic = _FOOTER.unpack(f.read(_FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError(file_name + ": truncated binary GrainId file")
+        f.seek(-_FOOTER.size - length, os.SEEK_END)
+        return json.loads(f.read(length).decode('utf-8'))
+
+
+def read_GrainId_binary(file_name, mmap=True):
+    """
+    Read a .gid file.
+
+    Arguments:
+
+        file_name: str
+
+        mmap: bool
+          For uncompressed files, return a read-only memory map instead of
+          reading the array into memory
+
+    Returns:
+
+        header: dict
+          'lines', 'dimensions', 'shape' as returned by read_GrainId_header
+
+        grain_ids: numpy.ndarray
+          The voxel array, in the smallest integer dtype that holds all ids
+
+    """
+    metadata = read_GrainId_binary_metadata(file_name)
+    header = {
+        'lines': metadata['header_lines'],
+        'dimensions': tuple(metadata['dimensions']) if metadata['dimensions'] is not None else None,
+        'shape': tuple(metadata['shape'])
+    }
+    dtype = np.dtype(metadata['dtype'])
+    n = int(np.prod(header['shape']))
+    compression = metadata['compression']
+
+    if compression == 'none' and mmap:
+        if n == 0:
+            return header, np.zeros(header['shape'], dtype=dtype)
+        return header, np.memmap(file_name, dtype=dtype, mode='r', offset=DATA_OFFSET, shape=header['shape'])
+
+    out = np.empty(n, dtype=dtype)
+    pos = 0
+    for start, values in iter_GrainId_binary_chunks(file_name, metadata):
+        out[start:start+len(values)] = values
+        pos = start + len(values)
+    if pos != n:
+        raise ValueError(file_name + ": chunks hold " + str(pos) + " values, shape gives " + str(n))
+    return header, out.reshape(header['shape'])
+
+
+def iter_GrainId_binary_chunks(file_name, metadata=None):
+    """
+    Yield (position, values) for each chunk of a .gid file, position being
+    the index of its first value in the flattened array, reading one chunk
+    at a time
+    """
+    if metadata is None:
+        metadata = read_GrainId_binary_metadata(file_name)
+    dtype = np.dtype(metadata['dtype'])
+    compression = metadata['compression']
+    if compression == 'zstd':
+        dctx = _zstandard().ZstdDecompressor()
+    pos = 0
+    with open(file_name, 'rb') as f:
+        for offset, nbytes, nvalues, nruns in metadata['chunks']:
+            f.seek(offset)
+            data = f.read(nbytes)
+            if compression == 'none':
+                values = np.frombuffer(data, dtype=dtype)
+            elif compression == 'rle':
+                runs = np.frombuffer(data, dtype=dtype, count=nruns)
+                lengths = np.frombuffer(data, dtype='<u4', count=nruns, offset=nruns * dtype.itemsize)
+                values = np.repeat(runs, lengths)
+            else:
+                values = np.frombuffer(dctx.decompress(data, max_output_size=nvalues * dtype.itemsize), dtype=dtype)
+            yield pos, values
+            pos += nvalues
+
+
+def _matches_GrainId(file_name, header, grain_ids):
+    """True if a .gid file holds header and grain_ids, compared one chunk at a time"""
+    metadata = read_GrainId_binary_metadata(file_name)
+    if metadata['header_lines'] != header['lines'] or tuple(metadata['shape']) != grain_ids.shape:
+        return False
+    flat = grain_ids.reshape(-1)
+    pos = 0
+    for start, values in iter_GrainId_binary_chunks(file_name, metadata):
+        if not np.array_equal(values, flat[start:start+len(values)]):
+            return False
+        pos = start + len(values)
+    return pos == len(flat)
+
+
+def convert_GrainId(file_name, out_path=None, compression='rle', verify=True):
+    """
+    Convert a GrainId text file to the binary format.
+
+    Arguments:
+
+        file_name: str
+
+        out_path: str, optional
+          Default is binary_path(file_name)
+
+        compression: str
+          'none', 'rle' or 'zstd'
+
+        verify: bool
+          Read the written file back, one chunk at a time, and check that it
+          is identical to the text file; raises ValueError if it is not
+
+    Returns:
+
+        out_path: str
+
+    """
+    if out_path is None:
+        out_path = binary_path(file_name)
+    header = read_GrainId_header(file_name)
+    # large volumes are parsed into a memory map, as in GrainId_file_statistics
+    tmpdir = None
+    mmap_path = None
+    if header['shape'] is not None and np.prod(header['shape']) > MMAP_THRESHOLD_VOXELS:
+        tmpdir = tempfile.mkdtemp(prefix='prismscpfe_grainid_')
+        mmap_path = os.path.join(tmpdir, 'GrainId.npy')
+    try:
+        grain_ids = load_GrainId(file_name, header=header, mmap_path=mmap_path)
+        write_GrainId_binary(out_path, grain_ids, header, compression=compression)
+        if verify and not _matches_GrainId(out_path, header, grain_ids):
+            os.remove(out_path)
+            raise ValueError(out_path + ": binary GrainId does not match " + file_name)
+        del grain_ids
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    return out_path
+
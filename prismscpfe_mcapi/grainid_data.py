@@ -0,0 +1,233 @@
+"""Vectorized reading and statistics of PRISMS-CPFE GrainId voxel files"""
+
+import os
+import re
+import shutil
+import tempfile
+import numpy as np
+from prismscpfe_mcapi.tracing import traced
+
+# Volumes with more voxels than this are parsed into a memory-mapped array
+MMAP_THRESHOLD_VOXELS = 64 * 1024 * 1024
+
+# Grain ids and voxel counts are recorded per grain for at most this many
+# grains; larger volumes get only their summary statistics
+MAX_GRAIN_VECTOR_LENGTH = 1000
+
+# Bytes of text parsed per block
+_PARSE_BLOCK_SIZE = 16 * 1024 * 1024
+
+_DIMENSIONS_RE = re.compile(r"\[\s*(\d+)\s*x\s*(\d+)\s*x\s*(\d+)\s*\]")
+_ARRAY_RE = re.compile(r"array of\s+(\d+)\s*x\s*(\d+)")
+_HEADER_COUNT_RE = re.compile(r"header lines\s*=\s*(\d+)", re.IGNORECASE)
+
+# (path, mtime, size, bins) -> (header, statistics) of files already read in this process
+_statistics_cache = {}
+
+
+def read_GrainId_header(file_name):
+    """
+    Read the header of a GrainId file, e.g.
+
+        **Total header lines = 5
+        **Grain ID File
+        **3D Volume has dimensions [20 x 20 x 22] voxels
+        **Data arranged in a 2D array of 400 x 22 integer values
+        **
+
+    Returns:
+
+        header: dict
+          'lines': list of header lines (without line endings),
+          'dimensions': (nx, ny, nz) or None if not given,
+          'shape': (rows, columns) of the data block or None if not given
+
+    """
+    lines = []
+    n_header = None
+    with open(file_name) as f:
+        for line in f:
+            if n_header is None and not line.startswith('**'):
+                break
+            lines.append(line.rstrip('\r\n'))
+            if n_header is None:
+                match = _HEADER_COUNT_RE.search(line)
+                if match:
+                    n_header = int(match.group(1))
+            if n_header is not None and len(lines) >= n_header:
+                break
+
+    header = {'lines': lines, 'dimensions': None, 'shape': None}
+    for line in lines:
+        match = _DIMENSIONS_RE.search(line)
+        if match and header['dimensions'] is None:
+            header['dimensions'] = tuple(int(g) for g in match.groups())
+        match = _ARRAY_RE.search(line)
+        if match and header['shape'] is None:
+            header['shape'] = tuple(int(g) for g in match.groups())
+    if header['shape'] is None and header['dimensions'] is not None:
+        nx, ny, nz = header['dimensions']
+        header['shape'] = (nx * ny, nz)
+    return header
+
+
+@traced('parse')
+def load_GrainId(file_name, header=None, mmap_path=None):
+    """
+    Read the voxel block of a GrainId file into an int32 array of the shape
+    given in its header, parsing the text in large blocks with NumPy.
+
+    Arguments:
+
+        file_name: str
+
+        header: dict, optional
+          Result of read_GrainId_header, read if not given
+
+        mmap_path: str, optional
+          If given, the array is written to this .npy file and returned
+          memory-mapped instead of being held in memory
+
+    Returns:
+
+        grain_ids: numpy.ndarray of int32, shape header['shape']
+
+    """
+    if header is None:
+        header = read_GrainId_header(file_name)
+    if header['shape'] is None:
+        raise ValueError(file_name + ": header does not give the volume dimensions")
+    n = int(np.prod(header['shape']))
+
+    if mmap_path is not None:
+        out = np.lib.format.open_memmap(mmap_path, mode='w+', dtype=np.int32, shape=(n,))
+    else:
+        out = np.empty(n, dtype=np.int32)
+
+    count = 0
+    with open(file_name, 'rb') as f:
+        for i in range(len(header['lines'])):
+            f.readline()
+        while True:
+            block = f.read(_PARSE_BLOCK_SIZE)
+            if not block:
+                break
+            # do not split a number between blocks
+            if not block[-1:].isspace():
+                block += f.readline()
+            values = np.fromstring(block, dtype=np.int32, sep=' ')
+            if count + len(values) > n:
+                raise ValueError(file_name + ": more values than the " + str(n) + " given in the header")
+            out[count:count+len(values)] = values
+            count += len(values)
+
+    if count != n:
+        raise ValueError(file_name + ": found " + str(count) + " values, header gives " + str(n))
+    return out.reshape(header['shape'])
+
+
+def GrainId_statistics(grain_ids, bins=20):
+    """
+    Compute grain statistics of a GrainId volume.
+
+    Arguments:
+
+        grain_ids: numpy.ndarray of non-negative integers
+
+        bins: int
+          Number of bins of the grain size distribution
+
+    Returns:
+
+        stats: dict
+          'voxel_count': total number of voxels,
+          'grain_count': number of distinct grain ids,
+          'grain_ids': ids present, ascending,
+          'grain_voxel_counts': voxels per grain, aligned with grain_ids,
+          'min_grain_size', 'max_grain_size', 'mean_grain_size',
+          'median_grain_size': grain sizes in voxels,
+          'size_histogram_counts', 'size_histogram_edges': grain size distribution
+
+    """
+    flat = grain_ids.ravel()
+    if flat.size and flat.min() < 0:
+        raise ValueError("Grain ids must be non-negative")
+    counts = np.bincount(flat)
+    ids = np.flatnonzero(counts)
+    sizes = counts[ids]
+    hist_counts, hist_edges = np.histogram(sizes, bins=bins)
+    return {
+        'voxel_count': int(flat.size),
+        'grain_count': int(len(ids)),
+        'grain_ids': ids,
+        'grain_voxel_counts': sizes,
+        'min_grain_size': int(sizes.min()) if len(sizes) else 0,
+        'max_grain_size': int(sizes.max()) if len(sizes) else 0,
+        'mean_grain_size': float(sizes.mean()) if len(sizes) else 0.0,
+        'median_grain_size': float(np.median(sizes)) if len(sizes) else 0.0,
+        'size_histogram_counts': hist_counts,
+        'size_histogram_edges': hist_edges
+    }
+
+
+def GrainId_file_statistics(file_name, bins=20):
+    """
+    Read a GrainId file and return (header, statistics), memory-mapping the
+    voxel array in a temporary directory for volumes above MMAP_THRESHOLD_VOXELS.
+
+    Results are kept for the lifetime of the process, so validating and then
+    creating a GrainId sample parses the file only once. If an up to date
+    binary copy (see grainid_binary) exists it is read instead of the text.
+    """
+    from prismscpfe_mcapi.grainid_binary import binary_path, read_GrainId_binary
+
+    st = os.stat(file_name)
+    key = (os.path.abspath(file_name), st.st_mtime_ns, st.st_size, bins)
+    if key in _statistics_cache:
+        return _statistics_cache[key]
+
+    bin_path = binary_path(file_name)
+    if os.path.exists(bin_path) and os.path.getmtime(bin_path) >= st.st_mtime:
+        header, grain_ids = read_GrainId_binary(bin_path)
+        stats = GrainId_statistics(grain_ids, bins=bins)
+        _statistics_cache[key] = (header, stats)
+        return header, stats
+
+    header = read_GrainId_header(file_name)
+    if header['shape'] is not None and np.prod(header['shape']) > MMAP_THRESHOLD_VOXELS:
+        tmpdir = tempfile.mkdtemp(prefix='prismscpfe_grainid_')
+        try:
+            grain_ids = load_GrainId(file_name, header=header, mmap_path=os.path.join(tmpdir, 'GrainId.npy'))
+            stats = GrainId_statistics(grain_ids, bins=bins)
+            del grain_ids
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    else:
+        stats = GrainId_statistics(load_GrainId(file_name, header=header), bins=bins)
+    _statistics_cache[key] = (header, stats)
+    return header, stats
+
+
+def add_GrainId_measurements(batch, header, stats):
+    """
+    Queue the GrainId header dimensions and grain statistics on a
+    MeasurementBatch; the ids and voxel counts of each grain only up to
+    MAX_GRAIN_VECTOR_LENGTH grains
+    """
+    if header['dimensions'] is not None:
+        for axis, n in zip('XYZ', header['dimensions']):
+            batch.add_integer('Voxels in ' + axis + ' direction', n)
+    batch.add_integer('Number of voxels', stats['voxel_count'])
+    batch.add_integer('Number of grains', stats['grain_count'])
+    batch.add_integer('Minimum grain size', stats['min_grain_size'], unit='voxels')
+    batch.add_integer('Maximum grain size', stats['max_grain_size'], unit='voxels')
+    batch.add_number('Mean grain size', stats['mean_grain_size'], unit='voxels')
+    batch.add_number('Median grain size', stats['median_grain_size'], unit='voxels')
+    if stats['grain_count']:
+        batch.add_integer('Minimum grain id', int(stats['grain_ids'][0]))
+        batch.add_integer('Maximum grain id', int(stats['grain_ids'][-1]))
+    if stats['grain_count'] <= MAX_GRAIN_VECTOR_LENGTH:
+        batch.add_vector('Grain ids', stats['grain_ids'].tolist(), otype='integer')
+        batch.add_vector('Grain voxel counts', stats['grain_voxel_counts'].tolist(), unit='voxels', otype='integer')
+    batch.add_vector('Grain size distribution counts', stats['size_histogram_counts'].tolist(), otype='integer')
+    batch.add_vector('Grain size distribution bin edges', stats['size_histogram_edges'].tolist(), unit='voxels')
@@ -0,0 +1,252 @@
+"""mc prismscpfe ingest subcommand: create every PRISMS-CPFE run found under a directory tree"""
+
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from prismscpfe_mcapi import grainid_data, orientation_data
+from prismscpfe_mcapi.prismscpfe_parameter_parser import ParameterIndex
+from prismscpfe_mcapi.grainid_data import GrainId_file_statistics
+from prismscpfe_mcapi.orientation_data import process_orientations_file
+from prismscpfe_mcapi.full_simulation import create_full_simulation
+from prismscpfe_mcapi.uploads import DEFAULT_UPLOAD_WORKERS, set_upload_pool
+from prismscpfe_mcapi.scheduler import add_scheduler_options
+from prismscpfe_mcapi.cache import add_cache_options, invalidate
+from prismscpfe_mcapi.tracing import add_profile_options
+from prismscpfe_mcapi.validation import add_validation_options, validate_app_directory, write_report
+from materials_commons.cli.functions import make_local_project, make_local_expt
+
+# Default number of runs whose processes are created at the same time
+DEFAULT_RUN_WORKERS = 4
+
+
+def find_run_directories(root):
+    """Return the directories under root (including root) that contain a parameters.in, sorted"""
+    run_dirs = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        if 'parameters.in' in filenames:
+            run_dirs.append(dirpath)
+    return run_dirs
+
+
+def parse_run_directory(app_dir):
+    """
+    Validate and parse the inputs of one run directory. Run in a worker
+    process; the parsed results are returned so that install_parsed can make
+    them available to create_full_simulation in the parent process.
+
+    Returns:
+
+        parsed: dict
+          'app_dir': str,
+          'errors': list of validation errors,
+          'caches': list of (cache name, entries) parsed in this process
+
+    """
+    ParameterIndex._cache.clear()
+    grainid_data._statistics_cache.clear()
+    orientation_data._summary_cache.clear()
+
+    errors = validate_app_directory(app_dir)
+    for file_name, parse in [('GrainId.txt', GrainId_file_statistics), ('orientations.txt', process_orientations_file)]:
+        path = os.path.join(app_dir, file_name)
+        if os.path.exists(path):
+            try:
+                parse(path)
+            except (IOError, OSError, ValueError):
+                # already reported by validation
+                pass
+
+    return {
+        'app_dir': app_dir,
+        'errors': errors,
+        'caches': [
+            ('parameters', dict(ParameterIndex._cache)),
+            ('GrainId', dict(grainid_data._statistics_cache)),
+            ('orientations', dict(orientation_data._summary_cache))
+        ]
+    }
+
+
+def install_parsed(parsed):
+    """Add the results of parse_run_directory to the caches of this process"""
+    caches = {
+        'parameters': ParameterIndex._cache,
+        'GrainId': grainid_data._statistics_cache,
+        'orientations': orientation_data._summary_cache
+    }
+    for name, entries in parsed['caches']:
+        caches[name].update(entries)
+
+
+def _create_run(proj, root, app_dir, expt=None, upload_workers=DEFAULT_UPLOAD_WORKERS, out=sys.stdout):
+    if expt is None:
+        name = os.path.relpath(os.path.abspath(app_dir), os.path.abspath(os.path.join(root, os.pardir)))
+        expt = proj.create_experiment(name, 'PRISMS-CPFE run ' + os.path.abspath(app_dir))
+    procs = create_full_simulation(expt, upload_workers=upload_workers, app_dir=app_dir, out=out)
+    return expt, procs
+
+
+def ingest(proj, root, jobs=None, workers=DEFAULT_RUN_WORKERS, upload_workers=DEFAULT_UPLOAD_WORKERS, expt=None, validate=True, dry_run=False, out=sys.stdout):
+    """
+    Create the processes and samples of every PRISMS-CPFE run under root.
+
+    Run directories are parsed on a pool of worker processes. As each one is
+    parsed, its processes are created on a pool of threads, and all of their
+    file uploads go through one shared upload pool.
+
+    Arguments:
+
+        proj: mcapi.Project object
+
+        root: str
+          Directory tree, inside proj.local_path, searched for run directories
+
+        jobs: int, optional
+          Number of worker processes parsing inputs, default is the CPU count
+
+        workers: int
+          Maximum number of runs created concurrently
+
+        upload_workers: int
+          Maximum number of files uploaded concurrently, over all runs
+
+        expt: mcapi.Experiment object, optional
+          Experiment for all runs; by default each run gets a new experiment
+          named after its directory
+
+        validate: bool
+          Skip runs whose inputs are inconsistent
+
+        dry_run: bool
+          Only find, parse and validate the run directories
+
+    Returns:
+
+        results: list of dict
+          One per run directory, sorted by directory: 'app_dir', 'status'
+          ('created', 'parsed', 'skipped' or 'failed'), 'errors' (list of str),
+          'processes' (number of processes created)
+
+    """
+    run_dirs = find_run_directories(root)
+    out.write('Found ' + str(len(run_dirs)) + ' run directories under ' + root + '\n')
+    results = {app_dir: {'app_dir': app_dir, 'status': 'failed', 'errors': [], 'processes': 0} for app_dir in run_dirs}
+    if not len(run_dirs):
+        return []
+
+    upload_pool = ThreadPoolExecutor(max_workers=max(1, int(upload_workers)))
+    set_upload_pool(upload_pool)
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as parse_pool, ThreadPoolExecutor(max_workers=max(1, int(workers))) as create_pool:
+            parse_futures = {parse_pool.submit(parse_run_directory, app_dir): app_dir for app_dir in run_dirs}
+            create_futures = {}
+            for future in as_completed(parse_futures):
+                app_dir = parse_futures[future]
+                result = results[app_dir]
+                try:
+                    parsed = future.result()
+                except Exception as e:
+                    result['errors'] = ['parsing failed: ' + str(e)]
+                    continue
+                result['errors'] = parsed['errors']
+                if validate and len(parsed['errors']):
+                    result['status'] = 'skipped'
+                    continue
+                if dry_run:
+                    result['status'] = 'parsed'
+                    continue
+                install_parsed(parsed)
+                create_futures[create_pool.submit(_create_run, proj, root, app_dir, expt, upload_workers, out)] = app_dir
+
+            for future in as_completed(create_futures):
+                result = results[create_futures[future]]
+                try:
+                    run_expt, procs = future.result()
+                    result['status'] = 'created'
+                    result['processes'] = len(procs)
+                    invalidate(run_expt)
+                except Exception as e:
+                    result['errors'].append('create failed: ' + str(e))
+    finally:
+        set_upload_pool(None)
+        upload_pool.shutdown()
+
+    if not dry_run:
+        invalidate(proj)
+    return [results[app_dir] for app_dir in run_dirs]
+
+
+def write_summary(results, elapsed, out=sys.stdout):
+    """Write the number of runs per status, and the problems of runs not created"""
+    out.write('\n')
+    for status in ['created', 'parsed', 'skipped', 'failed']:
+        runs = [r for r in results if r['status'] == status]
+        if len(runs):
+            out.write('{:8} {:6d} run(s)\n'.format(status, len(runs)))
+    out.write('processes created: ' + str(sum(r['processes'] for r in results)) + '\n')
+    out.write('elapsed: {:.1f} s\n'.format(elapsed))
+    for r in results:
+        if r['status'] in ('skipped', 'failed'):
+            out.write('\n' + r['app_dir'] + ' (' + r['status'] + '):\n')
+            write_report(r['errors'], out)
+
+
+class IngestSubcommand:
+    desc = "Create all PRISMS-CPFE runs under a directory"
+
+    def __init__(self, argv):
+
+        parser = argparse.ArgumentParser(
+            description='Finds every PRISMS-CPFE run directory (containing parameters.in) under a directory tree and creates its input processes, samples and simulation process',
+            prog='mc prismscpfe ingest')
+
+        parser.add_argument('root', help='Directory tree to search, inside the Materials Commons project')
+
+        jobs_help = "Number of worker processes parsing input files (default: number of CPUs)"
+        parser.add_argument('--jobs', '-j', type=int, default=None, help=jobs_help)
+
+        workers_help = "Maximum number of runs created concurrently (default: " + str(DEFAULT_RUN_WORKERS) + ")"
+        parser.add_argument('--workers', type=int, default=DEFAULT_RUN_WORKERS, help=workers_help)
+
+        upload_workers_help = "Maximum number of files uploaded concurrently, over all runs (default: " + str(DEFAULT_UPLOAD_WORKERS) + ")"
+        parser.add_argument('--upload-workers', type=int, default=DEFAULT_UPLOAD_WORKERS, help=upload_workers_help)
+
+        single_experiment_help = "Add all runs to the current experiment instead of creating an experiment per run"
+        parser.add_argument('--single-experiment', action="store_true", default=False, help=single_experiment_help)
+
+        sweep_help = "The runs are a parametric sweep: add them all to the current experiment, and create each numerical parameters, GrainId, Orientations and Boundary Conditions process once per distinct input, shared by every run using it"
+        parser.add_argument('--sweep', action="store_true", default=False, help=sweep_help)
+
+        dry_run_help = "Only find, parse and validate the run directories"
+        parser.add_argument('--dry-run', action="store_true", default=False, help=dry_run_help)
+
+        add_validation_options(parser)
+        add_cache_options(parser)
+        add_profile_options(parser)
+        add_scheduler_options(parser)
+
+        args = parser.parse_args(argv[3:])
+        self.ingest(args)
+
+    def ingest(self, args, out=sys.stdout):
+        start = time.time()
+        proj = None
+        expt = None
+        if not args.dry_run:
+            proj = make_local_project()
+            if args.single_experiment or args.sweep:
+                expt = make_local_expt(proj)
+        if args.sweep:
+            from prismscpfe_mcapi.sweep import sweep_ingest, write_unique_inputs
+            results, unique = sweep_ingest(proj, expt, args.root, jobs=args.jobs, workers=args.workers, upload_workers=args.upload_workers,
+                validate=not args.skip_validation, dry_run=args.dry_run, out=out)
+            write_unique_inputs(unique, out)
+        else:
+            results = ingest(proj, args.root, jobs=args.jobs, workers=args.workers, upload_workers=args.upload_workers,
+                expt=expt, validate=not args.skip_validation, dry_run=args.dry_run, out=out)
+        write_summary(results, time.time() - start, out)
+        if any(r['status'] == 'failed' for r in results):
+            exit(1)
@@ -0,0 +1,208 @@
+"""Local journal of the completed steps of create operations, for --resume"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+JOURNAL_NAME = "prismscpfe_journal.sqlite"
+
+
+def add_resume_options(parser):
+    """Add --resume to a subcommand argument parser"""
+    resume_help = "Continue the last create of this command in this experiment and app directory from the last completed step, instead of creating a new process"
+    parser.add_argument('--resume', action="store_true", default=False, help=resume_help)
+
+
+class OperationJournal(object):
+    """
+    SQLite journal of create operations, each identified by a key naming the
+    command, experiment and app directory. For each operation it stores the
+    process and output sample ids, the named steps completed (e.g. 'rename',
+    'measurements') and, for each local file, its uploaded file id and
+    whether it was attached to the process and linked to the samples.
+
+    Every step is written as soon as it completes, so after a failure a
+    resumed operation repeats only the steps that were not recorded.
+
+    Safe to use from several threads.
+
+    Arguments:
+
+        db_path: str
+          Path to the SQLite database, created if it does not exist
+
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS operations ("
+                " key TEXT PRIMARY KEY,"
+                " process_id TEXT,"
+                " sample_ids TEXT,"
+                " steps TEXT NOT NULL,"
+                " finished INTEGER NOT NULL,"
+                " updated REAL NOT NULL)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS operation_files ("
+                " key TEXT NOT NULL,"
+                " path TEXT NOT NULL,"
+                " file_id TEXT NOT NULL,"
+                " attached INTEGER NOT NULL,"
+                " linked INTEGER NOT NULL,"
+                " PRIMARY KEY (key, path))")
+
+    @classmethod
+    def for_project(cls, proj):
+        """Open the journal stored in the .materialscommons directory of a local project"""
+        return cls(os.path.join(proj.local_path, '.materialscommons', JOURNAL_NAME))
+
+    def begin(self, key, resume=False):
+        """
+        Return the Operation for key. If resume is False, or there is no
+        journal entry for key, any previous entry is discarded and a new
+        operation is started.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT process_id, sample_ids, steps, finished FROM operations WHERE key=?", (key,)).fetchone()
+            if resume and row is not None:
+                files = {}
+                for path, file_id, attached, linked in self._conn.execute(
+                        "SELECT path, file_id, attached, linked FROM operation_files WHERE key=?", (key,)):
+                    files[path] = {'file_id': file_id, 'attached': bool(attached), 'linked': bool(linked)}
+                return Operation(self, key, row[0], json.loads(row[1] or '[]'), set(json.loads(row[2])), bool(row[3]), files)
+            with self._conn:
+                self._conn.execute("DELETE FROM operation_files WHERE key=?", (key,))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO operations (key, process_id, sample_ids, steps, finished, updated) VALUES (?, NULL, NULL, '[]', 0, ?)",
+                    (key, time.time()))
+        return Operation(self, key)
+
+    def _update(self, key, **columns):
+        columns['updated'] = time.time()
+        names = sorted(columns)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE operations SET " + ", ".join(name + "=?" for name in names) + " WHERE key=?",
+                [columns[name] for name in names] + [key])
+
+    def _update_files(self, key, rows):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO operation_files (key, path, file_id, attached, linked) VALUES (?, ?, ?, ?, ?)",
+                [(key, path, f['file_id'], int(f['attached']), int(f['linked'])) for path, f in rows])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class Operation(object):
+    """
+    The journal entry of one create operation; see OperationJournal.
+
+    Attributes:
+
+        process_id: str or None
+          Id of the process created by the operation
+
+        sample_ids: list of str
+          Ids of the output samples created by the operation
+
+        finished: bool
+          True if a previous run completed the operation
+
+    """
+
+    def __init__(self, journal, key, process_id=None, sample_ids=None, steps=None, finished=False, files=None):
+        self.journal = journal
+        self.key = key
+        self.process_id = process_id
+        self.sample_ids = sample_ids or []
+        self.finished = finished
+        self._steps = steps or set()
+        self._files = files or {}
+        self._lock = threading.Lock()
+
+    def set_process(self, process_id):
+        self.process_id = process_id
+        self.journal._update(self.key, process_id=process_id)
+
+    def set_samples(self, sample_ids):
+        self.sample_ids = list(sample_ids)
+        self.journal._update(self.key, sample_ids=json.dumps(self.sample_ids))
+
+    def is_done(self, step):
+        return step in self._steps
+
+    def done(self, *steps):
+        """Record that named steps completed"""
+        with self._lock:
+            self._steps.update(steps)
+            steps = json.dumps(sorted(self._steps))
+        self.journal._update(self.key, steps=steps)
+
+    def _file(self, path):
+        return self._files.get(os.path.abspath(path))
+
+    def file_id(self, path):
+        """Id of the file uploaded for a local path, or None"""
+        f = self._file(path)
+        return None if f is None else f['file_id']
+
+    def is_attached(self, path):
+        f = self._file(path)
+        return f is not None and f['attached']
+
+    def is_linked(self, path):
+        f = self._file(path)
+        return f is not None and f['linked']
+
+    def _record_files(self, paths, file_ids=None, **flags):
+        rows = []
+        with self._lock:
+            for i, path in enumerate(paths):
+                path = os.path.abspath(path)
+                f = self._files.setdefault(path, {'file_id': None, 'attached': False, 'linked': False})
+                if file_ids is not None:
+                    f['file_id'] = file_ids[i]
+                f.update(flags)
+                rows.append((path, dict(f)))
+        self.journal._update_files(self.key, rows)
+
+    def record_attached(self, paths, file_ids):
+        """Record that the files uploaded from paths, with ids file_ids, were attached to the process"""
+        self._record_files(paths, file_ids, attached=True)
+
+    def record_linked(self, paths):
+        """Record that the files uploaded from paths were linked to the output samples"""
+        self._record_files(paths, linked=True)
+
+    def finish(self):
+        """Record that the operation completed and close the journal"""
+        self.finished = True
+        self.journal._update(self.key, finished=1)
+        self.journal.close()
+
+
+def begin_operation(expt, command, app_dir='.', resume=False):
+    """
+    Begin, or with resume=True continue, the create operation of command
+    (e.g. 'GrainId') for app_dir in expt, journaled in the local project.
+
+    Returns:
+
+        operation: Operation
+          Each step is committed to the journal as it completes; finish()
+          also closes the journal
+
+    """
+    journal = OperationJournal.for_project(expt.project)
+    key = command + ':' + expt.id + ':' + os.path.abspath(app_dir)
+    return journal.begin(key, resume=resume)
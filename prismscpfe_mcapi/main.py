@@ -1,28 +1,50 @@
 """CPFE - Materials Commons CLI"""
 
+import time
+_import_started = time.perf_counter()
+
+import os
 import argparse
+import importlib
 import sys
 from io import BytesIO     # for handling byte strings
 from io import StringIO    # for handling unicode strings
-from prismscpfe_mcapi.numerical_parameters import NumParametersSubcommand
-from prismscpfe_mcapi.grainid import GrainIdSubcommand
-from prismscpfe_mcapi.orientations import OrientationsSubcommand
-from prismscpfe_mcapi.boundaryconditions import BoundaryConditionsSubcommand
-from prismscpfe_mcapi.simulation import SimulationSubcommand
-from prismscpfe_mcapi.full_simulation import FullSimulationSubcommand
 
 
 # import prismscpfe_mcapi.samples
 
+# Subcommands are listed by name and description only. A subcommand's module,
+# and with it the Materials Commons client and NumPy, is imported when the
+# command is run. 'instance' subcommands are ListObjects built with no
+# arguments; the others parse and run argv when constructed.
 prismscpfe_usage = [
-    {'name':'numerical-parameters', 'desc': NumParametersSubcommand.desc, 'subcommand': NumParametersSubcommand()},
-    {'name':'GrainId', 'desc': GrainIdSubcommand.desc, 'subcommand': GrainIdSubcommand()},
-    {'name':'Orientations', 'desc': OrientationsSubcommand.desc, 'subcommand': OrientationsSubcommand()},
-	{'name':'BoundaryConditions', 'desc': BoundaryConditionsSubcommand.desc, 'subcommand': BoundaryConditionsSubcommand()},
-    {'name':'simulation', 'desc': SimulationSubcommand.desc, 'subcommand': SimulationSubcommand()} #,
-    #{'name':'full-simulation', 'desc': FullSimulationSubcommand.desc, 'subcommand': FullSimulationSubcommand()}
+    {'name':'numerical-parameters', 'desc': "(sample) PRISMS-CPFE Numerical Parameters", 'module': 'prismscpfe_mcapi.numerical_parameters', 'class': 'NumParametersSubcommand', 'instance': True},
+    {'name':'GrainId', 'desc': "(sample) PRISMS-CPFE GrainId", 'module': 'prismscpfe_mcapi.grainid', 'class': 'GrainIdSubcommand', 'instance': True},
+    {'name':'Orientations', 'desc': "(sample) PRISMS-CPFE Orientations", 'module': 'prismscpfe_mcapi.orientations', 'class': 'OrientationsSubcommand', 'instance': True},
+    {'name':'BoundaryConditions', 'desc': "(sample) PRISMS-CPFE BoundaryConditions", 'module': 'prismscpfe_mcapi.boundaryconditions', 'class': 'BoundaryConditionsSubcommand', 'instance': True},
+    {'name':'simulation', 'desc': "(sample) PRISMS-CPFE Simulation", 'module': 'prismscpfe_mcapi.simulation', 'class': 'SimulationSubcommand', 'instance': True},
+    {'name':'full-simulation', 'desc': "(samples) All PRISMS-CPFE input processes and the simulation", 'module': 'prismscpfe_mcapi.full_simulation', 'class': 'FullSimulationSubcommand', 'instance': False},
+    {'name':'validate', 'desc': "Check PRISMS-CPFE inputs for consistency", 'module': 'prismscpfe_mcapi.validation', 'class': 'ValidateSubcommand', 'instance': False},
+    {'name':'ingest', 'desc': "Create all PRISMS-CPFE runs under a directory", 'module': 'prismscpfe_mcapi.ingest', 'class': 'IngestSubcommand', 'instance': False}
 ]
 
+# Set to report the plugin import and subcommand load times on stderr
+STARTUP_TIME_ENV = "PRISMSCPFE_STARTUP_TIME"
+
+startup_times = {'import': time.perf_counter() - _import_started}
+
+
+def load_subcommand(interface):
+    """Import the module of a prismscpfe_usage entry and return its subcommand"""
+    module = importlib.import_module(interface['module'])
+    subcommand = getattr(module, interface['class'])
+    return subcommand() if interface['instance'] else subcommand
+
+
+def report_startup_time(command, out=sys.stderr):
+    out.write('prismscpfe startup: {:.1f} ms importing the plugin, {:.1f} ms loading \'{}\'\n'.format(
+        1000 * startup_times['import'], 1000 * startup_times['load'], command))
+
 
 def prismscpfe_subcommand(argv=sys.argv):
     usage_help = StringIO()
@@ -46,20 +68,29 @@ def prismscpfe_subcommand(argv=sys.argv):
     # exclude the rest of the args too, or validation will fail
     args = parser.parse_args(argv[2:3])
 
-    '''
-    if args.command in interfaces:
-        interfaces[args.command]['subcommand'](argv)
-    else:
+    if args.command not in interfaces:
         print('Unrecognized command')
         parser.print_help()
         exit(1)
-    '''
 
-    if args.command == 'full-simulation':
-        FullSimulationSubcommand(argv)
-    elif args.command in interfaces:
-        interfaces[args.command]['subcommand'](argv)
-    else:
-        print('Unrecognized command')
-        parser.print_help()
-        exit(1)
+    from prismscpfe_mcapi.cache import set_cache_options_from_argv
+    from prismscpfe_mcapi.scheduler import set_scheduler_options_from_argv
+    from prismscpfe_mcapi.tracing import set_profile_options_from_argv, finish_profile
+
+    # --refresh / --cache-ttl apply to every cached lookup made by the subcommand
+    set_cache_options_from_argv(argv[3:])
+    # --rate-limit / --max-requests / --retries / --latency-target apply to every Materials Commons request
+    set_scheduler_options_from_argv(argv[3:])
+    # --profile / --profile-trace trace every Materials Commons call, file parse and upload
+    set_profile_options_from_argv(argv[3:])
+
+    load_started = time.perf_counter()
+    subcommand = load_subcommand(interfaces[args.command])
+    startup_times['load'] = time.perf_counter() - load_started
+    if os.environ.get(STARTUP_TIME_ENV):
+        report_startup_time(args.command)
+
+    try:
+        subcommand(argv)
+    finally:
+        finish_profile()
@@ -0,0 +1,116 @@
+"""Local record of files already uploaded to Materials Commons"""
+
+import os
+import sqlite3
+import hashlib
+import threading
+
+MANIFEST_NAME = "prismscpfe_uploads.sqlite"
+
+_HASH_BLOCK_SIZE = 1 << 20
+
+
+def sha256_of_file(path):
+    """Return the hex sha256 digest of a file, read in 1 MB blocks"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        block = f.read(_HASH_BLOCK_SIZE)
+        while block:
+            h.update(block)
+            block = f.read(_HASH_BLOCK_SIZE)
+    return h.hexdigest()
+
+
+class UploadManifest(object):
+    """
+    SQLite manifest mapping local file contents to Materials Commons file ids.
+
+    Rows are keyed by project id, absolute path, size and mtime, and also store
+    the sha256 of the file contents. A file whose path, size and mtime match a
+    row is not hashed again; a file with new path or mtime is hashed and
+    matched by content and file name, so identical files of the same name
+    shared between run directories are uploaded once per project. Identical
+    files of different names (e.g. result files of successive time steps that
+    happen to be equal) are uploaded separately, since a file on the server
+    has one name.
+
+    Recorded file ids are reused without asking the server, which has no
+    route to fetch a file by id; after deleting an uploaded file on the
+    server, remove its rows with forget.
+
+    Safe to use from several upload threads.
+
+    Arguments:
+
+        db_path: str
+          Path to the SQLite database, created if it does not exist
+
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS uploads ("
+                " project_id TEXT NOT NULL,"
+                " path TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " mtime_ns INTEGER NOT NULL,"
+                " sha256 TEXT NOT NULL,"
+                " file_id TEXT NOT NULL,"
+                " PRIMARY KEY (project_id, path))")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS uploads_by_hash ON uploads (project_id, sha256, size)")
+
+    @classmethod
+    def for_project(cls, proj):
+        """Open the manifest stored in the .materialscommons directory of a local project"""
+        return cls(os.path.join(proj.local_path, '.materialscommons', MANIFEST_NAME))
+
+    def lookup(self, project_id, path):
+        """
+        Return (file_id, sha256) for a previously uploaded file with the same
+        name and contents as path, or (None, sha256) if there is none. The
+        file is only hashed if no row matches its path, size and mtime.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_id, sha256 FROM uploads WHERE project_id=? AND path=? AND size=? AND mtime_ns=?",
+                (project_id, path, st.st_size, st.st_mtime_ns)).fetchone()
+        if row is not None:
+            return row[0], row[1]
+
+        sha256 = sha256_of_file(path)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, file_id FROM uploads WHERE project_id=? AND sha256=? AND size=?",
+                (project_id, sha256, st.st_size)).fetchall()
+        name = os.path.basename(path)
+        for other_path, file_id in rows:
+            if os.path.basename(other_path) == name:
+                return file_id, sha256
+        return None, sha256
+
+    def record(self, project_id, path, file_id, sha256=None):
+        """Record that path, with its current size and mtime, was uploaded as file_id"""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        if sha256 is None:
+            sha256 = sha256_of_file(path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO uploads (project_id, path, size, mtime_ns, sha256, file_id) VALUES (?, ?, ?, ?, ?, ?)",
+                (project_id, path, st.st_size, st.st_mtime_ns, sha256, file_id))
+
+    def forget(self, project_id, file_id):
+        """Remove every row pointing at file_id, e.g. after it was deleted on the server"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM uploads WHERE project_id=? AND file_id=?", (project_id, file_id))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,155 @@
+"""Batched measurement submission for PRISMS-CPFE processes"""
+
+from materials_commons.api import api
+from prismscpfe_mcapi.scheduler import get_scheduler
+
+# Largest number of attributes sent in a single request; larger batches are split
+MAX_ATTRIBUTES_PER_REQUEST = 100
+
+
+class MeasurementBatch(object):
+    """
+    Collect measurements for the output samples of a process locally and send
+    them to Materials Commons in as few requests as possible.
+
+    The process-level add_*_measurement methods make one request per
+    measurement (plus a re-fetch of the process). A batch instead posts every
+    attribute in one request, or ceil(N / max_attributes) requests for very
+    large batches.
+
+    Arguments:
+
+        expt: mcapi.Experiment object
+
+        proc: mcapi.Process instance
+          The process whose output samples receive the measurements
+
+        max_attributes: int, optional (default=MAX_ATTRIBUTES_PER_REQUEST)
+          Maximum number of attributes per request
+
+        samples: list of mcapi.Sample, optional
+          Samples receiving the measurements, default is the output samples
+          of proc, fetched from the server when the batch is flushed
+
+    """
+
+    def __init__(self, expt, proc, max_attributes=MAX_ATTRIBUTES_PER_REQUEST, samples=None):
+        self.expt = expt
+        self.proc = proc
+        self.samples = samples
+        self.max_attributes = max_attributes
+        self.attributes = []
+        self.requests_sent = 0
+
+    def add(self, attribute, value, otype, unit=""):
+        """Queue one measurement; otype is a Materials Commons measurement type"""
+        self.attributes.append({
+            'name': attribute,
+            'attribute': attribute,
+            'measurements': [{
+                'name': attribute,
+                'attribute': attribute,
+                'otype': otype,
+                'unit': unit,
+                'value': value,
+                'is_best_measure': True
+            }]
+        })
+
+    def add_number(self, attribute, value, unit=""):
+        self.add(attribute, value, 'number', unit)
+
+    def add_integer(self, attribute, value, unit=""):
+        self.add(attribute, value, 'integer', unit)
+
+    def add_string(self, attribute, value, unit=""):
+        self.add(attribute, value, 'string', unit)
+
+    def add_boolean(self, attribute, value, unit=""):
+        self.add(attribute, value, 'boolean', unit)
+
+    def add_vector(self, attribute, value, unit="", otype='float'):
+        """Queue a list of numbers as one vector measurement; otype is the type of its elements, 'float' or 'integer'"""
+        self.add(attribute, {'dimensions': len(value), 'otype': otype, 'value': list(value)}, 'vector', unit)
+
+    def __len__(self):
+        return len(self.attributes)
+
+    def discard_unchanged(self, *stored):
+        """
+        Drop queued measurements equal to the ones already stored on every
+        sample, given as stored_measurements dicts, one per sample.
+
+        Returns:
+
+            n: int
+              Number of measurements dropped
+
+        """
+        kept = []
+        for attribute in self.attributes:
+            m = attribute['measurements'][0]
+            if not all(s.get(attribute['name']) == (m['otype'], m['value']) for s in stored):
+                kept.append(attribute)
+        n = len(self.attributes) - len(kept)
+        self.attributes = kept
+        return n
+
+    def flush(self):
+        """
+        Send all queued measurements and clear the batch.
+
+        Returns:
+
+            n: int
+              Number of requests sent by this call
+
+        """
+        if not len(self.attributes):
+            return 0
+        samples = self.samples
+        if samples is None:
+            # a process fetched by id does not necessarily list its output samples
+            if not getattr(self.proc, 'output_samples', None):
+                get_scheduler().call_idempotent(self.proc.decorate_with_output_samples)
+            samples = self.proc.output_samples
+        samples = [{'id': s.id, 'property_set_id': s.property_set_id} for s in samples]
+        n = 0
+        for start in range(0, len(self.attributes), self.max_attributes):
+            _post_attributes(self.expt, self.proc, samples, self.attributes[start:start+self.max_attributes])
+            n += 1
+        self.attributes = []
+        self.requests_sent += n
+        return n
+
+
+def stored_measurements(sample):
+    """
+    Return {attribute name: (otype, value)} of the best measure of each
+    property of a sample, as fetched with its properties
+    """
+    stored = {}
+    for prop in sample.properties:
+        best = prop.best_measure
+        if isinstance(best, list):
+            best = best[0] if len(best) else None
+        if best is not None:
+            stored[prop.name] = (best.otype, best.value)
+    return stored
+
+
+def _post_attributes(expt, proc, samples, attributes):
+    """Post a list of attributes (each with its measurements) for the given process samples"""
+    data = {
+        'process_id': proc.id,
+        'properties': [{
+            'property': {'name': a['name'], 'attribute': a['attribute']},
+            'add_as': 'separate',
+            'samples': samples,
+            'measurements': a['measurements']
+        } for a in attributes]
+    }
+    api_url = "projects/" + expt.project.id + "/experiments/" + expt.id + "/samples/measurements"
+    remote = api.use_remote()
+    # not retried after a server error, which could have recorded the measurements already
+    return get_scheduler().call(api.post, remote.make_url_v2(api_url), data, remote)
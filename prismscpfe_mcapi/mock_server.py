@@ -0,0 +1,405 @@
+"""Local stand-in for the Materials Commons server routes and client objects used by this package"""
+
+import os
+import json
+import time
+import uuid
+import threading
+import contextlib
+from urllib.parse import urlparse
+
+_COPY_BLOCK_SIZE = 1 << 20
+
+
+class MockServer(object):
+    """
+    In-process stand-in for the subset of Materials Commons used by this
+    package, for running the create_* functions without a live server:
+
+    - client objects (MockProject, MockExperiment, MockProcess, MockSample,
+      MockFile) with the mcapi methods called by this package,
+    - the measurements route posted to by MeasurementBatch, through install().
+
+    Every client call counts as one round trip and is delayed by latency,
+    plus the time to send its request and response bodies at bandwidth.
+
+    Use as a context manager:
+
+        with MockServer(latency=0.05) as server, server.install():
+            proj = server.create_project(project_dir)
+            expt = proj.create_experiment('run', '')
+            proc = create_parameters_sample(expt, app_dir=app_dir)
+
+    Arguments:
+
+        latency: float
+          Seconds added to every round trip
+
+        bandwidth: float, optional
+          Bytes per second for request and response bodies; None for no limit
+
+    Attributes:
+
+        url: str
+          Base URL of the routes installed by install()
+
+        requests: int
+          Number of round trips handled
+
+        bytes_received: int
+          Number of request body bytes received (uploads, measurements)
+
+        bytes_sent: int
+          Number of response body bytes sent
+
+    """
+
+    def __init__(self, latency=0.0, bandwidth=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.files = {}
+        self.projects = {}
+        self.experiments = {}
+        self.requests = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self.url = 'http://mockserver/api/v2/'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def counters(self):
+        """Return the current {'requests', 'bytes_received', 'bytes_sent'}"""
+        with self._lock:
+            return {'requests': self.requests, 'bytes_received': self.bytes_received, 'bytes_sent': self.bytes_sent}
+
+    def _delay(self, nbytes):
+        if self.bandwidth and nbytes:
+            time.sleep(float(nbytes) / self.bandwidth)
+
+    def round_trip(self, received=0, response=None):
+        """
+        Account for one client call: count it and its bytes, and wait for the
+        latency and transfer time. Returns response.
+        """
+        sent = len(json.dumps(_to_json(response))) if response is not None else 0
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += received
+            self.bytes_sent += sent
+        time.sleep(self.latency)
+        self._delay(received + sent)
+        return response
+
+    def _new_id(self):
+        return uuid.uuid4().hex
+
+    # ---- client objects ----
+
+    def create_project(self, path, name=None):
+        """
+        Create a project whose local directory is path; its .materialscommons
+        directory is created if needed. Not counted as a round trip.
+        """
+        mc_dir = os.path.join(path, '.materialscommons')
+        if not os.path.isdir(mc_dir):
+            os.makedirs(mc_dir)
+        proj = MockProject(self, self._new_id(), name or os.path.basename(os.path.abspath(path)), os.path.abspath(path))
+        with self._lock:
+            self.projects[proj.id] = proj
+        return proj
+
+    def add_file(self, project_id, local_path, remote_path):
+        """Store the metadata of a file uploaded in one request and return its id"""
+        file_id = self._new_id()
+        with self._lock:
+            self.files[file_id] = {'project_id': project_id, 'path': remote_path, 'size': os.path.getsize(local_path)}
+        return file_id
+
+    @contextlib.contextmanager
+    def install(self):
+        """
+        Within the block, send the requests this package makes with
+        materials_commons.api.api (measurements, process file updates) to
+        this server instead of the configured remote.
+        """
+        from materials_commons.api import api
+        saved = api.use_remote, api.post, api.put
+        api.use_remote = lambda *args, **kwargs: _MockRemote(self)
+        api.post = self.post
+        api.put = self.put
+        try:
+            yield self
+        finally:
+            api.use_remote, api.post, api.put = saved
+
+    def post(self, restpath, data, remote):
+        """api.post for the routes used by this package"""
+        received = len(json.dumps(data))
+        parts = [p for p in urlparse(restpath).path.split('/') if p]
+        if len(parts) < 6 or parts[-6] != 'projects' or parts[-4] != 'experiments' or parts[-2:] != ['samples', 'measurements']:
+            self.round_trip(received)
+            raise ValueError('MockServer: unsupported route ' + restpath)
+        expt = self.experiments[parts[-3]]
+        with self._lock:
+            for prop in data['properties']:
+                for s in prop['samples']:
+                    sample = expt.samples[s['id']]
+                    sample.measurements[prop['property']['name']] = prop['measurements']
+        return self.round_trip(received, {'success': True})
+
+    def put(self, restpath, data, remote):
+        """api.put for the routes used by this package"""
+        received = len(json.dumps(data))
+        parts = [p for p in urlparse(restpath).path.split('/') if p]
+        if len(parts) < 6 or parts[-6] != 'projects' or parts[-4] != 'experiments' or parts[-2] != 'processes' or 'files' not in data:
+            self.round_trip(received)
+            raise ValueError('MockServer: unsupported route ' + restpath)
+        proc = self.experiments[parts[-3]].processes[parts[-1]]
+        with self._lock:
+            for command in data['files']:
+                if command['command'] == 'add':
+                    proc._add_file_ids([command['id']], command['direction'])
+                elif command['command'] == 'delete':
+                    proc.files = [file for file in proc.files if file.id != command['id']]
+        return self.round_trip(received, proc)
+
+
+class _MockRemote(object):
+    """The parts of an mcapi Remote used by this package"""
+
+    class _Config(object):
+        params = {}
+
+    def __init__(self, server):
+        self.server = server
+        self.config = _MockRemote._Config()
+
+    def make_url_v2(self, restpath):
+        return self.server.url + restpath
+
+
+def _to_json(value):
+    if isinstance(value, (list, tuple)):
+        return [_to_json(v) for v in value]
+    if isinstance(value, _MockObject):
+        return value._json()
+    if hasattr(value, 'id'):
+        # mcapi objects built by this package, e.g. files reused from the upload manifest
+        return {'id': value.id, 'name': getattr(value, 'name', None)}
+    return value
+
+
+class _MockObject(object):
+    """Base of the mock client objects"""
+
+    def __init__(self, server, id, name):
+        self._server = server
+        self.id = id
+        self.name = name
+
+    def _json(self):
+        return {'id': self.id, 'name': self.name}
+
+
+class MockFile(_MockObject):
+
+    def __init__(self, server, id, name, path, size):
+        super(MockFile, self).__init__(server, id, name)
+        self.path = path
+        self.size = size
+        self.direction = None
+
+    def _json(self):
+        return {'id': self.id, 'name': self.name, 'path': self.path, 'size': self.size}
+
+
+class MockSample(_MockObject):
+
+    def __init__(self, server, id, name, experiment):
+        super(MockSample, self).__init__(server, id, name)
+        self.property_set_id = server._new_id()
+        self.project = experiment.project
+        self.experiment = experiment
+        self.files = []
+        # attribute name -> list of measurement dicts
+        self.measurements = {}
+
+    def link_files(self, file_list):
+        """Link files by id, as the server does; unknown ids raise KeyError"""
+        self.files.extend(self.project._file(file.id) for file in file_list)
+        return self._server.round_trip(len(json.dumps([file.id for file in file_list])), self)
+
+    @property
+    def properties(self):
+        """The stored measurements, as mcapi properties with their best_measure"""
+        return [_MockProperty(name, [_MockMeasurement(m['otype'], m['value']) for m in measurements if m.get('is_best_measure')])
+            for name, measurements in self.measurements.items()]
+
+
+class _MockProperty(object):
+
+    def __init__(self, name, best_measure):
+        self.name = name
+        self.best_measure = best_measure
+
+
+class _MockMeasurement(object):
+
+    def __init__(self, otype, value):
+        self.otype = otype
+        self.value = value
+
+
+class MockProcess(_MockObject):
+
+    def __init__(self, server, id, name, template_id, experiment):
+        super(MockProcess, self).__init__(server, id, name)
+        self.template_id = template_id
+        self.project = experiment.project
+        self.experiment = experiment
+        self.input_samples = []
+        self.output_samples = []
+        self.files = []
+
+    def _json(self):
+        return {'id': self.id, 'name': self.name, 'template_id': self.template_id,
+            'input_samples': _to_json(self.input_samples), 'output_samples': _to_json(self.output_samples), 'files': _to_json(self.files)}
+
+    def create_samples(self, sample_names):
+        samples = [MockSample(self._server, self._server._new_id(), name, self.experiment) for name in sample_names]
+        with self._server._lock:
+            for sample in samples:
+                self.experiment.samples[sample.id] = sample
+            self.output_samples.extend(samples)
+        return self._server.round_trip(len(json.dumps(sample_names)), samples)
+
+    def rename(self, process_name):
+        self.name = process_name
+        return self._server.round_trip(len(process_name), self)
+
+    def add_input_samples_to_process(self, samples, transform=None):
+        self.input_samples.extend(samples)
+        return self._server.round_trip(len(json.dumps([{'id': s.id, 'property_set_id': s.property_set_id} for s in samples])), self)
+
+    def add_files(self, files_list, direction=None):
+        """Attach files by id with direction, as the server does; unknown ids raise KeyError"""
+        self._add_file_ids([file.id for file in files_list], direction)
+        return self._server.round_trip(len(json.dumps([file.id for file in files_list])), self)
+
+    def _add_file_ids(self, file_ids, direction):
+        for file_id in file_ids:
+            file = self.project._file(file_id)
+            file.direction = direction or ''
+            self.files.append(file)
+
+    def get_all_files(self):
+        return self._server.round_trip(0, list(self.files))
+
+    def decorate_with_output_samples(self):
+        self._server.round_trip(0, self.output_samples)
+        return self
+
+
+class MockExperiment(_MockObject):
+
+    def __init__(self, server, id, name, project):
+        super(MockExperiment, self).__init__(server, id, name)
+        self.project = project
+        self.processes = {}
+        self.samples = {}
+
+    def create_process_from_template(self, template_id):
+        proc = MockProcess(self._server, self._server._new_id(), template_id, template_id, self)
+        with self._server._lock:
+            self.processes[proc.id] = proc
+        return self._server.round_trip(len(template_id), proc)
+
+    def get_process_by_id(self, proc_id):
+        return self._server.round_trip(0, self.processes[proc_id])
+
+    def get_all_processes(self):
+        return self._server.round_trip(0, list(self.processes.values()))
+
+    def get_all_samples(self):
+        return self._server.round_trip(0, list(self.samples.values()))
+
+
+class MockDirectory(_MockObject):
+
+    def __init__(self, server, id, name, path):
+        super(MockDirectory, self).__init__(server, id, name)
+        self.path = path
+
+    def _json(self):
+        return {'id': self.id, 'name': self.name, 'path': self.path}
+
+
+class MockProject(_MockObject):
+
+    def __init__(self, server, id, name, local_path):
+        super(MockProject, self).__init__(server, id, name)
+        self.local_path = local_path
+        self.experiments = {}
+        # directory path in the project -> MockDirectory
+        self.directories = {'/': MockDirectory(server, server._new_id(), name, '/')}
+
+    def create_experiment(self, name, description):
+        expt = MockExperiment(self._server, self._server._new_id(), name, self)
+        with self._server._lock:
+            self.experiments[expt.id] = expt
+            self._server.experiments[expt.id] = expt
+        return self._server.round_trip(len(name) + len(description), expt)
+
+    def get_all_processes(self):
+        return self._server.round_trip(0, [p for expt in self.experiments.values() for p in expt.processes.values()])
+
+    def create_or_get_all_directories_on_path(self, path):
+        """The directories from the project root to path, creating missing ones"""
+        directories = [self.directories['/']]
+        current = ''
+        for name in [p for p in path.split('/') if p]:
+            current = current + '/' + name
+            with self._server._lock:
+                if current not in self.directories:
+                    self.directories[current] = MockDirectory(self._server, self._server._new_id(), name, current)
+            directories.append(self.directories[current])
+        return self._server.round_trip(len(path), directories)
+
+    def add_file_using_directory(self, directory, file_name, local_path, verbose=False, limit=50):
+        """Upload a file in one request; its contents are read but not stored"""
+        from materials_commons.api.base import MCGenericException
+        file_size_mb = os.path.getsize(local_path) >> 20
+        if file_size_mb > limit:
+            raise MCGenericException("File too large (>{0}MB), skipping. File size: {1}M".format(limit, file_size_mb))
+        size = 0
+        with open(local_path, 'rb') as f:
+            block = f.read(_COPY_BLOCK_SIZE)
+            while block:
+                size += len(block)
+                block = f.read(_COPY_BLOCK_SIZE)
+        file_id = self._server.add_file(self.id, local_path, directory.path.rstrip('/') + '/' + file_name)
+        if verbose:
+            print("uploading:", local_path, " as:", file_name)
+        return self._server.round_trip(size, self._file(file_id))
+
+    def add_file_by_local_path(self, local_path, verbose=False, limit=50):
+        local_dir = os.path.dirname(os.path.abspath(local_path))
+        path = '/' if local_dir == self.local_path else os.path.relpath(local_dir, self.local_path)
+        directory = self.create_or_get_all_directories_on_path(path)[-1]
+        return self.add_file_using_directory(directory, os.path.basename(local_path), local_path, verbose, limit)
+
+    def get_sample_by_id(self, sample_id):
+        for expt in self.experiments.values():
+            if sample_id in expt.samples:
+                return self._server.round_trip(0, expt.samples[sample_id])
+        self._server.round_trip()
+        raise KeyError('MockServer: unknown sample id ' + sample_id)
+
+    def _file(self, file_id):
+        record = self._server.files[file_id]
+        return MockFile(self._server, file_id, os.path.basename(record['path']), record['path'], record['size'])
@@ -1,13 +1,28 @@
 """mc prismscpfe parameters subcommand"""
 
 import sys
+import os.path
+import asyncio
 import prismscpfe_mcapi
-from prismscpfe_mcapi.prismscpfe_parameter_parser import parse_parameters_file
+from prismscpfe_mcapi.aio import get_client, run_sync
+from prismscpfe_mcapi.journal import begin_operation, add_resume_options
+from prismscpfe_mcapi.cache import add_cache_options, invalidate, processes_with_template
+from prismscpfe_mcapi.scheduler import add_scheduler_options
+from prismscpfe_mcapi.tracing import add_profile_options
+from prismscpfe_mcapi.samples import SampleIndex
+from prismscpfe_mcapi.prismscpfe_parameter_parser import ParameterIndex
+from prismscpfe_mcapi.measurements import MeasurementBatch, stored_measurements
+from prismscpfe_mcapi.parameter_schema import parameter_values, add_parameter_measurements
+from prismscpfe_mcapi.uploads import DEFAULT_UPLOAD_WORKERS
+from prismscpfe_mcapi.validation import add_validation_options, check_app_directory
 from materials_commons.cli import ListObjects
 from materials_commons.cli.functions import make_local_project, make_local_expt
 
+# Files of the app directory attached to the Numerical Parameters process
+INPUT_FILE_NAMES = ['parameters.in', 'slipDirections.txt', 'slipNormals.txt', 'twinDirections.txt', 'twinNormals.txt']
 
-def get_parameters_sample(expt, sample_id=None, out=sys.stdout):
+
+def get_parameters_sample(expt, sample_id=None, index=None, out=sys.stdout):
     """
     Return a PRISMS-CPFE Input File sample from provided Materials Commons
     experiment and optionally explicit sample id. Returns None if sample_id is None
@@ -17,8 +32,11 @@ def get_parameters_sample(expt, sample_id=None, out=sys.stdout):
 
         expt: mcapi.Experiment object
 
-        sample_id: str, optional (default=None)
-          Sample id to use explicitly
+        sample_id: list of str, optional (default=None)
+          Sample id to use explicitly, as sample_id[0]
+
+        index: SampleIndex, optional
+          Index of the experiment samples to reuse; built if not given
 
     Returns:
 
@@ -27,7 +45,7 @@ def get_parameters_sample(expt, sample_id=None, out=sys.stdout):
 
     """
     if sample_id is None:
-        candidate_parameters = [proc for proc in expt.get_all_processes() if proc.template_id == prismscpfe_mcapi.templates['input_parameters']]
+        candidate_parameters = processes_with_template(expt, prismscpfe_mcapi.templates['numerical-parameters'])
         if len(candidate_parameters) == 0:
             out.write('Did not find a Numerical Parameters sample.\n')
             out.write('Use \'mc prismscpfe numerical-parameters --create\' to create a Numerical Parameters sample, or --parameters-id <id> to specify explicitly.\n')
@@ -44,27 +62,14 @@ def get_parameters_sample(expt, sample_id=None, out=sys.stdout):
         parameters_proc.decorate_with_output_samples()
         return parameters_proc.output_samples[0]
     else:
-        # print("The sample id is: ")
-        # print(sample_id[0])
-
-        # This is broken, temporarily replaced by a more complicated work-around
-        # parameters = expt.get_sample_by_id(sample_id)
-
-        sample_found = False
-        for proc in expt.get_all_processes():
-            for sample in proc.get_all_samples():
-                if sample.id == sample_id[0]:
-                    # print("Sample found with id of: ", sample.id)
-                    parameters = sample
-                    sample_found = True
-                    break
-            if sample_found:
-                break
+        if index is None:
+            index = SampleIndex(expt)
+        parameters = index.get(sample_id[0])
 
     return parameters
 
 
-def create_parameters_sample(expt, sample_name=None, verbose=False):
+def create_parameters_sample(expt, sample_name=None, verbose=False, upload_workers=DEFAULT_UPLOAD_WORKERS, app_dir='.', resume=False):
     """
     Create a PRISMS-CPFE Numerical Parameters Sample
 
@@ -80,179 +85,110 @@ def create_parameters_sample(expt, sample_name=None, verbose=False):
         verbose: bool
           Print messages about uploads, etc.
 
+        upload_workers: int
+          Maximum number of files uploaded concurrently
+
+        app_dir: str
+          PRISMS-CPFE app directory containing the input files, default is the
+          current directory
+
+        resume: bool
+          Continue the last create of this sample for app_dir in expt, as
+          recorded in the project's operation journal, repeating only the
+          steps that did not complete
+
     Returns:
 
         proc: mcapi.Process instance
           The Process that created the sample
     """
-    template_id = prismscpfe_mcapi.templates['numerical-parameters']
+    return run_sync(create_parameters_sample_async(expt, sample_name, verbose, upload_workers, app_dir, resume))
 
-    print("The template ID is: " + template_id)
-    ## Process that will create samples
-    proc = expt.create_process_from_template(template_id)
 
-    proc.rename('Set ' + 'Numerical Parameters')
+async def create_parameters_sample_async(expt, sample_name=None, verbose=False, upload_workers=DEFAULT_UPLOAD_WORKERS, app_dir='.', resume=False, client=None):
+    """Coroutine version of create_parameters_sample; client defaults to the shared get_client()"""
+    if client is None:
+        client = get_client()
+    template_id = prismscpfe_mcapi.templates['numerical-parameters']
+
+    operation = begin_operation(expt, 'numerical-parameters', app_dir, resume)
+    if operation.finished:
+        print("Already created: process " + operation.process_id)
+        operation.journal.close()
+        return await client.get_process(expt, operation.process_id)
 
-    ## Create sample
+    print("The template ID is: " + template_id)
+    ## Process that will create samples, and its sample
     if sample_name is None:
         sample_name = "Numerical Parameters"
-    new_sample = proc.create_samples([sample_name])
-
-    proc = expt.get_process_by_id(proc.id)
-
-    # Populate the list of numerical parameter descriptors used in parameters.in (skipping anything in a subsection for now)
-    # The order of entries is "descriptor string in parameters.in", "type", "default value", "the subsection name" (if applicable)
-    parameter_descriptor_list = []
-    parameter_descriptor_list.append(('Order of finite elements', 'string', '1', ''))
-    parameter_descriptor_list.append(('Order of quadrature', 'string', '1', ''))
-    parameter_descriptor_list.append(('Domain size X', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Domain size Y', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Domain size Z', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Subdivisions X', 'string', '1', ''))
-    parameter_descriptor_list.append(('Subdivisions Y', 'string', '1', ''))
-    parameter_descriptor_list.append(('Subdivisions Z', 'string', '1', ''))
-    parameter_descriptor_list.append(('Refine factor', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Write Mesh To EPS', 'string', 'false', ''))
-
-    parameter_descriptor_list.append(('Write Output', 'string', 'false', ''))
-    parameter_descriptor_list.append(('Output Directory', 'string', '.', ''))
-    parameter_descriptor_list.append(('Skip Output Steps', 'string', '-1', ''))
-
-    parameter_descriptor_list.append(('Output Equivalent strain', 'string', 'false', ''))
-    parameter_descriptor_list.append(('Output Equivalent stress', 'string', 'false', ''))
-    parameter_descriptor_list.append(('Output Grain ID', 'string', 'false', ''))
-    parameter_descriptor_list.append(('Output Twin fractions', 'string', 'false', ''))
-	
-    parameter_descriptor_list.append(('Boundary condition filename', 'string', 'BCinfo.txt', ''))
-    parameter_descriptor_list.append(('BC file number of header lines', 'string', '2', ''))
-    parameter_descriptor_list.append(('Number of boundary conditions', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Enable cyclic loading', 'string', 'false', ''))
-    parameter_descriptor_list.append(('Cyclic loading face', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Cyclic loading direction', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Quarter cycle time', 'string', '-1', ''))
-	
-	
-    parameter_descriptor_list.append(('Time increments', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Total time', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Maximum linear solver iterations', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Relative linear solver tolerance', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Maximum non linear iterations', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Absolute nonLinear solver tolerance', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Relative nonLinear solver tolerance', 'string', '-1', ''))  # Actually a list of strings
-    parameter_descriptor_list.append(('Stop on convergence failure', 'string', 'false', ''))  # Actually a list of strings
-    parameter_descriptor_list.append(('Enable adaptive Time stepping', 'string', 'false', ''))
-    parameter_descriptor_list.append(('Adaptive load step factor', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Adaptive load increase Factor', 'string', '-1', ''))  # Actually a list of ints
-    parameter_descriptor_list.append(('Succesive increment for increasing time step', 'string', '1', ''))
-
-    parameter_descriptor_list.append(('Crystal Structure', 'fcc', ' '))
-
-    parameter_descriptor_list.append(('Elastic Stiffness row 1', 'string', '0,0,0,0,0,0', ''))  # Actually a list of doubles
-    parameter_descriptor_list.append(('Elastic Stiffness row 2', 'string', '0,0,0,0,0,0', ''))  # Actually a list of doubles
-    parameter_descriptor_list.append(('Elastic Stiffness row 3', 'string', '0,0,0,0,0,0', ''))  # Actually a list of doubles
-    parameter_descriptor_list.append(('Elastic Stiffness row 4', 'string', '0,0,0,0,0,0', ''))  # Actually a list of doubles
-    parameter_descriptor_list.append(('Elastic Stiffness row 5', 'string', '0,0,0,0,0,0', ''))  # Actually a list of doubles
-    parameter_descriptor_list.append(('Elastic Stiffness row 6', 'string', '0,0,0,0,0,0', ''))  # Actually a list of doubles
-    parameter_descriptor_list.append(('Number of Slip Systems', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Latent Hardening Ratio', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Initial Slip Resistance', 'string', '0,0,0,0,0,0', ''))  # Actually a list of doubles
-    parameter_descriptor_list.append(('Initial Hardening Modulus', 'string', '0,0,0,0,0,0', ''))  # Actually a list of doubles
-    parameter_descriptor_list.append(('Power Law Exponent', 'string', '0,0,0,0,0,0', ''))  # Actually a list of doubles
-    parameter_descriptor_list.append(('Saturation Stress', 'string', '0,0,0,0,0,0', ''))  # Actually a list of doubles
-    parameter_descriptor_list.append(('Slip Directions File', 'string', 'slipDirections.txt', ''))
-    parameter_descriptor_list.append(('Slip Normals File', 'string', 'slipNormals.txt', ''))
-    parameter_descriptor_list.append(('Backstress Factor', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Twinning enabled', 'string', 'false', ''))
-    parameter_descriptor_list.append(('Number of Twin Systems', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Initial Slip Resistance Twin', 'string', '0,0,0,0,0,0', ''))  # Actually a list of doubles
-    parameter_descriptor_list.append(('Initial Hardening Modulus Twin', 'string', '0,0,0,0,0,0', ''))  # Actually a list of doubles
-    parameter_descriptor_list.append(('Power Law Exponent Twin', 'string', '0,0,0,0,0,0', ''))  # Actually a list of doubles
-    parameter_descriptor_list.append(('Saturation Stress Twin', 'string', '0,0,0,0,0,0', ''))  # Actually a list of doubles
-    parameter_descriptor_list.append(('Twin Saturation Factor', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Twin Threshold Fraction', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Twin Directions File', 'string', 'twinDirections.txt', ''))
-    parameter_descriptor_list.append(('Twin Normals File', 'string', 'twinNormals.txt', ''))
-    parameter_descriptor_list.append(('Characteristic Twin Shear', 'string', '-1', ''))
-	
-    parameter_descriptor_list.append(('Stress Tolerance', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Max Plastic Slip L2 Norm', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Max Slip Search Iterations', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Max Solver Iterations', 'string', '-1', ''))
-	
-    parameter_descriptor_list.append(('Voxels in X direction', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Voxels in Y direction', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Voxels in Z direction', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Grain ID file name', 'string', 'grainID.txt', ''))
-    parameter_descriptor_list.append(('Header Lines GrainID File', 'string', '-1', ''))
-    parameter_descriptor_list.append(('Orientations file name', 'string', 'orientations.txt', ''))
-	
-    parameter_dictionary = parse_parameters_file()
-
-    for parameter_descriptor in parameter_descriptor_list:
-        # The standard case where a parameter is directly set in the parameters file
-        if parameter_descriptor[0] in parameter_dictionary:
-            parameter_value = parameter_dictionary[parameter_descriptor[0]]
-            parameter_description = parameter_descriptor[0]
-
-            if parameter_descriptor[1] == 'double':
-                proc.add_number_measurement(parameter_description, parameter_value)
-            elif parameter_descriptor[1] == 'int':
-                proc.add_integer_measurement(parameter_description, parameter_value)
-            elif parameter_descriptor[1] == 'string':
-                proc.add_string_measurement(parameter_description, parameter_value)
-            elif parameter_descriptor[1] == 'bool':
-                proc.add_boolean_measurement(parameter_description, parameter_value)
-
-        # The default value if the parameter isn't set in the parameters file
-        elif len(parameter_descriptor[3]) < 1:
-            parameter_value = parameter_descriptor[2]
-            parameter_description = parameter_descriptor[0]
-
-            if parameter_descriptor[1] == 'double':
-                proc.add_number_measurement(parameter_description, parameter_value)
-            elif parameter_descriptor[1] == 'int':
-                proc.add_integer_measurement(parameter_description, parameter_value)
-            elif parameter_descriptor[1] == 'string':
-                proc.add_string_measurement(parameter_description, parameter_value)
-            elif parameter_descriptor[1] == 'bool':
-                proc.add_boolean_measurement(parameter_description, parameter_value)
-
-        else:
-            # Need to find all versions of the parameters in subsections
-            base_subsection_name = parameter_descriptor[3]
-            base_subsection_name = base_subsection_name[:-1]
-
-            for entry in parameter_dictionary:
-                if entry[:len(base_subsection_name)] == base_subsection_name and entry[-len(parameter_descriptor[0]):] == parameter_descriptor[0]:
-                    parameter_value = parameter_dictionary[entry]
-                    parameter_description = entry
-
-                    if parameter_descriptor[1] == 'double':
-                        proc.add_number_measurement(parameter_description, parameter_value)
-                    elif parameter_descriptor[1] == 'int':
-                        proc.add_integer_measurement(parameter_description, parameter_value)
-                    elif parameter_descriptor[1] == 'string':
-                        proc.add_string_measurement(parameter_description, parameter_value)
-                    elif parameter_descriptor[1] == 'bool':
-                        proc.add_boolean_measurement(parameter_description, parameter_value)
+    proc, new_sample = await client.create_process(expt, template_id, 'Set ' + 'Numerical Parameters', [sample_name], operation=operation)
+
+    # Measurements are collected locally and sent together
+    batch = MeasurementBatch(expt, proc, samples=new_sample)
+    add_parameter_measurements(batch, parameter_values(ParameterIndex.load(os.path.join(app_dir, "parameters.in"))))
 
+    # new_sample[0].pretty_print(shift=0, indent=2, out=sys.stdout)
 
+    # I need to pass in the path to the PRISMS-CPFE app folder
+    input_file_names = [os.path.join(app_dir, name) for name in INPUT_FILE_NAMES]
+    await asyncio.gather(client.upload_and_attach(expt.project, proc, input_file_names, workers=upload_workers, operation=operation, verbose=verbose), client.flush(batch, operation))
+    operation.finish()
+    return await client.get_process(expt, proc.id)
 
 
-    # new_sample[0].pretty_print(shift=0, indent=2, out=sys.stdout)
+def update_parameters_sample(expt, proc_id, verbose=False, upload_workers=DEFAULT_UPLOAD_WORKERS, app_dir='.'):
+    """
+    Update an existing PRISMS-CPFE Numerical Parameters process from the
+    current input files, sending only what changed: the measurements whose
+    value differs from the one stored on its output samples, and the input
+    files whose contents differ from the files attached to it.
 
-    parameters_file = expt.project.add_file_by_local_path('parameters.in', verbose=verbose)  # I need to pass in the path to the PRISMS-CPFE app folder
-    proc.add_files([parameters_file])
-    parameters_fileSlipDirection = expt.project.add_file_by_local_path('slipDirections.txt', verbose=verbose)  # I need to pass in the path to the PRISMS-CPFE app folder
-    proc.add_files([parameters_fileSlipDirection])
-    parameters_fileNormalDirection = expt.project.add_file_by_local_path('slipNormals.txt', verbose=verbose)  # I need to pass in the path to the PRISMS-CPFE app folder
-    proc.add_files([parameters_fileNormalDirection])
+    Arguments:
 
-    parameters_fileTwinDirection = expt.project.add_file_by_local_path('twinDirections.txt', verbose=verbose)  # I need to pass in the path to the PRISMS-CPFE app folder
-    proc.add_files([parameters_fileTwinDirection])
-    parameters_fileTwinNormalDirection = expt.project.add_file_by_local_path('twinNormals.txt', verbose=verbose)  # I need to pass in the path to the PRISMS-CPFE app folder
-    proc.add_files([parameters_fileTwinNormalDirection])
-    return expt.get_process_by_id(proc.id)
+        expt: mcapi.Experiment object
+
+        proc_id: str
+          Id of the Numerical Parameters process to update
+
+        verbose: bool
+          Print messages about uploads, etc.
+
+        upload_workers: int
+          Maximum number of files uploaded concurrently
+
+        app_dir: str
+          PRISMS-CPFE app directory containing the input files, default is the
+          current directory
+
+    Returns:
+
+        proc: mcapi.Process instance
+          The updated Process
+    """
+    return run_sync(update_parameters_sample_async(expt, proc_id, verbose, upload_workers, app_dir))
+
+
+async def update_parameters_sample_async(expt, proc_id, verbose=False, upload_workers=DEFAULT_UPLOAD_WORKERS, app_dir='.', client=None):
+    """Coroutine version of update_parameters_sample; client defaults to the shared get_client()"""
+    if client is None:
+        client = get_client()
+    proc = await client.get_process(expt, proc_id)
+    if proc.template_id != prismscpfe_mcapi.templates['numerical-parameters']:
+        raise ValueError("Process " + proc_id + " is not a Numerical Parameters process")
+
+    values = parameter_values(ParameterIndex.load(os.path.join(app_dir, "parameters.in")))
+    if not getattr(proc, 'output_samples', None):
+        await client.request_idempotent(proc.decorate_with_output_samples)
+    samples = await asyncio.gather(*[client.get_sample(expt.project, sample.id) for sample in proc.output_samples])
+    batch = MeasurementBatch(expt, proc, samples=samples)
+    add_parameter_measurements(batch, values)
+    unchanged = batch.discard_unchanged(*[stored_measurements(sample) for sample in samples])
+    if verbose:
+        print("Changed measurements: " + str(len(batch)) + " (" + str(unchanged) + " unchanged)")
+
+    input_file_names = [os.path.join(app_dir, name) for name in INPUT_FILE_NAMES]
+    await asyncio.gather(client.replace_changed_files(expt.project, proc, input_file_names, workers=upload_workers, verbose=verbose), client.flush(batch))
+    return await client.get_process(expt, proc.id)
 
 
 class NumParametersSubcommand(ListObjects):
@@ -266,21 +202,38 @@ class NumParametersSubcommand(ListObjects):
             creatable=True)
 
     def get_all_from_experiment(self, expt):
-        return [proc for proc in expt.get_all_processes() if proc.template_id == prismscpfe_mcapi.templates[self.cmdname[-1]]]
+        return processes_with_template(expt, prismscpfe_mcapi.templates[self.cmdname[-1]])
 
     def get_all_from_project(self, proj):
-        return [proc for proc in proj.get_all_processes() if proc.template_id == prismscpfe_mcapi.templates[self.cmdname[-1]]]
+        return processes_with_template(proj, prismscpfe_mcapi.templates[self.cmdname[-1]])
 
     def create(self, args, out=sys.stdout):
+        if not args.skip_validation and not check_app_directory('numerical-parameters', out=out):
+            return
         proj = make_local_project()
         expt = make_local_expt(proj)
-        proc = create_parameters_sample(expt, verbose=True)
+        if args.update is not None:
+            proc = update_parameters_sample(expt, args.update, verbose=True, upload_workers=args.upload_workers)
+            invalidate(expt, proj)
+            out.write('Updated process: ' + proc.name + ' ' + proc.id + '\n')
+            return
+        proc = create_parameters_sample(expt, verbose=True, upload_workers=args.upload_workers, resume=args.resume)
+        invalidate(expt, proj)
         out.write('Created process: ' + proc.name + ' ' + proc.id + '\n')
 
 
     def add_create_options(self, parser):
-        #some_option_help = "Some option help info"
-        #parser.add_argument('--some_option', action="store_true", default=False, help=some_option_help)
+        upload_workers_help = "Maximum number of files uploaded concurrently (default: " + str(DEFAULT_UPLOAD_WORKERS) + ")"
+        parser.add_argument('--upload-workers', type=int, default=DEFAULT_UPLOAD_WORKERS, help=upload_workers_help)
+
+        add_validation_options(parser)
+        add_cache_options(parser)
+        add_profile_options(parser)
+        add_scheduler_options(parser)
+        add_resume_options(parser)
+
+        update_help = "Instead of creating a new process, update this Numerical Parameters process, sending only the changed parameters and input files"
+        parser.add_argument('--update', type=str, default=None, metavar='PROCESS_ID', help=update_help)
         return
 
     def list_data(self, obj):
@@ -0,0 +1,185 @@
+"""Vectorized reading, conversion and texture statistics of PRISMS-CPFE orientations files"""
+
+import os
+import numpy as np
+from prismscpfe_mcapi.tracing import traced
+
+# (path, mtime, size, write_sidecar) -> (summary, sidecar) of files already processed in this process
+_summary_cache = {}
+
+
+@traced('parse')
+def load_orientations(file_name):
+    """
+    Read an orientations file with one 'grain_id r_x r_y r_z' line per grain,
+    after any header lines starting with '**'.
+
+    Returns:
+
+        grain_ids: numpy.ndarray of int64, shape (N,)
+
+        rodrigues: numpy.ndarray of float64, shape (N, 3)
+
+    """
+    with open(file_name, 'rb') as f:
+        data = f.read()
+    start = 0
+    while data.startswith(b'**', start):
+        end = data.find(b'\n', start)
+        start = len(data) if end == -1 else end + 1
+    values = np.fromstring(data[start:], dtype=np.float64, sep=' ')
+    if values.size % 4 != 0:
+        raise ValueError(file_name + ": expected 4 values (grain id, r_x, r_y, r_z) per line")
+    values = values.reshape(-1, 4)
+    return values[:, 0].astype(np.int64), values[:, 1:].copy()
+
+
+def rodrigues_to_quaternions(rodrigues):
+    """
+    Convert Rodrigues vectors r = n tan(w/2) to unit quaternions
+    (cos(w/2), sin(w/2) n), shape (N, 4), scalar first, scalar part >= 0
+    """
+    rodrigues = np.asarray(rodrigues, dtype=np.float64)
+    w = 1.0 / np.sqrt(1.0 + np.einsum('ij,ij->i', rodrigues, rodrigues))
+    return np.column_stack((w, rodrigues * w[:, None]))
+
+
+def quaternions_to_bunge_euler(quaternions):
+    """
+    Convert unit quaternions (scalar first) to Bunge Euler angles
+    (phi1, Phi, phi2) in radians, each in [0, 2 pi), shape (N, 3).
+
+    Uses the conventions of Rowenhorst et al., Modelling Simul. Mater. Sci.
+    Eng. 23 (2015) 083501, with P = -1.
+    """
+    q = np.array(quaternions, dtype=np.float64)
+    q[q[:, 0] < 0] *= -1
+    q0, q1, q2, q3 = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    P = -1.0
+    q03 = q0 * q0 + q3 * q3
+    q12 = q1 * q1 + q2 * q2
+    chi = np.sqrt(q03 * q12)
+
+    euler = np.empty((len(q), 3))
+    tol = 1e-12
+    no_tilt = chi < tol
+    only_z = no_tilt & (q12 < tol)
+    only_xy = no_tilt & ~only_z
+    general = ~no_tilt
+
+    euler[only_z, 0] = np.arctan2(-2.0 * P * q0[only_z] * q3[only_z], q0[only_z]**2 - q3[only_z]**2)
+    euler[only_z, 1] = 0.0
+    euler[only_z, 2] = 0.0
+
+    euler[only_xy, 0] = np.arctan2(2.0 * q1[only_xy] * q2[only_xy], q1[only_xy]**2 - q2[only_xy]**2)
+    euler[only_xy, 1] = np.pi
+    euler[only_xy, 2] = 0.0
+
+    g = general
+    c = chi[g]
+    euler[g, 0] = np.arctan2((q1[g] * q3[g] - P * q0[g] * q2[g]) / c, (-P * q0[g] * q1[g] - q2[g] * q3[g]) / c)
+    euler[g, 1] = np.arctan2(2.0 * c, q03[g] - q12[g])
+    euler[g, 2] = np.arctan2((P * q0[g] * q2[g] + q1[g] * q3[g]) / c, (q2[g] * q3[g] - P * q0[g] * q1[g]) / c)
+
+    return np.mod(euler, 2.0 * np.pi)
+
+
+def mean_orientation(quaternions):
+    """
+    Return the mean of unit quaternions as the eigenvector of the largest
+    eigenvalue of sum(q q^T), which does not depend on the sign of each q.
+    Crystal symmetry is not taken into account.
+    """
+    q = np.asarray(quaternions, dtype=np.float64)
+    eigenvalues, eigenvectors = np.linalg.eigh(q.T.dot(q))
+    mean = eigenvectors[:, -1]
+    return mean if mean[0] >= 0 else -mean
+
+
+def misorientation_angles(quaternions, reference):
+    """Rotation angles (radians) between each quaternion and a reference quaternion, ignoring crystal symmetry"""
+    dots = np.abs(np.asarray(quaternions).dot(reference))
+    return 2.0 * np.arccos(np.clip(dots, 0.0, 1.0))
+
+
+def texture_summary(quaternions):
+    """
+    Summarize a set of orientations.
+
+    Returns:
+
+        summary: dict
+          'grain_count', 'mean_quaternion', 'mean_euler' (Bunge, degrees),
+          'misorientation_mean', 'misorientation_std', 'misorientation_median',
+          'misorientation_max' (degrees, to the mean orientation)
+
+    """
+    mean = mean_orientation(quaternions)
+    angles = np.degrees(misorientation_angles(quaternions, mean))
+    return {
+        'grain_count': int(len(quaternions)),
+        'mean_quaternion': mean,
+        'mean_euler': np.degrees(quaternions_to_bunge_euler(mean[None, :])[0]),
+        'misorientation_mean': float(angles.mean()),
+        'misorientation_std': float(angles.std()),
+        'misorientation_median': float(np.median(angles)),
+        'misorientation_max': float(angles.max())
+    }
+
+
+def sidecar_path(file_name):
+    """Path of the binary sidecar of an orientations file, e.g. orientations.npz"""
+    return os.path.splitext(file_name)[0] + '.npz'
+
+
+def write_orientations_sidecar(file_name, grain_ids, rodrigues, quaternions, euler):
+    """
+    Write grain_ids, rodrigues, quaternions and euler (Bunge, radians) arrays
+    to the compressed .npz sidecar of file_name and return its path
+    """
+    out_path = sidecar_path(file_name)
+    np.savez_compressed(out_path, grain_ids=grain_ids, rodrigues=rodrigues, quaternions=quaternions, euler=euler)
+    return out_path
+
+
+def process_orientations_file(file_name, write_sidecar=True):
+    """
+    Read an orientations file, convert all orientations and compute the
+    texture summary.
+
+    Returns:
+
+        summary: dict
+          Result of texture_summary
+
+        sidecar: str or None
+          Path of the written .npz sidecar
+
+    Results are kept for the lifetime of the process while the sidecar exists.
+    """
+    st = os.stat(file_name)
+    key = (os.path.abspath(file_name), st.st_mtime_ns, st.st_size, write_sidecar)
+    cached = _summary_cache.get(key)
+    if cached is not None and (cached[1] is None or os.path.exists(cached[1])):
+        return cached
+
+    grain_ids, rodrigues = load_orientations(file_name)
+    quaternions = rodrigues_to_quaternions(rodrigues)
+    summary = texture_summary(quaternions)
+    sidecar = None
+    if write_sidecar:
+        euler = quaternions_to_bunge_euler(quaternions)
+        sidecar = write_orientations_sidecar(file_name, grain_ids, rodrigues, quaternions, euler)
+    _summary_cache[key] = (summary, sidecar)
+    return summary, sidecar
+
+
+def add_orientation_measurements(batch, summary):
+    """Queue the texture summary on a MeasurementBatch"""
+    batch.add_integer('Number of grains', summary['grain_count'])
+    batch.add_vector('Mean orientation (quaternion)', summary['mean_quaternion'].tolist())
+    batch.add_vector('Mean orientation (Bunge Euler angles)', summary['mean_euler'].tolist(), unit='degrees')
+    batch.add_number('Mean misorientation from mean orientation', summary['misorientation_mean'], unit='degrees')
+    batch.add_number('Standard deviation of misorientation from mean orientation', summary['misorientation_std'], unit='degrees')
+    batch.add_number('Median misorientation from mean orientation', summary['misorientation_median'], unit='degrees')
+    batch.add_number('Maximum misorientation from mean orientation', summary['misorientation_max'], unit='degrees')
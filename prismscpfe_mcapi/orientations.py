@@ -2,13 +2,22 @@
 
 import sys
 import os.path
+import asyncio
 import subprocess
 import prismscpfe_mcapi
+from prismscpfe_mcapi.aio import get_client, run_sync
+from prismscpfe_mcapi.journal import begin_operation, add_resume_options
+from prismscpfe_mcapi.cache import add_cache_options, invalidate, processes_with_template
+from prismscpfe_mcapi.scheduler import add_scheduler_options
+from prismscpfe_mcapi.tracing import add_profile_options
+from prismscpfe_mcapi.samples import SampleIndex
+from prismscpfe_mcapi.measurements import MeasurementBatch
+from prismscpfe_mcapi.validation import add_validation_options, check_app_directory
 from materials_commons.cli import ListObjects
 from materials_commons.cli.functions import make_local_project, make_local_expt
 
 
-def get_Orientations_sample(expt, Orientations_id=None, out=sys.stdout):
+def get_Orientations_sample(expt, sample_id=None, index=None, out=sys.stdout):
     """
     Return a PRISMS-CPFE Orientations sample from provided Materials Commons
     experiment and optionally explicit sample id. Returns None if sample_id is None
@@ -18,8 +27,11 @@ def get_Orientations_sample(expt, Orientations_id=None, out=sys.stdout):
 
         expt: mcapi.Experiment object
 
-        sample_id: str, optional (default=None)
-          Sample id to use explicitly
+        sample_id: list of str, optional (default=None)
+          Sample id to use explicitly, as sample_id[0]
+
+        index: SampleIndex, optional
+          Index of the experiment samples to reuse; built if not given
 
     Returns:
 
@@ -28,7 +40,7 @@ def get_Orientations_sample(expt, Orientations_id=None, out=sys.stdout):
 
     """
     if sample_id is None:
-        candidate_Orientations = [proc for proc in expt.get_all_processes() if proc.template_id == prismscpfe_mcapi.templates['Orientations']]
+        candidate_Orientations = processes_with_template(expt, prismscpfe_mcapi.templates['Orientations'])
         if len(candidate_Orientations) == 0:
             out.write('Did not find a Orientations sample.\n')
             out.write('Use \'mc prismscpfe Orientations --create\' to create a Orientations sample, or --Orientations-id <id> to specify explicitly.\n')
@@ -45,27 +57,14 @@ def get_Orientations_sample(expt, Orientations_id=None, out=sys.stdout):
         Orientations_proc.decorate_with_output_samples()
         return Orientations_proc.output_samples[0]
     else:
-        # print("The sample id is: ")
-        # print(sample_id[0])
-
-        # This is broken, temporarily replaced by a more complicated work-around
-        # Orientations = expt.get_sample_by_id(sample_id)
-
-        sample_found = False
-        for proc in expt.get_all_processes():
-            for sample in proc.get_all_samples():
-                if sample.id == sample_id[0]:
-                    # print("Sample found with id of: ", sample.id)
-                    Orientations = sample
-                    sample_found = True
-                    break
-            if sample_found:
-                break
+        if index is None:
+            index = SampleIndex(expt)
+        Orientations = index.get(sample_id[0])
 
     return Orientations
 
 
-def create_Orientations_sample(expt, sample_name=None, verbose=False):
+def create_Orientations_sample(expt, sample_name=None, verbose=False, statistics=True, app_dir='.', resume=False):
     """
     Create a PRISMS-CPFE Orientations Sample
 
@@ -81,31 +80,64 @@ def create_Orientations_sample(expt, sample_name=None, verbose=False):
         verbose: bool
           Print messages about uploads, etc.
 
+        statistics: bool
+          Parse the orientations, add texture summary measurements and upload
+          a binary .npz sidecar with grain ids, Rodrigues vectors, quaternions
+          and Bunge Euler angles
+
+        app_dir: str
+          PRISMS-CPFE app directory containing the input files, default is the
+          current directory
+
+        resume: bool
+          Continue the last create of this sample for app_dir in expt, as
+          recorded in the project's operation journal, repeating only the
+          steps that did not complete
+
     Returns:
 
         proc: mcapi.Process instance
           The Process that created the sample
     """
+    return run_sync(create_Orientations_sample_async(expt, sample_name, verbose, statistics, app_dir, resume))
+
+
+async def create_Orientations_sample_async(expt, sample_name=None, verbose=False, statistics=True, app_dir='.', resume=False, client=None):
+    """Coroutine version of create_Orientations_sample; client defaults to the shared get_client()"""
+    if client is None:
+        client = get_client()
     template_id = prismscpfe_mcapi.templates['Orientations']
 
+    operation = begin_operation(expt, 'Orientations', app_dir, resume)
+    if operation.finished:
+        print("Already created: process " + operation.process_id)
+        operation.journal.close()
+        return await client.get_process(expt, operation.process_id)
+
     print("The template ID is: " + template_id)
 
-    file_name = "orientations.txt"
-    proc = expt.create_process_from_template(template_id)
-    proc.rename('Orientations Input')
-    
+    # imported here so that NumPy is only loaded when a sample is created
+    from prismscpfe_mcapi.orientation_data import process_orientations_file, add_orientation_measurements
+
+    file_name = os.path.join(app_dir, "orientations.txt")
+    upload_names = [file_name]
+    if statistics:
+        summary, sidecar = process_orientations_file(file_name)
+        upload_names.append(sidecar)
+
     if sample_name is None:
         sample_name = "Orientations Input"
-    new_sample = proc.create_samples([sample_name])
-    proc = expt.get_process_by_id(proc.id)
-    Orientations_file = expt.project.add_file_by_local_path(file_name, verbose=verbose)
-    proc.add_files([Orientations_file])
-    
-  
+    proc, new_sample = await client.create_process(expt, template_id, 'Orientations Input', [sample_name], operation=operation)
+
+    batch = MeasurementBatch(expt, proc, samples=new_sample)
+    if statistics:
+        add_orientation_measurements(batch, summary)
+    await asyncio.gather(client.upload_and_attach(expt.project, proc, upload_names, operation=operation, verbose=verbose), client.flush(batch, operation))
 
         # new_sample_list[-1][0].pretty_print(shift=0, indent=2, out=sys.stdout)
 
-    return expt.get_process_by_id(proc.id)
+    operation.finish()
+    return await client.get_process(expt, proc.id)
 
 
 class OrientationsSubcommand(ListObjects):
@@ -115,21 +147,30 @@ class OrientationsSubcommand(ListObjects):
         super(OrientationsSubcommand, self).__init__(["prismscpfe", "Orientations"], "Orientations", "Orientations", desc="Creates a set of entities (samples) representing the Orientations.", expt_member=True, list_columns=['name', 'owner', 'template_name', 'id', 'mtime'], creatable=True)
 
     def get_all_from_experiment(self, expt):
-        return [proc for proc in expt.get_all_processes() if proc.template_id == prismscpfe_mcapi.templates[self.cmdname[-1]]]
+        return processes_with_template(expt, prismscpfe_mcapi.templates[self.cmdname[-1]])
 
     def get_all_from_project(self, proj):
-        return [proc for proc in proj.get_all_processes() if proc.template_id == prismscpfe_mcapi.templates[self.cmdname[-1]]]
+        return processes_with_template(proj, prismscpfe_mcapi.templates[self.cmdname[-1]])
 
     def create(self, args, out=sys.stdout):
+        if not args.skip_validation and not check_app_directory('Orientations', out=out):
+            return
         proj = make_local_project()
         expt = make_local_expt(proj)
-        proc = create_Orientations_sample(expt, verbose=True)
+        proc = create_Orientations_sample(expt, verbose=True, statistics=not args.no_statistics, resume=args.resume)
+        invalidate(expt, proj)
         out.write('Created process: ' + proc.name + ' ' + proc.id + '\n')
 
 
     def add_create_options(self, parser):
-        """
-        """
+        no_statistics_help = "Do not parse orientations.txt for texture measurements and the .npz sidecar"
+        parser.add_argument('--no-statistics', action="store_true", default=False, help=no_statistics_help)
+
+        add_validation_options(parser)
+        add_cache_options(parser)
+        add_profile_options(parser)
+        add_scheduler_options(parser)
+        add_resume_options(parser)
 
     def list_data(self, obj):
         return {
@@ -0,0 +1,213 @@
+"""Typed schema of the parameters.in entries recorded as Numerical Parameters measurements"""
+
+# Value types of parameters, and the MeasurementBatch method recording each
+PARAMETER_TYPES = {
+    'int': 'add_integer',
+    'double': 'add_number',
+    'bool': 'add_boolean',
+    'string': 'add_string',
+    'list of double': 'add_vector'
+}
+
+_TRUE = ('true', 'yes', 'on')
+_FALSE = ('false', 'no', 'off')
+
+
+def _to_bool(text):
+    value = text.strip().lower()
+    if value in _TRUE:
+        return True
+    if value in _FALSE:
+        return False
+    raise ValueError("not a bool: '" + text + "'")
+
+
+def _to_doubles(text):
+    return [float(v) for v in text.replace(',', ' ').split()]
+
+
+_CONVERTERS = {
+    'int': lambda text: int(text.strip()),
+    'double': lambda text: float(text.strip()),
+    'bool': _to_bool,
+    'string': lambda text: text,
+    'list of double': _to_doubles
+}
+
+
+class Parameter(object):
+    """
+    One parameters.in entry recorded as a measurement.
+
+    Arguments:
+
+        name: str
+          Entry name, as in 'set <name> = <value>'
+
+        type: str
+          One of PARAMETER_TYPES
+
+        default: str
+          Value recorded if the entry is not set, as it would be written in
+          parameters.in; converted once, when the schema is compiled
+
+        subsection: str, optional
+          For entries inside numbered subsections, the subsection name as
+          written in parameters.in; the entry of every numbered subsection of
+          that name is recorded, and there is no default
+
+    """
+
+    def __init__(self, name, type, default, subsection=''):
+        if type not in PARAMETER_TYPES:
+            raise ValueError(name + ": unknown parameter type '" + str(type) + "'")
+        self.name = name
+        self.type = type
+        self.subsection = subsection
+        self.default = None if subsection else _CONVERTERS[type](default)
+        # ParameterIndex keys of this entry start with the subsection name
+        # without its last character
+        self._subsection_base = subsection[:-1]
+
+    def convert(self, text):
+        """
+        Convert a value read from parameters.in to this parameter's type.
+
+        Returns:
+
+            (type, value): the value converted, or ('string', text) if it
+            does not parse as this type
+
+        """
+        try:
+            return self.type, _CONVERTERS[self.type](text)
+        except ValueError:
+            return 'string', text
+
+    def values(self, index):
+        """
+        Yield (measurement name, type, value) for this parameter in a
+        ParameterIndex: the value set in the file, the default if it is not
+        set, or one value per subsection setting it.
+        """
+        if not self.subsection:
+            text = index.entries.get(self.name)
+            if text is None:
+                yield (self.name, self.type, self.default)
+            else:
+                yield (self.name,) + self.convert(text)
+            return
+        for key in index.subsection_keys(self.name):
+            if key.startswith(self._subsection_base):
+                yield (key,) + self.convert(index.entries[key])
+
+
+def compile_schema(table):
+    """Build the list of Parameter from (name, type, default[, subsection]) rows, checking each row"""
+    return [Parameter(*row) for row in table]
+
+
+# (name, type, default value[, subsection]) of every recorded parameter, in
+# the order of parameters.in
+PARAMETER_SCHEMA = compile_schema([
+    ('Order of finite elements', 'int', '1'),
+    ('Order of quadrature', 'int', '1'),
+    ('Domain size X', 'double', '-1'),
+    ('Domain size Y', 'double', '-1'),
+    ('Domain size Z', 'double', '-1'),
+    ('Subdivisions X', 'int', '1'),
+    ('Subdivisions Y', 'int', '1'),
+    ('Subdivisions Z', 'int', '1'),
+    ('Refine factor', 'int', '-1'),
+    ('Write Mesh To EPS', 'bool', 'false'),
+
+    ('Write Output', 'bool', 'false'),
+    ('Output Directory', 'string', '.'),
+    ('Skip Output Steps', 'int', '-1'),
+
+    ('Output Equivalent strain', 'bool', 'false'),
+    ('Output Equivalent stress', 'bool', 'false'),
+    ('Output Grain ID', 'bool', 'false'),
+    ('Output Twin fractions', 'bool', 'false'),
+
+    ('Boundary condition filename', 'string', 'BCinfo.txt'),
+    ('BC file number of header lines', 'int', '2'),
+    ('Number of boundary conditions', 'int', '-1'),
+    ('Enable cyclic loading', 'bool', 'false'),
+    ('Cyclic loading face', 'int', '-1'),
+    ('Cyclic loading direction', 'int', '-1'),
+    ('Quarter cycle time', 'double', '-1'),
+
+    ('Time increments', 'double', '-1'),
+    ('Total time', 'double', '-1'),
+    ('Maximum linear solver iterations', 'int', '-1'),
+    ('Relative linear solver tolerance', 'double', '-1'),
+    ('Maximum non linear iterations', 'int', '-1'),
+    ('Absolute nonLinear solver tolerance', 'double', '-1'),
+    ('Relative nonLinear solver tolerance', 'double', '-1'),
+    ('Stop on convergence failure', 'bool', 'false'),
+    ('Enable adaptive Time stepping', 'bool', 'false'),
+    ('Adaptive load step factor', 'double', '-1'),
+    ('Adaptive load increase Factor', 'double', '-1'),
+    ('Succesive increment for increasing time step', 'int', '1'),
+
+    ('Crystal Structure', 'string', 'fcc'),
+
+    ('Elastic Stiffness row 1', 'list of double', '0,0,0,0,0,0'),
+    ('Elastic Stiffness row 2', 'list of double', '0,0,0,0,0,0'),
+    ('Elastic Stiffness row 3', 'list of double', '0,0,0,0,0,0'),
+    ('Elastic Stiffness row 4', 'list of double', '0,0,0,0,0,0'),
+    ('Elastic Stiffness row 5', 'list of double', '0,0,0,0,0,0'),
+    ('Elastic Stiffness row 6', 'list of double', '0,0,0,0,0,0'),
+    ('Number of Slip Systems', 'int', '-1'),
+    ('Latent Hardening Ratio', 'double', '-1'),
+    ('Initial Slip Resistance', 'list of double', '0,0,0,0,0,0'),
+    ('Initial Hardening Modulus', 'list of double', '0,0,0,0,0,0'),
+    ('Power Law Exponent', 'list of double', '0,0,0,0,0,0'),
+    ('Saturation Stress', 'list of double', '0,0,0,0,0,0'),
+    ('Slip Directions File', 'string', 'slipDirections.txt'),
+    ('Slip Normals File', 'string', 'slipNormals.txt'),
+    ('Backstress Factor', 'double', '-1'),
+    ('Twinning enabled', 'bool', 'false'),
+    ('Number of Twin Systems', 'int', '-1'),
+    ('Initial Slip Resistance Twin', 'list of double', '0,0,0,0,0,0'),
+    ('Initial Hardening Modulus Twin', 'list of double', '0,0,0,0,0,0'),
+    ('Power Law Exponent Twin', 'list of double', '0,0,0,0,0,0'),
+    ('Saturation Stress Twin', 'list of double', '0,0,0,0,0,0'),
+    ('Twin Saturation Factor', 'double', '-1'),
+    ('Twin Threshold Fraction', 'double', '-1'),
+    ('Twin Directions File', 'string', 'twinDirections.txt'),
+    ('Twin Normals File', 'string', 'twinNormals.txt'),
+    ('Characteristic Twin Shear', 'double', '-1'),
+
+    ('Stress Tolerance', 'double', '-1'),
+    ('Max Plastic Slip L2 Norm', 'double', '-1'),
+    ('Max Slip Search Iterations', 'int', '-1'),
+    ('Max Solver Iterations', 'int', '-1'),
+
+    ('Voxels in X direction', 'int', '-1'),
+    ('Voxels in Y direction', 'int', '-1'),
+    ('Voxels in Z direction', 'int', '-1'),
+    ('Grain ID file name', 'string', 'grainID.txt'),
+    ('Header Lines GrainID File', 'int', '-1'),
+    ('Orientations file name', 'string', 'orientations.txt')
+])
+
+PARAMETERS_BY_NAME = {parameter.name: parameter for parameter in PARAMETER_SCHEMA}
+
+
+def parameter_values(index, schema=PARAMETER_SCHEMA):
+    """
+    Return (measurement name, type, value) for every parameter of schema in
+    a ParameterIndex, in schema order, with values converted to their type.
+    """
+    values = []
+    for parameter in schema:
+        values.extend(parameter.values(index))
+    return values
+
+
+def add_parameter_measurements(batch, values):
+    """Queue the result of parameter_values on a MeasurementBatch, each with its typed measurement"""
+    for name, type, value in values:
+        getattr(batch, PARAMETER_TYPES[type])(name, value)
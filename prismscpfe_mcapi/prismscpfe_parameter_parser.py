@@ -6,32 +6,144 @@ import os
 import datetime
 import time
 import sys
+from prismscpfe_mcapi.tracing import traced
 
 
 # ----------------------------------------------------------------------------------------
-# Function to extract a specific parameter from a PRISMS-CPFE input file
+# Indexed, cached view of a PRISMS-CPFE input file
 # ----------------------------------------------------------------------------------------
-def parameter_extractor(file_name, entry_name):
-    parameter_value = 0
+class ParameterIndex(object):
+    """
+    A PRISMS-CPFE input file parsed once into a dictionary.
+
+    Plain entries are keyed by their name ('Number of Slip Systems'), entries
+    inside a subsection by 'subsection name (index): entry name', matching the
+    keys produced by parse_parameters_file(). Use ParameterIndex.load() to get a
+    cached instance; the file is only re-read when its path, mtime or size change.
+
+    Attributes:
+
+        file_name: str
+          Absolute path to the parsed file
+
+        entries: dict
+          'key' -> 'value' for every 'set' line in the file
+
+    """
+    _cache = {}
+
+    def __init__(self, file_name, entries, bare_entries, subsection_keys=None):
+        self.file_name = file_name
+        self.entries = entries
+        self._bare_entries = bare_entries
+        self._subsection_keys = subsection_keys if subsection_keys is not None else {}
+
+    @classmethod
+    def load(cls, file_name="parameters.in"):
+        """
+        Return the ParameterIndex for file_name, parsing it only if it changed
+        since the last call.
+        """
+        path = os.path.abspath(file_name)
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached = cls._cache.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        index = cls.parse(path)
+        cls._cache[path] = (stamp, index)
+        return index
+
+    @classmethod
+    @traced('parse')
+    def parse(cls, file_name):
+        """Parse file_name in a single pass, without using the cache"""
+        entries = {}
+        bare_entries = {}
+        subsection_keys = {}
+        in_subsection = False
+        subsection_name = ""
+
+        with open(file_name) as f:
+            for line in f:
+
+                # First make sure line isn't a comment or blank line
+                stripped_line = line.strip()
+                if len(stripped_line) < 1 or stripped_line[0] == "#":
+                    continue
+
+                # Check if entering or leaving a subsection
+                split_line = stripped_line.split()
+                if split_line[0] == "subsection":
+                    in_subsection = True
+                    subsection_name = ' '.join(split_line[1:-1])
+                    subsection_name = subsection_name[:-1]
+                    subsection_name = subsection_name + " (" + split_line[-1] + ")"
+                    continue
+                elif split_line[0] == "end":
+                    in_subsection = False
+                    continue
+                elif split_line[0] != "set":
+                    continue
+
+                entry_name, entry_value = parse_line(split_line)
+                if in_subsection:
+                    key = subsection_name + ": " + entry_name
+                    if key not in entries:
+                        subsection_keys.setdefault(entry_name, []).append(key)
+                    entries[key] = entry_value
+                else:
+                    entries[entry_name] = entry_value
+                bare_entries["".join(entry_name.split())] = entry_value
+
+        return cls(os.path.abspath(file_name), entries, bare_entries, subsection_keys)
+
+    @staticmethod
+    def _normalize(key):
+        if ":" in key:
+            subsection, entry_name = key.split(":", 1)
+            return " ".join(subsection.split()) + ": " + " ".join(entry_name.split())
+        return " ".join(key.split())
+
+    def get(self, key, default=None):
+        """
+        Return the value for 'key' or 'subsection: key', or default if not set.
+        Whitespace in key is not significant.
+        """
+        return self.entries.get(self._normalize(key), default)
+
+    def get_any(self, entry_name, default=None):
+        """
+        Return the value of the last 'set entry_name' line in the file, inside a
+        subsection or not, or default if there is none.
+        """
+        return self._bare_entries.get("".join(entry_name.split()), default)
+
+    def subsection_keys(self, entry_name):
+        """Return the keys of every 'set entry_name' line inside a subsection, in file order"""
+        return self._subsection_keys.get(entry_name, [])
+
+    def __getitem__(self, key):
+        return self.entries[self._normalize(key)]
+
+    def __contains__(self, key):
+        return self._normalize(key) in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
 
-    num_words_in_entry_name = len(entry_name.split())
-    entry_name_no_whitespace = "".join(entry_name.split())
 
-    f = open(file_name)
-    for line in f:
-        words_in_line = line.split()
-        if len(words_in_line) > 0:
-            if words_in_line[0] == "set":
-                if (len(words_in_line) > num_words_in_entry_name+2):
-                    prospective_match = ""
-                    for word in range(1, 1+num_words_in_entry_name):
-                        prospective_match += words_in_line[word]
-                    if (prospective_match == entry_name_no_whitespace):
-                        if len(words_in_line) >= 2+num_words_in_entry_name:
-                            parameter_value = words_in_line[2+num_words_in_entry_name]
-
-    f.close()
-    return parameter_value
+# ----------------------------------------------------------------------------------------
+# Function to extract a specific parameter from a PRISMS-CPFE input file
+# ----------------------------------------------------------------------------------------
+def parameter_extractor(file_name, entry_name):
+    value = ParameterIndex.load(file_name).get_any(entry_name)
+    if value is None or len(value.split()) < 1:
+        return 0
+    return value.split()[0]
 
 
 # ----------------------------------------------------------------------------------------
@@ -61,40 +173,5 @@ def parse_line(split_line):
 # ----------------------------------------------------------------------------------------
 # This file reads a PRISMS-CPFE input file and turns it into a set of key-value pairs that
 # are stored in a dictionary
-def parse_parameters_file():
-
-    file_name = "parameters.in"
-
-    parameter_set = {}
-    in_subsection = False
-
-    f = open(file_name)
-    for line in f:
-
-        # First make sure line isn't a comment or blank line
-        stripped_line = line.strip()
-        if len(stripped_line) < 1 or stripped_line[0] is "#":
-            continue
-
-        # Check if entering or leaving a subsection (not needed once updates are complete)
-        split_line = stripped_line.split()
-        if split_line[0] == "subsection":
-            in_subsection = True
-            subsection_name = ' '.join(split_line[1:-1])
-            subsection_name = subsection_name[:-1]
-            subsection_name = subsection_name + " (" + split_line[-1] + ")"
-            # print("subsection name: " + subsection_name)
-
-        elif split_line[0] == "end":
-            in_subsection = False
-
-        # For non-subsection variables
-        if in_subsection is False and split_line[0] == "set":
-            parameter_key_value_pair = parse_line(split_line)
-            parameter_set[parameter_key_value_pair[0]] = parameter_key_value_pair[1]
-        elif in_subsection is True and split_line[0] == "set":
-            parameter_key_value_pair = parse_line(split_line)
-            parameter_set[subsection_name + ": " + parameter_key_value_pair[0]] = parameter_key_value_pair[1]
-            # print(subsection_name + ": " + parameter_key_value_pair[0])
-
-    return parameter_set
+def parse_parameters_file(file_name="parameters.in"):
+    return dict(ParameterIndex.load(file_name).entries)
@@ -0,0 +1,46 @@
+"""Sample lookup helpers for PRISMS-CPFE experiments"""
+
+from prismscpfe_mcapi.cache import samples_by_id
+
+
+class SampleIndex(object):
+    """
+    Index of every sample in an experiment by sample id, built from a single
+    expt.get_all_samples() call (or the metadata cache) and reused for all
+    lookups in a command. A lookup that misses a cached index fetches the
+    samples once more, so newly created samples are found.
+
+    Arguments:
+
+        expt: mcapi.Experiment object
+
+        refresh: bool, optional
+          Ignore cached sample metadata; default from cache.set_cache_options
+
+    """
+
+    def __init__(self, expt, refresh=None):
+        self.expt = expt
+        self.samples = samples_by_id(expt, refresh=refresh)
+        self._refreshed = bool(refresh)
+
+    def _refresh_on_miss(self, sample_id):
+        if sample_id not in self.samples and not self._refreshed:
+            self.samples = samples_by_id(self.expt, refresh=True)
+            self._refreshed = True
+
+    def get(self, sample_id, default=None):
+        """Return the sample with id sample_id, or default if it is not in the experiment"""
+        self._refresh_on_miss(sample_id)
+        return self.samples.get(sample_id, default)
+
+    def __contains__(self, sample_id):
+        self._refresh_on_miss(sample_id)
+        return sample_id in self.samples
+
+    def __len__(self):
+        return len(self.samples)
+
+    def missing(self, sample_ids):
+        """Return the ids in sample_ids that are not in the experiment"""
+        return [sample_id for sample_id in sample_ids if sample_id not in self]
@@ -0,0 +1,291 @@
+"""Rate limiting, adaptive concurrency and retries for Materials Commons calls"""
+
+import time
+import random
+import argparse
+import threading
+from prismscpfe_mcapi import tracing
+
+# Requests per second sustained, and the burst allowed above that
+DEFAULT_RATE = 20.0
+DEFAULT_BURST = 40
+
+# Bounds of the adaptive number of requests in flight
+DEFAULT_MIN_CONCURRENCY = 1
+DEFAULT_MAX_CONCURRENCY = 32
+DEFAULT_INITIAL_CONCURRENCY = 4
+
+# Attempts per idempotent request, and the backoff between them
+DEFAULT_RETRIES = 6
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 30.0
+
+# HTTP statuses that mean the server is overloaded or temporarily unavailable
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504)
+
+
+def _status_of(error):
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+
+def is_throttled(error):
+    """True if the server refused a request with 429 Too Many Requests"""
+    return _status_of(error) == 429
+
+
+def is_connection_error(error):
+    """True if a request failed to connect or its connection was dropped"""
+    try:
+        import requests
+        if isinstance(error, requests.exceptions.ConnectionError):
+            return True
+    except ImportError:
+        pass
+    return isinstance(error, ConnectionError)
+
+
+def is_transient(error):
+    """True for errors worth retrying: connection errors, timeouts, throttling and 5xx responses"""
+    try:
+        import requests
+        if isinstance(error, requests.exceptions.Timeout):
+            return True
+    except ImportError:
+        pass
+    if is_connection_error(error) or isinstance(error, TimeoutError):
+        return True
+    return _status_of(error) in TRANSIENT_STATUSES
+
+
+def is_unprocessed(error):
+    """True for errors after which the server has not acted on a request: throttling and connection errors"""
+    return is_throttled(error) or is_connection_error(error)
+
+
+def _retry_after(error):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestScheduler(object):
+    """
+    Admit Materials Commons requests through a token bucket, bounded by an
+    AIMD (additive increase, multiplicative decrease) concurrency limit, and
+    retry transient failures with exponential backoff and full jitter.
+
+    The concurrency limit grows by about one request per round of successful
+    requests and halves when the server throttles, fails with a 5xx or times
+    out (at most once per latency of the failed request), or when a request
+    takes longer than latency_target.
+
+    Arguments:
+
+        rate: float
+          Requests per second admitted on average; 0 for no rate limit
+
+        burst: int
+          Requests admitted at once after an idle period
+
+        min_concurrency, max_concurrency, initial_concurrency: int
+          Bounds and starting value of the number of requests in flight
+
+        retries: int
+          Attempts per idempotent request
+
+        base_delay, max_delay: float
+          Backoff before retry n is uniform in [0, min(max_delay, base_delay * 2**n)]
+
+        latency_target: float, optional
+          Seconds; slower successful requests also decrease the concurrency limit
+
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 min_concurrency=DEFAULT_MIN_CONCURRENCY, max_concurrency=DEFAULT_MAX_CONCURRENCY, initial_concurrency=DEFAULT_INITIAL_CONCURRENCY,
+                 retries=DEFAULT_RETRIES, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY, latency_target=None):
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.min_concurrency = max(1, int(min_concurrency))
+        self.max_concurrency = max(self.min_concurrency, int(max_concurrency))
+        self.limit = float(min(max(initial_concurrency, self.min_concurrency), self.max_concurrency))
+        self.retries = max(1, int(retries))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.latency_target = latency_target
+
+        self._cond = threading.Condition()
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        self._in_flight = 0
+        self._last_decrease = 0.0
+
+        self.stats = {'requests': 0, 'retries': 0, 'failures': 0, 'throttled': 0}
+
+    def _take_token(self):
+        """With self._cond held: take a token, or return the seconds until one is available"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return 0.0
+        return (1.0 - self._tokens) / self.rate
+
+    def _acquire(self):
+        with self._cond:
+            while True:
+                if self._in_flight >= int(self.limit):
+                    self._cond.wait()
+                    continue
+                wait = self._take_token()
+                if wait == 0.0:
+                    self._in_flight += 1
+                    return
+                self._cond.wait(wait)
+
+    def _release(self, started, congested):
+        latency = time.monotonic() - started
+        with self._cond:
+            self._in_flight -= 1
+            if self.latency_target is not None and latency > self.latency_target:
+                congested = True
+            if congested:
+                # one decrease per round trip, not one per request failing in the same burst
+                if started >= self._last_decrease:
+                    self.limit = max(self.min_concurrency, self.limit / 2.0)
+                    self._last_decrease = time.monotonic()
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    def _backoff(self, attempt, error):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        time.sleep(delay)
+
+    def _run(self, func, args, kwargs, retryable):
+        tracer = tracing.get_tracer()
+        if tracer is None:
+            return self._attempt(func, args, kwargs, retryable, [0])
+        attempts = [0]
+        error = None
+        started = time.perf_counter()
+        try:
+            return self._attempt(func, args, kwargs, retryable, attempts)
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            tracer.record(tracing.call_phase(func), tracing.call_name(func), started, time.perf_counter() - started,
+                nbytes=tracing.request_bytes(func, args), round_trips=attempts[0], retries=max(0, attempts[0] - 1), error=error)
+
+    def _attempt(self, func, args, kwargs, retryable, attempts):
+        """Call func until it succeeds or retryable(error) is False; attempts[0] counts the calls made"""
+        attempt = 0
+        while True:
+            self._acquire()
+            started = time.monotonic()
+            attempts[0] += 1
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                transient = is_transient(e)
+                self._release(started, transient)
+                with self._cond:
+                    self.stats['requests'] += 1
+                    if is_throttled(e):
+                        self.stats['throttled'] += 1
+                attempt += 1
+                if not retryable(e) or attempt >= self.retries:
+                    with self._cond:
+                        self.stats['failures'] += 1
+                    raise
+                with self._cond:
+                    self.stats['retries'] += 1
+                self._backoff(attempt, e)
+                continue
+            self._release(started, False)
+            with self._cond:
+                self.stats['requests'] += 1
+            return result
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call func(*args, **kwargs) once a request is admitted. Only retried if
+        the server throttled it, since repeating it could duplicate its effect.
+        """
+        return self._run(func, args, kwargs, is_throttled)
+
+    def call_idempotent(self, func, *args, **kwargs):
+        """Call func(*args, **kwargs) once admitted, retrying transient failures with backoff"""
+        return self._run(func, args, kwargs, is_transient)
+
+    def call_unprocessed(self, func, *args, **kwargs):
+        """
+        Call func(*args, **kwargs) once admitted, retrying with backoff only
+        if the server throttled it or the connection failed. For requests
+        that create something, like file uploads: after a 5xx the server may
+        have done so already, and a repeat would create a duplicate.
+        """
+        return self._run(func, args, kwargs, is_unprocessed)
+
+
+def set_scheduler_options(rate=DEFAULT_RATE, max_concurrency=DEFAULT_MAX_CONCURRENCY, retries=DEFAULT_RETRIES, latency_target=None):
+    """
+    Set the options of the RequestScheduler used by this process; takes effect
+    for the next get_scheduler()
+    """
+    global scheduler_options, _scheduler
+    scheduler_options = {
+        'rate': rate,
+        'max_concurrency': max_concurrency,
+        'retries': retries,
+        'latency_target': latency_target
+    }
+    _scheduler = None
+
+_scheduler_lock = threading.Lock()
+set_scheduler_options()
+
+
+def get_scheduler():
+    """Return the RequestScheduler shared by every Materials Commons call in this process"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler(
+                rate=scheduler_options['rate'],
+                burst=max(1, int(2 * scheduler_options['rate'])) if scheduler_options['rate'] > 0 else DEFAULT_BURST,
+                max_concurrency=scheduler_options['max_concurrency'],
+                retries=scheduler_options['retries'],
+                latency_target=scheduler_options['latency_target'])
+        return _scheduler
+
+
+def add_scheduler_options(parser):
+    """Add --rate-limit, --max-requests, --retries and --latency-target to a subcommand argument parser"""
+    rate_limit_help = "Materials Commons requests per second, 0 for no limit (default: " + str(DEFAULT_RATE) + ")"
+    parser.add_argument('--rate-limit', type=float, default=DEFAULT_RATE, help=rate_limit_help)
+    max_requests_help = "Maximum number of Materials Commons requests in flight; the actual number adapts to server errors (default: " + str(DEFAULT_MAX_CONCURRENCY) + ")"
+    parser.add_argument('--max-requests', type=int, default=DEFAULT_MAX_CONCURRENCY, help=max_requests_help)
+    retries_help = "Attempts per request that is safe to repeat (default: " + str(DEFAULT_RETRIES) + ")"
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES, help=retries_help)
+    latency_target_help = "Seconds; fewer requests are sent at once while requests take longer than this"
+    parser.add_argument('--latency-target', type=float, default=None, help=latency_target_help)
+
+
+def set_scheduler_options_from_argv(argv):
+    """Apply --rate-limit, --max-requests, --retries and --latency-target from argv, ignoring all other arguments"""
+    parser = argparse.ArgumentParser(add_help=False)
+    add_scheduler_options(parser)
+    args, unknown = parser.parse_known_args(argv)
+    set_scheduler_options(rate=args.rate_limit, max_concurrency=args.max_requests, retries=args.retries, latency_target=args.latency_target)
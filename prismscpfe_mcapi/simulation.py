@@ -1,13 +1,29 @@
 """mc prismscpfe simulation subcommand"""
 
 import sys
+import os.path
 import glob
+import asyncio
+import functools
+import threading
 import prismscpfe_mcapi
+from prismscpfe_mcapi.aio import get_client, run_sync
+from prismscpfe_mcapi.journal import begin_operation, add_resume_options
+from prismscpfe_mcapi.scheduler import add_scheduler_options
+from prismscpfe_mcapi.cache import add_cache_options, invalidate, processes_with_template
+from prismscpfe_mcapi.tracing import add_profile_options
+from prismscpfe_mcapi.samples import SampleIndex
 from prismscpfe_mcapi.numerical_parameters import get_parameters_sample
+from prismscpfe_mcapi.uploads import DEFAULT_UPLOAD_WORKERS
+from prismscpfe_mcapi.measurements import MeasurementBatch
+from prismscpfe_mcapi.compression import CODEC_EXTENSIONS, check_codec, compressed_path, compress_files, remove_compressed
+from prismscpfe_mcapi.vtu_data import read_vtu_headers, add_vtu_measurements
+from prismscpfe_mcapi.validation import add_validation_options, check_app_directory
+from prismscpfe_mcapi.watch import DEFAULT_POLL_INTERVAL, DEFAULT_STABLE_SECONDS, DEFAULT_IDLE_TIMEOUT, ResultWatcher, PvdManifest
 from materials_commons.cli import ListObjects
 from materials_commons.cli.functions import make_local_project, make_local_expt
 
-def get_simulation_sample(expt, sample_id=None, out=sys.stdout):
+def get_simulation_sample(expt, sample_id=None, index=None, out=sys.stdout):
     """
     Return a PRISMS-CPFE Simulation sample from provided Materials Commons
     experiment and optionally explicit sample id. Returns None if sample_id is None
@@ -17,8 +33,11 @@ def get_simulation_sample(expt, sample_id=None, out=sys.stdout):
 
         expt: mcapi.Experiment object
 
-        sample_id: str, optional (default=None)
-          Sample id to use explicitly
+        sample_id: list of str, optional (default=None)
+          Sample id to use explicitly, as sample_id[0]
+
+        index: SampleIndex, optional
+          Index of the experiment samples to reuse; built if not given
 
     Returns:
 
@@ -27,7 +46,7 @@ def get_simulation_sample(expt, sample_id=None, out=sys.stdout):
 
     """
     if sample_id is None:
-        candidate_simulation = [proc for proc in expt.get_all_processes() if proc.template_id == prismscpfe_mcapi.templates['simulation']]
+        candidate_simulation = processes_with_template(expt, prismscpfe_mcapi.templates['Simulation'])
         if len(candidate_simulation) == 0:
             out.write('Did not find a Crystal Plasticity Simulation sample.\n')
             out.write('Use \'mc prismscpfe simulation --create\' to create a Simulation sample, or --simulation -id <id> to specify explicitly.\n')
@@ -44,27 +63,67 @@ def get_simulation_sample(expt, sample_id=None, out=sys.stdout):
         simulation_proc.decorate_with_output_samples()
         return simulation_proc.output_samples[0]
     else:
-        # print("The sample id is: ")
-        # print(sample_id[0])
-
-        # This is broken, temporarily replaced by a more complicated work-around
-        # simulation = expt.get_sample_by_id(sample_id)
-
-        sample_found = False
-        for proc in expt.get_all_processes():
-            for sample in proc.get_all_samples():
-                if sample.id == sample_id[0]:
-                    # print("Sample found with id of: ", sample.id)
-                    simulation = sample
-                    sample_found = True
-                    break
-            if sample_found:
-                break
+        if index is None:
+            index = SampleIndex(expt)
+        simulation = index.get(sample_id[0])
 
     return simulation
 
 
-def create_simulation_sample(expt, sample_list, sample_name=None, verbose=False):
+async def _add_result_files(client, expt, proc, samples, vtu_file_names, upload_workers, compress, metadata, summary, verbose, operation=None):
+    """
+    Upload result files to proc, link them to samples and add their
+    measurements; returns their VTU headers. With an operation, files linked
+    and measurements sent by a previous run of the operation are skipped.
+    """
+    def upload_name(name):
+        return name if compress is None else compressed_path(name, compress)
+
+    def measured_step(name):
+        return 'measurements: ' + os.path.abspath(name)
+
+    headers = [None] * len(vtu_file_names)
+    if metadata:
+        headers = read_vtu_headers(vtu_file_names, workers=upload_workers)
+    header_of = dict(zip(vtu_file_names, headers))
+
+    pending = vtu_file_names
+    measured = vtu_file_names
+    if operation is not None:
+        pending = [name for name in vtu_file_names if not operation.is_linked(upload_name(name))]
+        measured = [name for name in pending if not operation.is_done(measured_step(name))]
+        summary = summary and not operation.is_done('result summary')
+
+    upload_names = pending
+    if compress is not None:
+        upload_names = compress_files(pending, compress, workers=upload_workers)
+
+    batch = MeasurementBatch(expt, proc, samples=samples)
+    if metadata:
+        add_vtu_measurements(batch, measured, [header_of[name] for name in measured], summary=False)
+        if summary:
+            add_vtu_measurements(batch, vtu_file_names, headers, per_file=False)
+
+    async def flush():
+        await client.flush(batch)
+        if operation is not None:
+            operation.done(*([measured_step(name) for name in measured] + (['result summary'] if summary else [])))
+
+    result_files, n = await asyncio.gather(
+        client.upload_and_attach(expt.project, proc, upload_names, workers=upload_workers, direction='out', operation=operation, verbose=verbose),
+        flush())
+
+    #new_sample.link_files(result_files)
+    await client.link_files(samples, result_files)
+    if operation is not None:
+        operation.record_linked(upload_names)
+    if compress is not None:
+        # kept if the upload fails, for a --resume to reuse
+        remove_compressed(upload_names)
+    return headers
+
+
+def create_simulation_sample(expt, sample_list, sample_name=None, verbose=False, upload_workers=DEFAULT_UPLOAD_WORKERS, compress=None, metadata=True, watch=None, pvd_name='results.pvd', app_dir='.', resume=False):
     """
     Create a PRISMS-CPFE Simulation Sample
 
@@ -82,50 +141,119 @@ def create_simulation_sample(expt, sample_list, sample_name=None, verbose=False)
         verbose: bool
           Print messages about uploads, etc.
 
+        upload_workers: int
+          Maximum number of files uploaded concurrently
+
+        compress: str, optional
+          'gzip' or 'zstd' to upload compressed copies of the result files,
+          named with the codec extension ('.gz' or '.zst'), written next to
+          them and deleted once uploaded
+
+        metadata: bool
+          Read the VTK XML headers of the result files and add the time steps,
+          mesh sizes, data arrays and encodings as measurements
+
+        watch: ResultWatcher, optional
+          If given, upload result files as the running simulation completes
+          them, until the watcher stops, instead of the files present now;
+          it must watch app_dir
+
+        pvd_name: str
+          In watch mode, .pvd time-series manifest of the uploaded result
+          files in app_dir, rewritten after each new file and uploaded once
+          watching ends
+
+        app_dir: str
+          PRISMS-CPFE app directory containing the input files, default is the
+          current directory
+
+        resume: bool
+          Continue the last create of the simulation for app_dir in expt, as
+          recorded in the project's operation journal: result files already
+          linked to the sample are neither uploaded nor measured again
+
     Returns:
 
         proc: mcapi.Process instance
           The Process that created the sample
     """
+    return run_sync(create_simulation_sample_async(expt, sample_list, sample_name, verbose, upload_workers, compress, metadata, watch, pvd_name, app_dir, resume))
+
+
+async def create_simulation_sample_async(expt, sample_list, sample_name=None, verbose=False, upload_workers=DEFAULT_UPLOAD_WORKERS, compress=None, metadata=True, watch=None, pvd_name='results.pvd', app_dir='.', resume=False, client=None):
+    """Coroutine version of create_simulation_sample; client defaults to the shared get_client()"""
+    if client is None:
+        client = get_client()
     template_id = prismscpfe_mcapi.templates['Simulation']
+    if compress is not None:
+        check_codec(compress)
+    if watch is not None and os.path.abspath(watch.directory) != os.path.abspath(app_dir):
+        raise ValueError("The result watcher polls " + watch.directory + ", not the app directory " + app_dir)
+
+    operation = begin_operation(expt, 'simulation', app_dir, resume)
+    if operation.finished:
+        print("Already created: process " + operation.process_id)
+        operation.journal.close()
+        return await client.get_process(expt, operation.process_id)
 
     print("The template ID is: " + template_id)
-    # Process that will create samples
-    proc = expt.create_process_from_template(template_id)
 
     # Hardcoding the name of the template
     # proc = expt.create_process_from_template('global_Create Samples')
 
-    proc.rename('Run ' + 'Simulation')
-
-    proc = expt.get_process_by_id(proc.id)
-
+    # Process that will create samples, with the input samples added
+    sample_name = "Simulation Results"
     print("Adding input sample(s)...")
-    proc.add_input_samples_to_process(sample_list)
+    proc, new_sample = await client.create_process(expt, template_id, 'Run ' + 'Simulation', [sample_name], input_samples=sample_list, operation=operation)
     print("Finshed adding input sample(s).")
 
-    sample_name = "Simulation Results"
-    new_sample = proc.create_samples([sample_name])
-
-    # Get the names of all of the *.vtu files in the cwd
-    vtu_file_names = glob.glob('*vtu')
-    print(vtu_file_names)
-
-    result_files = []
-    for vtu_file in vtu_file_names:
-        result_files.append(expt.project.add_file_by_local_path(vtu_file, verbose=verbose))
-
-      # I need to pass in the path to the PRISMS-PF app folder
-    for file in result_files:
-        file.direction = 'out'
-
-    proc.add_files(result_files)
-
-    #new_sample.link_files(result_files)
-    for sample in new_sample:
-        sample.link_files(result_files)
-
-    return expt.get_process_by_id(proc.id)
+    # I need to pass in the path to the PRISMS-PF app folder
+    if watch is None:
+        # Get the names of all of the *.vtu files in the cwd
+        vtu_file_names = glob.glob(os.path.join(app_dir, '*vtu'))
+        print(vtu_file_names)
+        await _add_result_files(client, expt, proc, new_sample, vtu_file_names, upload_workers, compress, metadata, True, verbose, operation)
+        operation.finish()
+        return await client.get_process(expt, proc.id)
+
+    print("Watching for result files in process " + proc.id + "...")
+    pvd = PvdManifest(os.path.join(app_dir, pvd_name))
+    all_names = []
+    all_headers = []
+
+    async def handle(vtu_file_names):
+        print(vtu_file_names)
+        headers = await _add_result_files(client, expt, proc, new_sample, vtu_file_names, upload_workers, compress, metadata, False, verbose, operation)
+        for name, header in zip(vtu_file_names, headers):
+            pvd.add(name, None if header is None else header['time'])
+        # kept current for viewing locally; uploaded once, when watching ends
+        pvd.write()
+        all_names.extend(vtu_file_names)
+        all_headers.extend(headers)
+
+    # the watcher polls on a thread of its own and hands new files back to this
+    # event loop. Ctrl-C cancels this coroutine instead of reaching the watcher,
+    # so it is passed on through stop, and the files already handled are then
+    # summarized as when watching ends by itself
+    loop = asyncio.get_running_loop()
+    stop = threading.Event()
+    watching = loop.run_in_executor(None, functools.partial(watch.run, lambda paths: asyncio.run_coroutine_threadsafe(handle(paths), loop).result(), stop=stop))
+    try:
+        await asyncio.shield(watching)
+    except asyncio.CancelledError:
+        stop.set()
+        await watching
+
+    if len(pvd.datasets):
+        pvd_files = await client.upload_and_attach(expt.project, proc, [pvd.path], direction='out', verbose=verbose)
+        await client.link_files(new_sample, pvd_files)
+    if metadata:
+        batch = MeasurementBatch(expt, proc, samples=new_sample)
+        add_vtu_measurements(batch, all_names, all_headers, per_file=False)
+        await client.flush(batch, operation, 'result summary')
+
+    operation.finish()
+    return await client.get_process(expt, proc.id)
 
 
 class SimulationSubcommand(ListObjects):
@@ -139,34 +267,36 @@ class SimulationSubcommand(ListObjects):
             creatable=True)
 
     def get_all_from_experiment(self, expt):
-        return [proc for proc in expt.get_all_processes() if proc.template_id == prismscpfe_mcapi.templates[self.cmdname[-1]]]
+        return processes_with_template(expt, prismscpfe_mcapi.templates['Simulation'])
 
     def get_all_from_project(self, proj):
-        return [proc for proc in proj.get_all_processes() if proc.template_id == prismscpfe_mcapi.templates[self.cmdname[-1]]]
+        return processes_with_template(proj, prismscpfe_mcapi.templates['Simulation'])
 
     def create(self, args, out=sys.stdout):
+        if not args.skip_validation and not check_app_directory('Simulation', out=out):
+            return
         proj = make_local_project()
         expt = make_local_expt(proj)
 
         # Get the necessary input samples
 
-        sample_list = []
-        for sample_id in args.input_sample_ids:
-            sample_found = False
-            for proc in expt.get_all_processes():
-                for sample in proc.get_all_samples():
-                    if sample.id == sample_id:
-                        # print("Sample found with id of: ", sample.id)
-                        matching_sample = sample
-                        sample_found = True
-                        break
-                if sample_found:
-                    break
-            sample_list.append(matching_sample)
+        index = SampleIndex(expt)
+        missing_ids = index.missing(args.input_sample_ids)
+        if len(missing_ids):
+            out.write('Did not find input sample(s): ' + ' '.join(missing_ids) + '\n')
+            out.write('Aborting\n')
+            return
+        sample_list = [index.get(sample_id) for sample_id in args.input_sample_ids]
 
         # parameters_sample = get_parameters_sample(expt, args.input_sample_ids[0], out)
 
-        proc = create_simulation_sample(expt, sample_list, verbose=True)
+        app_dir = '.'
+        watch = None
+        if args.watch:
+            watch = ResultWatcher(directory=app_dir, stable_seconds=args.stable_seconds, poll_interval=args.poll_interval, idle_timeout=args.idle_timeout)
+        proc = create_simulation_sample(expt, sample_list, verbose=True, upload_workers=args.upload_workers, compress=args.compress, metadata=not args.no_metadata,
+            watch=watch, pvd_name=args.pvd, app_dir=app_dir, resume=args.resume)
+        invalidate(expt, proj)
         out.write('Created process: ' + proc.name + ' ' + proc.id + '\n')
 
 
@@ -174,6 +304,36 @@ class SimulationSubcommand(ListObjects):
         input_id_help = "Specify in sample ids explicitly"
         parser.add_argument('--input-sample-ids', nargs='*', default=None, help=input_id_help)
 
+        upload_workers_help = "Maximum number of files uploaded concurrently (default: " + str(DEFAULT_UPLOAD_WORKERS) + ")"
+        parser.add_argument('--upload-workers', type=int, default=DEFAULT_UPLOAD_WORKERS, help=upload_workers_help)
+
+        compress_help = "Upload result files compressed with the given codec"
+        parser.add_argument('--compress', choices=sorted(CODEC_EXTENSIONS), default=None, help=compress_help)
+
+        watch_help = "Keep running and upload each result file once the simulation has finished writing it"
+        parser.add_argument('--watch', action="store_true", default=False, help=watch_help)
+
+        poll_interval_help = "With --watch, seconds between checks for new result files (default: " + str(DEFAULT_POLL_INTERVAL) + ")"
+        parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL, help=poll_interval_help)
+
+        stable_seconds_help = "With --watch, seconds a result file must be unchanged before it is uploaded (default: " + str(DEFAULT_STABLE_SECONDS) + ")"
+        parser.add_argument('--stable-seconds', type=float, default=DEFAULT_STABLE_SECONDS, help=stable_seconds_help)
+
+        idle_timeout_help = "With --watch, stop after this many seconds without a new result file (default: " + str(DEFAULT_IDLE_TIMEOUT) + ")"
+        parser.add_argument('--idle-timeout', type=float, default=DEFAULT_IDLE_TIMEOUT, help=idle_timeout_help)
+
+        pvd_help = "With --watch, name of the .pvd time-series manifest kept up to date (default: results.pvd)"
+        parser.add_argument('--pvd', default='results.pvd', help=pvd_help)
+
+        no_metadata_help = "Do not read the result file headers for time step, mesh and data array measurements"
+        parser.add_argument('--no-metadata', action="store_true", default=False, help=no_metadata_help)
+
+        add_validation_options(parser)
+        add_cache_options(parser)
+        add_profile_options(parser)
+        add_scheduler_options(parser)
+        add_resume_options(parser)
+
         return
 
     def list_data(self, obj):
@@ -0,0 +1,88 @@
+"""Run dependent steps concurrently, each as soon as its inputs are ready"""
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class Stage(object):
+    """
+    One step of a pipeline.
+
+    Arguments:
+
+        name: str
+          Unique name of the stage
+
+        func: callable
+          Called as func(results), where results is a dict of the results of
+          all finished stages by name; its return value is the stage result
+
+        requires: list of str
+          Names of the stages that must finish before this one starts
+
+    """
+
+    def __init__(self, name, func, requires=()):
+        self.name = name
+        self.func = func
+        self.requires = list(requires)
+
+
+def run_stages(stages, workers=4):
+    """
+    Run a dependency graph of stages on a thread pool. Independent stages run
+    concurrently; a stage starts as soon as all of its required stages finished.
+
+    If a stage raises, no further stages are started, the stages already
+    running are allowed to finish and the first exception is re-raised.
+
+    Arguments:
+
+        stages: list of Stage
+
+        workers: int
+          Maximum number of stages running at the same time
+
+    Returns:
+
+        results: dict
+          Stage name -> result of the stage
+
+    """
+    by_name = {}
+    for stage in stages:
+        if stage.name in by_name:
+            raise ValueError("Duplicate stage name: " + stage.name)
+        by_name[stage.name] = stage
+    for stage in stages:
+        for name in stage.requires:
+            if name not in by_name:
+                raise ValueError("Stage '" + stage.name + "' requires unknown stage '" + name + "'")
+
+    results = {}
+    waiting = list(stages)
+    running = {}
+    error = None
+
+    with ThreadPoolExecutor(max_workers=max(1, int(workers))) as pool:
+        while waiting or running:
+            if error is None:
+                ready = [stage for stage in waiting if all(name in results for name in stage.requires)]
+                for stage in ready:
+                    waiting.remove(stage)
+                    running[pool.submit(stage.func, dict(results))] = stage
+            if not running:
+                if error is None and waiting:
+                    raise ValueError("Circular stage dependencies: " + ", ".join(stage.name for stage in waiting))
+                break
+            done, not_done = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                if future.exception() is not None:
+                    if error is None:
+                        error = future.exception()
+                else:
+                    results[stage.name] = future.result()
+
+    if error is not None:
+        raise error
+    return results
@@ -0,0 +1,246 @@
+"""Parametric-sweep ingest: one process per distinct input, shared by every run using it"""
+
+import os
+import sys
+import asyncio
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from prismscpfe_mcapi.ingest import find_run_directories, DEFAULT_RUN_WORKERS
+from prismscpfe_mcapi.manifest import sha256_of_file
+from prismscpfe_mcapi.aio import get_client, run_sync
+from prismscpfe_mcapi.numerical_parameters import create_parameters_sample_async, INPUT_FILE_NAMES
+from prismscpfe_mcapi.grainid import create_GrainId_sample_async
+from prismscpfe_mcapi.orientations import create_Orientations_sample_async
+from prismscpfe_mcapi.boundaryconditions import create_BoundaryConditions_sample_async
+from prismscpfe_mcapi.simulation import create_simulation_sample_async
+from prismscpfe_mcapi.uploads import DEFAULT_UPLOAD_WORKERS, set_upload_pool
+from prismscpfe_mcapi.cache import invalidate
+from prismscpfe_mcapi.validation import validate_app_directory
+
+# Input processes of a simulation -> files of the run directory they are created from
+SWEEP_INPUTS = [
+    ('numerical-parameters', INPUT_FILE_NAMES),
+    ('GrainId', ['GrainId.txt']),
+    ('Orientations', ['orientations.txt']),
+    ('BoundaryConditions', ['boundaryconditions.txt'])
+]
+
+# Validation check -> input processes whose files it reads; each check is
+# run once per distinct combination of their inputs
+CHECK_INPUTS = {
+    'GrainId dimensions': ['numerical-parameters', 'GrainId'],
+    'grain orientations': ['GrainId', 'Orientations'],
+    'slip systems': ['numerical-parameters'],
+    'twin systems': ['numerical-parameters'],
+    'boundary conditions': ['numerical-parameters', 'BoundaryConditions']
+}
+
+# Sample name of each input process; the run directory of the first run using it is appended
+SAMPLE_NAMES = {
+    'numerical-parameters': 'Numerical Parameters',
+    'GrainId': 'GrainId Input',
+    'Orientations': 'Orientations Input',
+    'BoundaryConditions': 'Boundary Conditions Input'
+}
+
+
+def input_key(app_dir, file_names):
+    """Return a digest of the names and contents of input files of a run directory; missing files are included as such"""
+    h = hashlib.sha256()
+    for name in file_names:
+        path = os.path.join(app_dir, name)
+        digest = sha256_of_file(path) if os.path.exists(path) else '-'
+        h.update((name + '\0' + digest + '\n').encode())
+    return h.hexdigest()
+
+
+def input_keys(app_dir):
+    """Return {input process name: input_key} for a run directory. Run in a worker process."""
+    return {stage: input_key(app_dir, file_names) for stage, file_names in SWEEP_INPUTS}
+
+
+def validate_checks(app_dir, checks):
+    """Return {check name: errors} for some checks of validation.CHECKS on a run directory. Run in a worker process."""
+    return {check: validate_app_directory(app_dir, checks=[check]) for check in checks}
+
+
+async def _create_sweep(expt, root, runs, inputs, workers, upload_workers, out):
+    client = get_client()
+    limit = asyncio.Semaphore(max(1, int(workers)))
+    create_funcs = {
+        'numerical-parameters': lambda app_dir, name: create_parameters_sample_async(expt, name, upload_workers=upload_workers, app_dir=app_dir, client=client),
+        'GrainId': lambda app_dir, name: create_GrainId_sample_async(expt, name, app_dir=app_dir, client=client),
+        'Orientations': lambda app_dir, name: create_Orientations_sample_async(expt, name, app_dir=app_dir, client=client),
+        'BoundaryConditions': lambda app_dir, name: create_BoundaryConditions_sample_async(expt, name, app_dir=app_dir, client=client)
+    }
+
+    async def create_input(stage, key):
+        app_dir = inputs[stage][key]
+        async with limit:
+            proc = await create_funcs[stage](app_dir, SAMPLE_NAMES[stage] + ' (' + os.path.relpath(app_dir, root) + ')')
+        out.write('Created process: ' + proc.name + ' ' + proc.id + ' (' + stage + ', ' + app_dir + ')\n')
+        runs[app_dir]['processes'] += 1
+        return proc
+
+    keys = [(stage, key) for stage, file_names in SWEEP_INPUTS for key in inputs[stage]]
+    procs = await asyncio.gather(*[create_input(stage, key) for stage, key in keys], return_exceptions=True)
+    procs = dict(zip(keys, procs))
+
+    async def create_run(app_dir, run):
+        run['status'] = 'failed'
+        sample_list = []
+        for stage, file_names in SWEEP_INPUTS:
+            proc = procs[(stage, run['inputs'][stage])]
+            if isinstance(proc, BaseException):
+                run['errors'].append(stage + ' failed: ' + str(proc))
+                return
+            if not getattr(proc, 'output_samples', None):
+                await client.request_idempotent(proc.decorate_with_output_samples)
+            sample_list.extend(proc.output_samples)
+        try:
+            async with limit:
+                proc = await create_simulation_sample_async(expt, sample_list, upload_workers=upload_workers, app_dir=app_dir, client=client)
+        except Exception as e:
+            run['errors'].append('create failed: ' + str(e))
+            return
+        out.write('Created process: ' + proc.name + ' ' + proc.id + ' (' + app_dir + ')\n')
+        run['processes'] += 1
+        run['status'] = 'created'
+
+    await asyncio.gather(*[create_run(app_dir, run) for app_dir, run in runs.items() if run['status'] == 'parsed'])
+
+
+def sweep_ingest(proj, expt, root, jobs=None, workers=DEFAULT_RUN_WORKERS, upload_workers=DEFAULT_UPLOAD_WORKERS, validate=True, dry_run=False, out=sys.stdout):
+    """
+    Create the runs of a parametric sweep under root in one experiment.
+
+    Runs of a sweep share most of their inputs. The input files of every run
+    are hashed on a pool of worker processes, and each input process
+    (numerical parameters, with the slip and twin files; GrainId;
+    Orientations; Boundary Conditions) is created once per distinct content
+    of its input files, from the first run using it. Inputs are parsed only
+    there, and each validation check runs once per distinct combination of
+    the inputs it reads (see CHECK_INPUTS). Each run then gets its own simulation process, with the
+    output samples of the input processes of its inputs as input samples.
+    Uploads and processes therefore scale with the number of distinct inputs,
+    plus one simulation per run.
+
+    Arguments:
+
+        proj: mcapi.Project object
+
+        expt: mcapi.Experiment object
+          Experiment for all runs and their shared inputs
+
+        root: str
+          Directory tree, inside proj.local_path, searched for run directories
+
+        jobs: int, optional
+          Number of worker processes parsing inputs, default is the CPU count
+
+        workers: int
+          Maximum number of processes created concurrently
+
+        upload_workers: int
+          Maximum number of files uploaded concurrently, over all processes
+
+        validate: bool
+          Skip runs whose inputs are inconsistent
+
+        dry_run: bool
+          Only find, validate and group the run directories
+
+    Returns:
+
+        results: list of dict
+          As returned by ingest.ingest: one per run directory, sorted by
+          directory; the input processes are counted in 'processes' of the
+          run they were created from
+
+        unique: dict
+          Input process name -> number of distinct inputs, over the runs
+          parsed and validated
+
+    """
+    run_dirs = find_run_directories(root)
+    out.write('Found ' + str(len(run_dirs)) + ' run directories under ' + root + '\n')
+    runs = {app_dir: {'app_dir': app_dir, 'status': 'failed', 'errors': [], 'processes': 0} for app_dir in run_dirs}
+    # input process name -> {input_key: run directory it is created from}
+    inputs = {stage: {} for stage, file_names in SWEEP_INPUTS}
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        # only the input files are hashed for every run
+        key_futures = {pool.submit(input_keys, app_dir): app_dir for app_dir in run_dirs}
+        for future in as_completed(key_futures):
+            run = runs[key_futures[future]]
+            try:
+                run['inputs'] = future.result()
+                run['status'] = 'parsed'
+            except Exception as e:
+                run['errors'] = ['reading inputs failed: ' + str(e)]
+
+        # each check runs once per distinct combination of the inputs it reads,
+        # on the first run with that combination
+        # (check, input keys) -> run directory it is run on
+        units = {}
+        for app_dir in run_dirs:
+            run = runs[app_dir]
+            if run['status'] == 'parsed':
+                run['checks'] = [(check, tuple(run['inputs'][stage] for stage in stages)) for check, stages in sorted(CHECK_INPUTS.items())]
+                for unit in run['checks']:
+                    units.setdefault(unit, app_dir)
+        checks_of = {}
+        for unit, app_dir in units.items():
+            checks_of.setdefault(app_dir, []).append(unit)
+        check_futures = {pool.submit(validate_checks, app_dir, [check for check, keys in unit_list]): unit_list for app_dir, unit_list in checks_of.items()}
+        unit_errors = {}
+        for future in as_completed(check_futures):
+            unit_list = check_futures[future]
+            try:
+                errors = future.result()
+                for unit in unit_list:
+                    unit_errors[unit] = errors[unit[0]]
+            except Exception as e:
+                for unit in unit_list:
+                    unit_errors[unit] = [unit[0] + ': validation failed: ' + str(e)]
+
+    for app_dir in run_dirs:
+        run = runs[app_dir]
+        if run['status'] != 'parsed':
+            continue
+        for unit in run.pop('checks'):
+            run['errors'].extend(unit_errors[unit])
+        if validate and len(run['errors']):
+            run['status'] = 'skipped'
+
+    # the first run in directory order is the one each input is created from,
+    # and the only one whose files for it are parsed
+    for app_dir in run_dirs:
+        if runs[app_dir]['status'] == 'parsed':
+            for stage, key in runs[app_dir]['inputs'].items():
+                inputs[stage].setdefault(key, app_dir)
+    unique = {stage: len(inputs[stage]) for stage, file_names in SWEEP_INPUTS}
+
+    if not dry_run and any(run['status'] == 'parsed' for run in runs.values()):
+        upload_pool = ThreadPoolExecutor(max_workers=max(1, int(upload_workers)))
+        set_upload_pool(upload_pool)
+        try:
+            run_sync(_create_sweep(expt, root, runs, inputs, workers, upload_workers, out))
+        finally:
+            set_upload_pool(None)
+            upload_pool.shutdown()
+        invalidate(expt, proj)
+
+    results = []
+    for app_dir in run_dirs:
+        run = dict(runs[app_dir])
+        run.pop('inputs', None)
+        results.append(run)
+    return results, unique
+
+
+def write_unique_inputs(unique, out=sys.stdout):
+    """Write the number of distinct inputs of each input process"""
+    out.write('\ndistinct inputs:\n')
+    for stage, file_names in SWEEP_INPUTS:
+        out.write('  {:22} {:6d}\n'.format(stage, unique[stage]))
@@ -0,0 +1,249 @@
+"""Per-call tracing of Materials Commons requests, file parsing and uploads"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import functools
+import contextlib
+
+# Phases of the --profile report, in order
+PHASES = ['parse', 'create process', 'measurements', 'uploads', 're-fetches', 'other']
+
+# Name of a Materials Commons client call -> phase
+CALL_PHASES = {
+    'create_experiment': 'create process',
+    'create_process_from_template': 'create process',
+    'create_samples': 'create process',
+    'rename': 'create process',
+    'add_input_samples_to_process': 'create process',
+    'post': 'measurements',
+    'add_file_by_local_path': 'uploads',
+    'add_file_using_directory': 'uploads',
+    'create_or_get_all_directories_on_path': 'uploads',
+    'add_files': 'uploads',
+    'link_files': 'uploads',
+    'put': 'uploads',
+    'get_process_by_id': 're-fetches',
+    'get_all_processes': 're-fetches',
+    'get_all_samples': 're-fetches',
+    'get_all_files': 're-fetches',
+    'get_sample_by_id': 're-fetches',
+    'decorate_with_output_samples': 're-fetches'
+}
+
+
+class Tracer(object):
+    """
+    Thread-safe record of traced calls. Each event has a phase, a name, its
+    start (seconds since the tracer was created) and duration, the bytes it
+    sent or parsed, the round trips it made to the server, how many of those
+    were retries, and the type of the error it raised, if any.
+    """
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    def record(self, phase, name, started, duration, nbytes=0, round_trips=0, retries=0, error=None):
+        """Add an event; started is a time.perf_counter() value"""
+        event = {
+            'phase': phase,
+            'name': name,
+            'start': started - self._started,
+            'duration': duration,
+            'bytes': nbytes,
+            'round_trips': round_trips,
+            'retries': retries,
+            'error': error,
+            'thread': threading.current_thread().name
+        }
+        with self._lock:
+            self.events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, phase, name, nbytes=0, round_trips=0):
+        """Record the block as one event"""
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.record(phase, name, started, time.perf_counter() - started, nbytes, round_trips, 0, error)
+
+    def elapsed(self):
+        return time.perf_counter() - self._started
+
+    def summary(self):
+        """
+        Returns:
+
+            phases: dict
+              phase -> {'calls', 'round_trips', 'retries', 'errors', 'bytes',
+              'busy' (summed duration of its calls), 'wall' (time during which
+              at least one of its calls was running)}, for phases with events
+
+        """
+        with self._lock:
+            events = list(self.events)
+        phases = {}
+        for phase in PHASES:
+            mine = [e for e in events if e['phase'] == phase]
+            if not len(mine):
+                continue
+            phases[phase] = {
+                'calls': len(mine),
+                'round_trips': sum(e['round_trips'] for e in mine),
+                'retries': sum(e['retries'] for e in mine),
+                'errors': sum(1 for e in mine if e['error'] is not None),
+                'bytes': sum(e['bytes'] for e in mine),
+                'busy': sum(e['duration'] for e in mine),
+                'wall': _covered_time([(e['start'], e['start'] + e['duration']) for e in mine])
+            }
+        return phases
+
+    def write_report(self, out=sys.stderr):
+        """Write the per-phase breakdown and the slowest calls"""
+        phases = self.summary()
+        out.write('\nProfile ({:.3f} s elapsed):\n'.format(self.elapsed()))
+        out.write('  {:16} {:>7} {:>11} {:>8} {:>10} {:>10} {:>10}\n'.format('phase', 'calls', 'round trips', 'retries', 'MB', 'wall (s)', 'busy (s)'))
+        for phase, p in phases.items():
+            out.write('  {:16} {:7d} {:11d} {:8d} {:10.2f} {:10.3f} {:10.3f}\n'.format(
+                phase, p['calls'], p['round_trips'], p['retries'], p['bytes'] / float(1 << 20), p['wall'], p['busy']))
+        out.write('  {:16} {:7d} {:11d} {:8d}\n'.format('total',
+            sum(p['calls'] for p in phases.values()), sum(p['round_trips'] for p in phases.values()), sum(p['retries'] for p in phases.values())))
+        with self._lock:
+            slowest = sorted(self.events, key=lambda e: -e['duration'])[:5]
+        if len(slowest):
+            out.write('  slowest calls:\n')
+            for e in slowest:
+                out.write('    {:8.3f} s  {:16} {}\n'.format(e['duration'], e['phase'], e['name']))
+
+    def write_trace(self, path):
+        """Write the summary and every event to a JSON file"""
+        with self._lock:
+            events = sorted(self.events, key=lambda e: e['start'])
+        with open(path, 'w') as f:
+            json.dump({'elapsed': self.elapsed(), 'phases': self.summary(), 'events': events}, f, indent=1)
+
+
+def _covered_time(intervals):
+    total = 0.0
+    end = None
+    for start, stop in sorted(intervals):
+        if end is None or start > end:
+            total += stop - start
+            end = stop
+        elif stop > end:
+            total += stop - end
+            end = stop
+    return total
+
+
+def set_tracer(tracer):
+    """Record traced calls made by this process with tracer; None to stop tracing"""
+    global _tracer
+    _tracer = tracer
+
+set_tracer(None)
+
+
+def get_tracer():
+    """Return the current Tracer, or None if calls are not being traced"""
+    return _tracer
+
+
+def span(phase, name, nbytes=0, round_trips=0):
+    """Context manager recording the block with the current tracer, if any"""
+    if _tracer is None:
+        return contextlib.nullcontext()
+    return _tracer.span(phase, name, nbytes, round_trips)
+
+
+def call_phase(func):
+    """Phase of a Materials Commons client call, from its name"""
+    return CALL_PHASES.get(getattr(func, '__name__', None), 'other')
+
+
+def call_name(func):
+    return getattr(func, '__qualname__', None) or getattr(func, '__name__', None) or repr(func)
+
+
+def request_bytes(func, args):
+    """Size of the data a Materials Commons client call sends: a file upload or a JSON body"""
+    name = getattr(func, '__name__', None)
+    try:
+        if name == 'add_file_by_local_path':
+            return os.path.getsize(args[0])
+        if name == 'add_file_using_directory' and len(args) > 2:
+            return os.path.getsize(args[2])
+        if name in ('post', 'put') and len(args) > 1:
+            return len(json.dumps(args[1], default=str))
+    except (OSError, TypeError, ValueError):
+        pass
+    return 0
+
+
+def traced(phase):
+    """
+    Decorator recording each call of a function reading a file as a phase
+    event, named after the function and the file (its first str argument),
+    with the size of the file as its bytes.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            path = next((a for a in args if isinstance(a, str)), None)
+            nbytes = 0
+            if path is not None and os.path.isfile(path):
+                nbytes = os.path.getsize(path)
+            name = func.__name__ if path is None else func.__name__ + ': ' + path
+            with _tracer.span(phase, name, nbytes):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_profile_options(parser):
+    """Add --profile and --profile-trace to a subcommand argument parser"""
+    profile_help = "Print the time, round trips, retries and bytes of each phase (parse, create process, measurements, uploads, re-fetches) when done"
+    parser.add_argument('--profile', action="store_true", default=False, help=profile_help)
+    profile_trace_help = "Write every traced call to this JSON file"
+    parser.add_argument('--profile-trace', type=str, default=None, help=profile_trace_help)
+
+
+def set_profile_options_from_argv(argv):
+    """
+    Apply --profile and --profile-trace from argv, ignoring all other
+    arguments: start tracing if either is given.
+    """
+    global profile_options
+    parser = argparse.ArgumentParser(add_help=False)
+    add_profile_options(parser)
+    args, unknown = parser.parse_known_args(argv)
+    profile_options = {'profile': args.profile, 'trace': args.profile_trace}
+    if args.profile or args.profile_trace is not None:
+        set_tracer(Tracer())
+
+profile_options = {'profile': False, 'trace': None}
+
+
+def finish_profile(out=sys.stderr):
+    """Write the --profile report and --profile-trace file, if requested, and stop tracing"""
+    tracer = get_tracer()
+    if tracer is None:
+        return
+    set_tracer(None)
+    if profile_options['profile']:
+        tracer.write_report(out)
+    if profile_options['trace'] is not None:
+        tracer.write_trace(profile_options['trace'])
+        out.write('Wrote trace: ' + profile_options['trace'] + '\n')
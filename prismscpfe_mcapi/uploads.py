@@ -0,0 +1,286 @@
+"""Concurrent file uploads for PRISMS-CPFE processes"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from materials_commons.api import File, api
+from prismscpfe_mcapi.manifest import UploadManifest
+from prismscpfe_mcapi.scheduler import get_scheduler
+
+# Default number of files uploaded at the same time
+DEFAULT_UPLOAD_WORKERS = 4
+
+# Executor used by every upload_files call instead of a pool per call, see set_upload_pool
+_shared_pool = None
+
+# (project id, directory path in the project) -> mcapi.Directory, for the
+# directories uploaded to by this process. Looking up or creating a directory
+# is serialized over all threads, since it also creates its missing parents,
+# which directories of concurrent runs (e.g. in ingest) share; the uploads
+# into a known directory run concurrently
+_directories = {}
+_directory_lock = threading.Lock()
+
+
+def set_upload_pool(pool):
+    """
+    Send the uploads of all upload_files calls, from any thread, to one
+    concurrent.futures executor, so that its size bounds the total number
+    of concurrent uploads. Pass None to go back to a pool per call.
+    """
+    global _shared_pool
+    _shared_pool = pool
+
+
+def _uploaded_file(proj, file_id, local_path):
+    """
+    The mcapi.File of an earlier upload of local_path, from its recorded id;
+    processes and samples only use the file id when files are attached
+    """
+    file = File(data={'id': file_id, 'name': os.path.basename(local_path), 'otype': 'file'})
+    file._project = proj
+    return file
+
+
+def _remote_directory(proj, local_dir):
+    """Return the mcapi.Directory of a local directory inside proj.local_path, created with its parents if missing"""
+    local_dir = os.path.abspath(local_dir)
+    path = "/" if local_dir == os.path.abspath(proj.local_path) else os.path.relpath(local_dir, proj.local_path)
+    key = (proj.id, path)
+    with _directory_lock:
+        if key not in _directories:
+            _directories[key] = get_scheduler().call_idempotent(proj.create_or_get_all_directories_on_path, path)[-1]
+        return _directories[key]
+
+
+def upload_file(proj, local_path, manifest=None, verbose=False):
+    """
+    Upload one local file, or reuse an already uploaded file with the same
+    contents if manifest records one.
+
+    Arguments:
+
+        proj: mcapi.Project object
+
+        local_path: str
+          Path of the file to upload, inside proj.local_path
+
+        manifest: UploadManifest, optional
+          Manifest of previous uploads; if None every file is uploaded
+
+        verbose: bool
+          Print messages about uploads
+
+    Returns:
+
+        file: mcapi.File
+
+    """
+    sha256 = None
+    if manifest is not None:
+        file_id, sha256 = manifest.lookup(proj.id, local_path)
+        if file_id is not None:
+            if verbose:
+                print("Already uploaded: " + local_path + " (file id: " + file_id + ")")
+            return _uploaded_file(proj, file_id, local_path)
+
+    directory = _remote_directory(proj, os.path.dirname(local_path))
+    # an upload repeated after the server stored it adds a new file version
+    file = get_scheduler().call_unprocessed(proj.add_file_using_directory, directory, os.path.basename(local_path), local_path, verbose=verbose)
+    if manifest is not None:
+        manifest.record(proj.id, local_path, file.id, sha256)
+    return file
+
+
+def upload_files(proj, local_paths, workers=DEFAULT_UPLOAD_WORKERS, manifest=None, verbose=False):
+    """
+    Upload local files to a Materials Commons project using a bounded pool of
+    worker threads.
+
+    The remote directory of each local directory is looked up, or created
+    with its parents, once per process, one directory at a time over all
+    threads; the uploads themselves run concurrently.
+
+    Arguments:
+
+        proj: mcapi.Project object
+
+        local_paths: list of str
+          Paths of files to upload, inside proj.local_path
+
+        workers: int, optional (default=DEFAULT_UPLOAD_WORKERS)
+          Maximum number of concurrent uploads; ignored if a shared pool was
+          set with set_upload_pool
+
+        manifest: UploadManifest, optional
+          Manifest of previous uploads; files with recorded contents are reused
+
+        verbose: bool
+          Print messages about uploads
+
+    Returns:
+
+        files: list of mcapi.File
+          The uploaded files, in the same order as local_paths
+
+    """
+    files = [None] * len(local_paths)
+
+    def upload(i):
+        files[i] = upload_file(proj, local_paths[i], manifest=manifest, verbose=verbose)
+
+    if _shared_pool is not None:
+        # list() re-raises the first upload error, if any
+        list(_shared_pool.map(upload, range(len(local_paths))))
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, int(workers))) as pool:
+            list(pool.map(upload, range(len(local_paths))))
+
+    return files
+
+
+def unique_files(files):
+    """Return files without repeated file ids, in order of first occurrence"""
+    seen = set()
+    unique = []
+    for file in files:
+        if file.id not in seen:
+            seen.add(file.id)
+            unique.append(file)
+    return unique
+
+
+def upload_and_attach(proj, proc, local_paths, workers=DEFAULT_UPLOAD_WORKERS, direction=None, use_manifest=True, operation=None, verbose=False):
+    """
+    Upload local files concurrently and attach all of them to a process with a
+    single add_files call.
+
+    Arguments:
+
+        proj: mcapi.Project object
+
+        proc: mcapi.Process instance
+
+        local_paths: list of str
+          Paths of files to upload, inside proj.local_path
+
+        workers: int, optional (default=DEFAULT_UPLOAD_WORKERS)
+          Maximum number of concurrent uploads
+
+        direction: str, optional
+          If given ('in' or 'out'), the direction of the files with respect
+          to proc
+
+        use_manifest: bool, optional (default=True)
+          Reuse files already uploaded to proj with identical contents, as
+          recorded in the project's upload manifest
+
+        operation: journal.Operation, optional
+          Files the operation journal records as attached to proc are neither
+          uploaded nor attached again, but rebuilt from their recorded ids;
+          the files attached now are recorded
+
+        verbose: bool
+          Print messages about uploads
+
+    Returns:
+
+        files: list of mcapi.File
+          The uploaded files, in the same order as local_paths
+
+    """
+    files = [None] * len(local_paths)
+    pending = list(range(len(local_paths)))
+    if operation is not None:
+        for i in [i for i in pending if operation.is_attached(local_paths[i])]:
+            files[i] = _uploaded_file(proj, operation.file_id(local_paths[i]), local_paths[i])
+            if verbose:
+                print("Already attached: " + local_paths[i])
+        pending = [i for i in pending if files[i] is None]
+
+    manifest = UploadManifest.for_project(proj) if use_manifest else None
+    try:
+        uploaded = upload_files(proj, [local_paths[i] for i in pending], workers=workers, manifest=manifest, verbose=verbose)
+    finally:
+        if manifest is not None:
+            manifest.close()
+    for i, file in zip(pending, uploaded):
+        files[i] = file
+    if direction is not None:
+        for file in files:
+            file.direction = direction
+    if len(uploaded):
+        # add_files takes the direction as an argument; File.direction is not sent
+        get_scheduler().call_idempotent(proc.add_files, unique_files(uploaded), direction=direction)
+        if operation is not None:
+            operation.record_attached([local_paths[i] for i in pending], [file.id for file in uploaded])
+    return files
+
+
+def _remove_files(proj, proc, files):
+    """
+    Detach files from a process with 'delete' file commands, sent to the
+    process update route mcapi's Process.add_files sends 'add' commands to
+    """
+    data = {
+        'template_id': proc.template_id,
+        'process_id': proc.id,
+        'files': [{'command': 'delete', 'id': file.id, 'direction': ''} for file in files]
+    }
+    api_url = "projects/" + proj.id + "/experiments/" + proc.experiment.id + "/processes/" + proc.id
+    remote = api.use_remote()
+    return get_scheduler().call_idempotent(api.put, remote.make_url_v2(api_url), data, remote)
+
+
+def replace_changed_files(proj, proc, local_paths, workers=DEFAULT_UPLOAD_WORKERS, verbose=False):
+    """
+    Attach to a process the local files whose contents differ from the files
+    already attached to it, replacing attached files of the same name.
+
+    A local file is unchanged if the project's upload manifest maps its
+    contents to a file attached to proc; files the manifest does not know
+    are treated as changed.
+
+    Arguments:
+
+        proj: mcapi.Project object
+
+        proc: mcapi.Process instance
+
+        local_paths: list of str
+          Paths of files to compare and upload, inside proj.local_path
+
+        workers: int, optional (default=DEFAULT_UPLOAD_WORKERS)
+          Maximum number of concurrent uploads
+
+        verbose: bool
+          Print messages about uploads
+
+    Returns:
+
+        files: list of mcapi.File
+          The files attached, for the changed local files only
+
+    """
+    attached = {file.id: file for file in get_scheduler().call_idempotent(proc.get_all_files)}
+    manifest = UploadManifest.for_project(proj)
+    try:
+        changed = []
+        for local_path in local_paths:
+            file_id, sha256 = manifest.lookup(proj.id, local_path)
+            if file_id in attached:
+                if verbose:
+                    print("Unchanged: " + local_path)
+            else:
+                changed.append(local_path)
+        uploaded = upload_files(proj, changed, workers=workers, manifest=manifest, verbose=verbose)
+    finally:
+        manifest.close()
+    names = set(os.path.basename(local_path) for local_path in changed)
+    uploaded_ids = set(file.id for file in uploaded)
+    replaced = [file for file in attached.values() if file.name in names and file.id not in uploaded_ids]
+    if len(uploaded):
+        get_scheduler().call_idempotent(proc.add_files, unique_files(uploaded))
+    if len(replaced):
+        _remove_files(proj, proc, replaced)
+    return uploaded
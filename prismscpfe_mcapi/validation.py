@@ -0,0 +1,245 @@
+"""mc prismscpfe validate subcommand: consistency checks across app-directory inputs"""
+
+import os
+import sys
+import argparse
+from prismscpfe_mcapi.prismscpfe_parameter_parser import ParameterIndex
+from prismscpfe_mcapi.tracing import add_profile_options
+
+# NumPy and the modules using it are imported by the checks that need them,
+# so that importing this module for add_validation_options stays cheap
+
+
+class _AppDirectory(object):
+    """Lazily loaded inputs of an app directory, shared by all checks"""
+
+    def __init__(self, app_dir):
+        self.app_dir = app_dir
+        self._parameters = None
+        self._grain_ids = None
+        self._orientation_ids = None
+
+    def path(self, file_name):
+        return os.path.join(self.app_dir, file_name)
+
+    @property
+    def parameters(self):
+        if self._parameters is None:
+            self._parameters = ParameterIndex.load(self.path('parameters.in'))
+        return self._parameters
+
+    def parameter(self, name, default=None):
+        return self.parameters.get(name, default)
+
+    def int_parameter(self, name):
+        value = self.parameter(name)
+        return None if value is None else int(float(value))
+
+    @property
+    def grain_ids(self):
+        """Grain ids present in GrainId.txt"""
+        if self._grain_ids is None:
+            from prismscpfe_mcapi.grainid_data import GrainId_file_statistics
+            header, stats = GrainId_file_statistics(self.path('GrainId.txt'))
+            self._grain_ids = stats['grain_ids']
+        return self._grain_ids
+
+    @property
+    def orientation_ids(self):
+        if self._orientation_ids is None:
+            from prismscpfe_mcapi.orientation_data import load_orientations
+            self._orientation_ids = load_orientations(self.path('orientations.txt'))[0]
+        return self._orientation_ids
+
+
+def _count_data_lines(file_name, header_lines=0):
+    with open(file_name, 'rb') as f:
+        lines = f.read().splitlines()[header_lines:]
+    return sum(1 for line in lines if line.strip())
+
+
+def check_GrainId_dimensions(app):
+    """GrainId.txt header dimensions match 'Voxels in X/Y/Z direction'"""
+    from prismscpfe_mcapi.grainid_data import read_GrainId_header
+    header = read_GrainId_header(app.path('GrainId.txt'))
+    if header['dimensions'] is None:
+        return ["GrainId.txt: header does not give the volume dimensions"]
+    errors = []
+    for axis, n in zip('XYZ', header['dimensions']):
+        expected = app.int_parameter('Voxels in ' + axis + ' direction')
+        if expected is not None and expected != n:
+            errors.append("GrainId.txt has " + str(n) + " voxels in " + axis + ", parameters.in 'Voxels in " + axis + " direction' = " + str(expected))
+    return errors
+
+
+def check_grain_orientations(app):
+    """Every grain id in GrainId.txt has a row in orientations.txt"""
+    import numpy as np
+    errors = []
+    missing = np.setdiff1d(app.grain_ids, app.orientation_ids, assume_unique=True)
+    if len(missing):
+        shown = ', '.join(str(i) for i in missing[:10]) + (', ...' if len(missing) > 10 else '')
+        errors.append(str(len(missing)) + " grain id(s) in GrainId.txt have no orientation in orientations.txt: " + shown)
+    unique_ids, counts = np.unique(app.orientation_ids, return_counts=True)
+    duplicated = unique_ids[counts > 1]
+    if len(duplicated):
+        errors.append("orientations.txt lists grain id(s) more than once: " + ', '.join(str(i) for i in duplicated[:10]))
+    return errors
+
+
+def _check_system_files(app, count_name, file_parameters, list_parameters):
+    errors = []
+    n = app.int_parameter(count_name)
+    if n is None:
+        return ["parameters.in does not set '" + count_name + "'"]
+    for parameter_name, default in file_parameters:
+        file_name = app.parameter(parameter_name, default)
+        path = app.path(file_name)
+        if not os.path.exists(path):
+            errors.append(file_name + " ('" + parameter_name + "') does not exist")
+            continue
+        lines = _count_data_lines(path)
+        if lines != n:
+            errors.append(file_name + " has " + str(lines) + " lines, '" + count_name + "' = " + str(n))
+    for parameter_name in list_parameters:
+        value = app.parameter(parameter_name)
+        if value is None:
+            continue
+        length = len([v for v in value.split(',') if v.strip()])
+        if length != n:
+            errors.append("'" + parameter_name + "' has " + str(length) + " values, '" + count_name + "' = " + str(n))
+    return errors
+
+
+def check_slip_systems(app):
+    """'Number of Slip Systems' matches slipNormals/slipDirections and the per-system parameters"""
+    return _check_system_files(
+        app, 'Number of Slip Systems',
+        [('Slip Normals File', 'slipNormals.txt'), ('Slip Directions File', 'slipDirections.txt')],
+        ['Initial Slip Resistance', 'Initial Hardening Modulus', 'Power Law Exponent', 'Saturation Stress'])
+
+
+def check_twin_systems(app):
+    """'Number of Twin Systems' matches twinNormals/twinDirections and the per-system parameters, if twinning is enabled"""
+    if app.parameter('Twinning enabled', 'false').strip().lower() != 'true':
+        return []
+    return _check_system_files(
+        app, 'Number of Twin Systems',
+        [('Twin Normals File', 'twinNormals.txt'), ('Twin Directions File', 'twinDirections.txt')],
+        ['Initial Slip Resistance Twin', 'Initial Hardening Modulus Twin', 'Power Law Exponent Twin', 'Saturation Stress Twin'])
+
+
+def check_boundary_conditions(app):
+    """'Number of boundary conditions' matches the data lines of the 'Boundary condition filename' file, if set"""
+    n = app.int_parameter('Number of boundary conditions')
+    if n is None:
+        return []
+    file_name = app.parameter('Boundary condition filename', 'BCinfo.txt').strip()
+    path = app.path(file_name)
+    if not os.path.exists(path):
+        return [file_name + " ('Boundary condition filename') does not exist"]
+    header_lines = app.int_parameter('BC file number of header lines')
+    lines = _count_data_lines(path, 2 if header_lines is None else header_lines)
+    if lines != n:
+        return [file_name + " has " + str(lines) + " boundary conditions, 'Number of boundary conditions' = " + str(n)]
+    return []
+
+
+# name -> check, in the order they are run
+CHECKS = [
+    ('GrainId dimensions', check_GrainId_dimensions),
+    ('grain orientations', check_grain_orientations),
+    ('slip systems', check_slip_systems),
+    ('twin systems', check_twin_systems),
+    ('boundary conditions', check_boundary_conditions)
+]
+
+# subcommand -> checks run before its --create
+CREATE_CHECKS = {
+    'numerical-parameters': ['slip systems', 'twin systems'],
+    'GrainId': ['GrainId dimensions', 'grain orientations'],
+    'Orientations': ['grain orientations'],
+    'BoundaryConditions': ['boundary conditions'],
+    'Simulation': [name for name, check in CHECKS],
+    'full-simulation': [name for name, check in CHECKS]
+}
+
+
+def validate_app_directory(app_dir='.', checks=None):
+    """
+    Check that the inputs of a PRISMS-CPFE app directory agree with each other.
+
+    Arguments:
+
+        app_dir: str
+          Directory containing parameters.in, GrainId.txt, orientations.txt, ...
+
+        checks: list of str, optional
+          Names of the checks in CHECKS to run, default is all of them
+
+    Returns:
+
+        errors: list of str
+          Description of every inconsistency found; empty if the inputs agree
+
+    """
+    app = _AppDirectory(app_dir)
+    errors = []
+    for name, check in CHECKS:
+        if checks is not None and name not in checks:
+            continue
+        try:
+            errors.extend(check(app))
+        except (IOError, OSError, ValueError) as e:
+            errors.append(name + ": " + str(e))
+    return errors
+
+
+def check_app_directory(command, app_dir='.', out=sys.stdout):
+    """
+    Run the checks for a subcommand's --create. Returns True if they pass,
+    otherwise writes a report and returns False.
+    """
+    errors = validate_app_directory(app_dir, checks=CREATE_CHECKS.get(command, []))
+    if len(errors):
+        write_report(errors, out)
+        out.write('Use --skip-validation to create anyway.\n')
+        out.write('Aborting\n')
+        return False
+    return True
+
+
+def write_report(errors, out=sys.stdout):
+    if len(errors):
+        out.write('Found ' + str(len(errors)) + ' problem(s):\n')
+        for error in errors:
+            out.write('  - ' + error + '\n')
+    else:
+        out.write('All inputs are consistent.\n')
+
+
+def add_validation_options(parser):
+    """Add --skip-validation to a subcommand argument parser"""
+    skip_validation_help = "Do not check the app directory inputs for consistency before creating"
+    parser.add_argument('--skip-validation', action="store_true", default=False, help=skip_validation_help)
+
+
+class ValidateSubcommand:
+    desc = "Check PRISMS-CPFE inputs for consistency"
+
+    def __init__(self, argv):
+
+        parser = argparse.ArgumentParser(
+            description='Checks that parameters.in, GrainId.txt, orientations.txt, the slip/twin system files and the boundary conditions file agree',
+            prog='mc prismscpfe validate')
+
+        parser.add_argument('app_dir', nargs='?', default='.', help='PRISMS-CPFE app directory (default: current directory)')
+
+        add_profile_options(parser)
+
+        args = parser.parse_args(argv[3:])
+
+        errors = validate_app_directory(args.app_dir)
+        write_report(errors)
+        if len(errors):
+            exit(1)
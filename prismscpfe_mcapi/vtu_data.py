@@ -0,0 +1,246 @@
+"""Streaming extraction of VTK XML (.vtu/.pvtu) header metadata"""
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from prismscpfe_mcapi.tracing import traced
+
+# Bytes read from the file at a time
+_READ_BLOCK_SIZE = 1024 * 1024
+
+# Longest tag accepted, guards against scanning a payload that is not XML
+_MAX_TAG_BYTES = 64 * 1024
+
+# Text between tags shorter than this is kept, e.g. an ascii TIME value
+_MAX_TEXT_BYTES = 256
+
+_ATTRIBUTE_RE = re.compile(r"""([\w:.-]+)\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+_TIME_STEP_RE = re.compile(r"(\d+)(?:\.\d+)?\.p?vtu$")
+
+# Data sections of a Piece, and of a parallel (.pvtu) file
+_DATA_SECTIONS = {
+    'PointData': 'point_data', 'PPointData': 'point_data',
+    'CellData': 'cell_data', 'PCellData': 'cell_data'
+}
+
+
+def _iter_tags(f):
+    """
+    Yield (name, attributes, closing, text) for each tag of an XML file,
+    where text is the text since the previous tag if it is short, else None.
+    Text between tags, such as inline data arrays, is skipped without being
+    parsed or held in memory.
+    """
+    buf = b''
+    pos = 0
+    text_start = 0
+    carry = b''
+    text_overflow = False
+    eof = False
+    while True:
+        start = buf.find(b'<', pos)
+        end = -1 if start == -1 else buf.find(b'>', start)
+        if end == -1:
+            if eof:
+                return
+            # keep the text read so far only while it is short
+            if not text_overflow:
+                carry += buf[text_start:len(buf) if start == -1 else start]
+                if len(carry) > _MAX_TEXT_BYTES:
+                    text_overflow = True
+                    carry = b''
+            if start == -1:
+                buf = b''
+            else:
+                buf = buf[start:]
+                if len(buf) > _MAX_TAG_BYTES:
+                    raise ValueError(f.name + ": tag longer than " + str(_MAX_TAG_BYTES) + " bytes")
+            pos = 0
+            text_start = 0
+            block = f.read(_READ_BLOCK_SIZE)
+            if not block:
+                eof = True
+            buf += block
+            continue
+
+        text = None
+        if not text_overflow:
+            text = carry + buf[text_start:start]
+            text = text.decode('utf-8', 'replace').strip() if len(text) <= _MAX_TEXT_BYTES else None
+        tag = buf[start+1:end].decode('utf-8', 'replace')
+        pos = end + 1
+        text_start = pos
+        carry = b''
+        text_overflow = False
+
+        if tag.startswith('?') or tag.startswith('!'):
+            continue
+        closing = tag.startswith('/')
+        if closing:
+            tag = tag[1:]
+        self_closing = tag.endswith('/')
+        if self_closing:
+            tag = tag[:-1]
+        parts = tag.split(None, 1)
+        if not parts:
+            continue
+        attributes = {}
+        if len(parts) > 1:
+            for match in _ATTRIBUTE_RE.finditer(parts[1]):
+                attributes[match.group(1)] = match.group(2) if match.group(2) is not None else match.group(3)
+        yield parts[0], attributes, closing, text
+        if self_closing:
+            yield parts[0], attributes, True, None
+
+
+def time_step_of(file_name):
+    """Time-step index from a result file name, e.g. 12 for 'solution-0012.vtu', or None"""
+    match = _TIME_STEP_RE.search(os.path.basename(file_name))
+    return int(match.group(1)) if match else None
+
+
+@traced('parse')
+def read_vtu_header(file_name):
+    """
+    Read the structure of a VTK XML file without parsing its data arrays.
+    Reading stops at <AppendedData>; inline arrays are skipped over.
+
+    Returns:
+
+        header: dict
+          'type': e.g. 'UnstructuredGrid' or 'PUnstructuredGrid',
+          'version', 'byte_order', 'header_type', 'compressor': VTKFile attributes,
+          'pieces': number of Piece elements,
+          'number_of_points', 'number_of_cells': summed over pieces,
+          'point_data', 'cell_data': list of {'name', 'type', 'components', 'format'},
+          'encodings': sorted list of data encodings found ('ascii', 'binary', 'appended', 'raw'),
+          'time_step': index from the file name, or None,
+          'time': value of an ascii TIME field, or None,
+          'bytes_read': bytes read from the file
+
+    """
+    header = {
+        'type': None,
+        'version': None,
+        'byte_order': None,
+        'header_type': None,
+        'compressor': None,
+        'pieces': 0,
+        'number_of_points': 0,
+        'number_of_cells': 0,
+        'point_data': [],
+        'cell_data': [],
+        'encodings': [],
+        'time_step': time_step_of(file_name),
+        'time': None,
+        'bytes_read': 0
+    }
+    encodings = set()
+    section = None
+    field_array = None
+    found_vtkfile = False
+
+    with open(file_name, 'rb') as f:
+        for name, attributes, closing, text in _iter_tags(f):
+            if name == 'VTKFile' and not closing:
+                found_vtkfile = True
+                header['type'] = attributes.get('type')
+                header['version'] = attributes.get('version')
+                header['byte_order'] = attributes.get('byte_order')
+                header['header_type'] = attributes.get('header_type', 'UInt32')
+                header['compressor'] = attributes.get('compressor')
+            elif name == 'Piece' and not closing:
+                header['pieces'] += 1
+                header['number_of_points'] += int(attributes.get('NumberOfPoints', 0))
+                header['number_of_cells'] += int(attributes.get('NumberOfCells', 0))
+            elif name in _DATA_SECTIONS or name == 'FieldData':
+                section = None if closing else name
+            elif name in ('DataArray', 'PDataArray'):
+                if not closing:
+                    data_format = attributes.get('format', 'ascii' if name == 'DataArray' else None)
+                    if data_format is not None:
+                        encodings.add(data_format)
+                    if section in _DATA_SECTIONS and header['pieces'] <= 1:
+                        header[_DATA_SECTIONS[section]].append({
+                            'name': attributes.get('Name'),
+                            'type': attributes.get('type'),
+                            'components': int(attributes.get('NumberOfComponents', 1)),
+                            'format': data_format
+                        })
+                    if section == 'FieldData' and attributes.get('Name', '').upper() == 'TIME' and data_format == 'ascii':
+                        field_array = 'TIME'
+                else:
+                    if field_array == 'TIME' and text:
+                        try:
+                            header['time'] = float(text.split()[0])
+                        except ValueError:
+                            pass
+                    field_array = None
+            elif name == 'AppendedData':
+                encodings.add(attributes.get('encoding', 'raw'))
+                break
+        header['bytes_read'] = f.tell()
+
+    if not found_vtkfile:
+        raise ValueError(file_name + ": not a VTK XML file")
+    header['encodings'] = sorted(encodings)
+    return header
+
+
+def _read_vtu_header_or_none(file_name):
+    try:
+        return read_vtu_header(file_name)
+    except ValueError:
+        return None
+
+
+def read_vtu_headers(file_names, workers=4):
+    """
+    Read the headers of several files on a pool of threads. Returns a list
+    aligned with file_names, with None for files that are not VTK XML.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, int(workers))) as pool:
+        return list(pool.map(_read_vtu_header_or_none, file_names))
+
+
+def _describe_arrays(arrays):
+    return [a['name'] + ' (' + str(a['type']) + ', ' + str(a['components']) + ' components)' for a in arrays]
+
+
+def add_vtu_measurements(batch, file_names, headers, summary=True, per_file=True):
+    """
+    Queue the time steps, mesh sizes, data arrays and encodings of the result
+    files on a MeasurementBatch; per-file values are named '<attribute>: <file name>'.
+    Files whose header is None are skipped.
+
+    Arguments:
+
+        summary: bool
+          Queue the number of files, time steps, data arrays and encodings
+
+        per_file: bool
+          Queue the points, cells, time step and time of each file
+
+    """
+    results = [(os.path.basename(n), h) for n, h in zip(file_names, headers) if h is not None]
+    if not len(results):
+        return
+    if per_file:
+        for base, h in results:
+            batch.add_integer('Number of points: ' + base, h['number_of_points'])
+            batch.add_integer('Number of cells: ' + base, h['number_of_cells'])
+            if h['time_step'] is not None:
+                batch.add_integer('Time step: ' + base, h['time_step'])
+            if h['time'] is not None:
+                batch.add_number('Time: ' + base, h['time'])
+    if not summary:
+        return
+    batch.add_integer('Number of result files', len(results))
+    steps = sorted(h['time_step'] for n, h in results if h['time_step'] is not None)
+    if len(steps):
+        batch.add_vector('Time steps', steps, otype='integer')
+    # arrays of the latest time step
+    latest = max(results, key=lambda r: -1 if r[1]['time_step'] is None else r[1]['time_step'])[1]
+    batch.add_string('Point data arrays', '; '.join(_describe_arrays(latest['point_data'])))
+    batch.add_string('Cell data arrays', '; '.join(_describe_arrays(latest['cell_data'])))
+    batch.add_string('Data encodings', ', '.join(sorted(set(e for n, h in results for e in h['encodings']))))
@@ -0,0 +1,156 @@
+"""Detection of completed result files while a simulation runs, and .pvd time-series manifests"""
+
+import os
+import sys
+import glob
+import time
+from xml.sax.saxutils import quoteattr
+from prismscpfe_mcapi.vtu_data import time_step_of
+
+DEFAULT_POLL_INTERVAL = 10.0
+DEFAULT_STABLE_SECONDS = 30.0
+DEFAULT_IDLE_TIMEOUT = 3600.0
+
+# Bytes at the end of a result file searched for its closing tag
+_TAIL_BYTES = 4096
+
+
+def is_closed_vtk_file(path):
+    """True if the end of a VTK XML file contains its closing </VTKFile> tag"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - _TAIL_BYTES))
+        return b'</VTKFile>' in f.read()
+
+
+def _result_order(path):
+    step = time_step_of(path)
+    return (step is None, step, os.path.basename(path))
+
+
+class ResultWatcher(object):
+    """
+    Poll a directory for result files that are complete: their XML is closed
+    and their size has not changed for stable_seconds. Each file is returned
+    by poll() once.
+
+    Arguments:
+
+        directory: str
+
+        pattern: str
+          Glob pattern of result files, relative to directory
+
+        stable_seconds: float
+          Time a file must be left unmodified before it is considered complete
+
+        poll_interval: float
+          Seconds between polls in run()
+
+        idle_timeout: float
+          run() stops when no file has completed for this many seconds
+
+    """
+
+    def __init__(self, directory='.', pattern='*vtu', stable_seconds=DEFAULT_STABLE_SECONDS, poll_interval=DEFAULT_POLL_INTERVAL, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.directory = directory
+        self.pattern = pattern
+        self.stable_seconds = stable_seconds
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.done = set()
+        # path -> (size, mtime, time this size and mtime were first seen)
+        self._seen = {}
+
+    def poll(self, now=None):
+        """Return the newly completed result files, ordered by time step"""
+        if now is None:
+            now = time.time()
+        complete = []
+        for path in glob.glob(os.path.join(self.directory, self.pattern)):
+            if path in self.done:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            # timed from our own observations, so file server clock skew does not matter
+            previous = self._seen.get(path)
+            if previous is None or previous[:2] != (st.st_size, st.st_mtime):
+                previous = (st.st_size, st.st_mtime, now)
+                self._seen[path] = previous
+            if now - previous[2] < self.stable_seconds:
+                continue
+            if not is_closed_vtk_file(path):
+                continue
+            complete.append(path)
+        for path in complete:
+            self.done.add(path)
+            del self._seen[path]
+        return sorted(complete, key=_result_order)
+
+    def run(self, handle, out=sys.stdout, stop=None):
+        """
+        Call handle(paths) with each set of newly completed files until no new
+        file has completed for idle_timeout seconds, the user interrupts
+        with Ctrl-C, or stop (a threading.Event, for runs on a thread other
+        than the main thread, which never sees Ctrl-C) is set. Returns the
+        number of files handled.
+        """
+        count = 0
+        last_activity = time.time()
+        try:
+            while stop is None or not stop.is_set():
+                paths = self.poll()
+                if len(paths):
+                    handle(paths)
+                    count += len(paths)
+                    last_activity = time.time()
+                elif time.time() - last_activity >= self.idle_timeout:
+                    out.write('No new result files for ' + str(int(self.idle_timeout)) + ' s, stopping.\n')
+                    break
+                if stop is None:
+                    time.sleep(self.poll_interval)
+                else:
+                    stop.wait(self.poll_interval)
+            else:
+                out.write('Stopped watching.\n')
+        except KeyboardInterrupt:
+            out.write('Stopped watching.\n')
+        return count
+
+
+class PvdManifest(object):
+    """
+    A ParaView .pvd collection listing result files by time, rewritten
+    atomically each time files are added.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # file name relative to the .pvd -> time
+        self.datasets = {}
+
+    def add(self, file_name, timestep=None):
+        """Add a result file; timestep defaults to its time-step index, else its position"""
+        if timestep is None:
+            timestep = time_step_of(file_name)
+        if timestep is None:
+            timestep = len(self.datasets)
+        rel = os.path.relpath(file_name, os.path.dirname(os.path.abspath(self.path)))
+        self.datasets[rel] = timestep
+
+    def write(self):
+        lines = [
+            '<?xml version="1.0"?>',
+            '<VTKFile type="Collection" version="0.1" byte_order="LittleEndian">',
+            '  <Collection>'
+        ]
+        for file_name, timestep in sorted(self.datasets.items(), key=lambda item: (item[1], item[0])):
+            lines.append('    <DataSet timestep=' + quoteattr(repr(timestep)) + ' group="" part="0" file=' + quoteattr(file_name) + '/>')
+        lines.extend(['  </Collection>', '</VTKFile>', ''])
+        tmp_path = self.path + '.part'
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines))
+        os.replace(tmp_path, self.path)
+        return self.path
@@ -0,0 +1,8 @@
+"""Shared pytest configuration"""
+
+import os
+
+# materials_commons.api reads its remote from the environment when imported;
+# the tests only talk to MockServer
+os.environ.setdefault('MC_API_URL', 'http://localhost/api')
+os.environ.setdefault('MC_API_KEY', 'x')
@@ -0,0 +1,33 @@
+"""Tests of the .gid GrainId format"""
+
+import os
+import shutil
+import pytest
+import numpy as np
+from prismscpfe_mcapi.grainid_data import load_GrainId, read_GrainId_header
+from prismscpfe_mcapi.grainid_binary import convert_GrainId, read_GrainId_binary, write_GrainId_binary
+
+TEST_FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'TestFiles')
+
+
+@pytest.fixture
+def grainid_file(tmp_path):
+    path = str(tmp_path / 'GrainId.txt')
+    shutil.copy(os.path.join(TEST_FILES, 'GrainId.txt'), path)
+    return path
+
+
+@pytest.mark.parametrize('compression', ['none', 'rle'])
+def test_round_trip(grainid_file, compression):
+    out_path = convert_GrainId(grainid_file, compression=compression)
+    assert out_path.endswith('.gid')
+    header, grain_ids = read_GrainId_binary(out_path)
+    assert header['dimensions'] == (20, 20, 22)
+    assert header['lines'] == read_GrainId_header(grainid_file)['lines']
+    assert np.array_equal(grain_ids, load_GrainId(grainid_file))
+
+
+def test_unknown_compression(grainid_file, tmp_path):
+    header = read_GrainId_header(grainid_file)
+    with pytest.raises(ValueError):
+        write_GrainId_binary(str(tmp_path / 'GrainId.gid'), load_GrainId(grainid_file, header), header, compression='lzma')
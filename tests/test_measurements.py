@@ -0,0 +1,62 @@
+"""Tests of MeasurementBatch against the MockServer measurements route"""
+
+import pytest
+from prismscpfe_mcapi.mock_server import MockServer
+from prismscpfe_mcapi.measurements import MeasurementBatch, stored_measurements
+
+
+@pytest.fixture
+def server():
+    with MockServer() as server, server.install():
+        yield server
+
+
+@pytest.fixture
+def process(server, tmp_path):
+    proj = server.create_project(str(tmp_path))
+    expt = proj.create_experiment('run', '')
+    proc = expt.create_process_from_template('template')
+    proc.create_samples(['sample'])
+    return expt, proc
+
+
+def test_flush_sends_one_request(server, process):
+    expt, proc = process
+    batch = MeasurementBatch(expt, proc)
+    for i in range(10):
+        batch.add_integer('value ' + str(i), i)
+    before = server.requests
+    assert batch.flush() == 1
+    assert server.requests - before == 1
+    assert len(batch) == 0
+    assert stored_measurements(proc.output_samples[0])['value 3'] == ('integer', 3)
+
+
+def test_flush_splits_large_batches(server, process):
+    expt, proc = process
+    batch = MeasurementBatch(expt, proc, max_attributes=4)
+    for i in range(10):
+        batch.add_number('value ' + str(i), float(i))
+    assert batch.flush() == 3
+    assert batch.requests_sent == 3
+    assert len(stored_measurements(proc.output_samples[0])) == 10
+
+
+def test_empty_flush_sends_nothing(server, process):
+    expt, proc = process
+    before = server.requests
+    assert MeasurementBatch(expt, proc).flush() == 0
+    assert server.requests == before
+
+
+def test_discard_unchanged(server, process):
+    expt, proc = process
+    batch = MeasurementBatch(expt, proc)
+    batch.add_string('crystal', 'fcc')
+    batch.add_vector('row', [1.0, 2.0])
+    batch.flush()
+
+    batch.add_string('crystal', 'fcc')
+    batch.add_vector('row', [1.0, 3.0])
+    assert batch.discard_unchanged(stored_measurements(proc.output_samples[0])) == 1
+    assert [a['name'] for a in batch.attributes] == ['row']
@@ -0,0 +1,43 @@
+"""Tests of ParameterIndex and the parameter schema on the example app directory"""
+
+import os
+from prismscpfe_mcapi.prismscpfe_parameter_parser import ParameterIndex
+from prismscpfe_mcapi.parameter_schema import parameter_values
+
+TEST_FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'TestFiles')
+
+
+def test_index_entries():
+    index = ParameterIndex.load(os.path.join(TEST_FILES, 'parameters.in'))
+    assert index.get('Number of Slip Systems') == '18'
+    assert index.get('Number  of Slip   Systems') == '18'
+    assert index.get('Boundary condition filename') is None
+    assert index.get('Boundary condition filename', 'BCinfo.txt') == 'BCinfo.txt'
+
+
+def test_load_is_cached_until_the_file_changes(tmp_path):
+    path = str(tmp_path / 'parameters.in')
+    with open(path, 'w') as f:
+        f.write("set Order of finite elements = 1\n")
+    index = ParameterIndex.load(path)
+    assert ParameterIndex.load(path) is index
+    with open(path, 'w') as f:
+        f.write("set Order of finite elements = 22\n")
+    assert ParameterIndex.load(path).get('Order of finite elements') == '22'
+
+
+def test_subsections(tmp_path):
+    path = str(tmp_path / 'parameters.in')
+    with open(path, 'w') as f:
+        f.write("# comment\nsubsection Elastic Stiffness: 1\n  set row = 1, 2\nend\nset Total time = 2.5\n")
+    index = ParameterIndex.load(path)
+    assert index.get('Elastic Stiffness (1): row') == '1, 2'
+    assert index.get_any('row') == '1, 2'
+    assert index.get('Total time') == '2.5'
+
+
+def test_parameter_values_are_typed():
+    values = dict((name, (type, value)) for name, type, value in parameter_values(ParameterIndex.load(os.path.join(TEST_FILES, 'parameters.in'))))
+    assert values['Order of quadrature'] == ('int', 2)
+    assert values['Domain size X'] == ('double', 1.0)
+    assert values['Elastic Stiffness row 1'] == ('list of double', [170000.0, 124000.0, 124000.0, 0.0, 0.0, 0.0])
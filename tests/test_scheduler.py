@@ -0,0 +1,158 @@
+"""Tests of the RequestScheduler AIMD concurrency limit, retries and backoff"""
+
+import pytest
+from prismscpfe_mcapi import scheduler
+from prismscpfe_mcapi.scheduler import RequestScheduler
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code, headers=None):
+        Exception.__init__(self, str(status_code))
+        self.response = FakeResponse(status_code, headers)
+
+
+class FakeFunc(object):
+    """Raise each of errors in turn, then return 'ok'; counts its calls"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if len(self.errors):
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    """Record backoff delays instead of sleeping; random.uniform returns its upper bound"""
+    slept = []
+    monkeypatch.setattr(scheduler.time, 'sleep', slept.append)
+    monkeypatch.setattr(scheduler.random, 'uniform', lambda lo, hi: hi)
+    return slept
+
+
+def make_scheduler(**kwargs):
+    options = dict(rate=0, initial_concurrency=4, min_concurrency=1, max_concurrency=32, retries=6, base_delay=0.5, max_delay=30.0)
+    options.update(kwargs)
+    return RequestScheduler(**options)
+
+
+def test_additive_increase():
+    s = make_scheduler()
+    for i in range(4):
+        s.call(FakeFunc())
+    # about one per round of limit requests
+    assert 4.9 < s.limit < 5.0
+
+
+def test_increase_bounded_by_max_concurrency():
+    s = make_scheduler(initial_concurrency=2, max_concurrency=3)
+    for i in range(100):
+        s.call(FakeFunc())
+    assert s.limit == 3
+
+
+def test_multiplicative_decrease_on_throttling(delays):
+    s = make_scheduler(initial_concurrency=16, retries=1)
+    with pytest.raises(HTTPError):
+        s.call(FakeFunc(HTTPError(429)))
+    assert s.limit == 8
+    assert s.stats['throttled'] == 1
+
+
+def test_one_decrease_per_round_trip(delays):
+    s = make_scheduler(initial_concurrency=16, retries=1)
+    # a request started before the last decrease does not decrease again
+    s._last_decrease = float('inf')
+    with pytest.raises(HTTPError):
+        s.call(FakeFunc(HTTPError(503)))
+    assert s.limit == 16
+
+
+def test_decrease_bounded_by_min_concurrency(delays):
+    s = make_scheduler(initial_concurrency=2, min_concurrency=2, retries=1)
+    with pytest.raises(HTTPError):
+        s.call(FakeFunc(HTTPError(503)))
+    assert s.limit == 2
+
+
+def test_decrease_on_latency_target(monkeypatch):
+    s = make_scheduler(initial_concurrency=8, latency_target=1.0)
+    clock = iter([0.0, 5.0, 5.0])
+    monkeypatch.setattr(scheduler.time, 'monotonic', lambda: next(clock))
+    assert s.call(FakeFunc()) == 'ok'
+    assert s.limit == 4
+
+
+def test_idempotent_retries_transient_errors(delays):
+    s = make_scheduler()
+    func = FakeFunc(HTTPError(503), ConnectionError(), TimeoutError())
+    assert s.call_idempotent(func) == 'ok'
+    assert func.calls == 4
+    assert s.stats['retries'] == 3
+
+
+def test_idempotent_does_not_retry_client_errors(delays):
+    s = make_scheduler()
+    func = FakeFunc(HTTPError(404))
+    with pytest.raises(HTTPError):
+        s.call_idempotent(func)
+    assert func.calls == 1
+    assert delays == []
+
+
+def test_retries_give_up(delays):
+    s = make_scheduler(retries=3)
+    func = FakeFunc(*[HTTPError(503)] * 5)
+    with pytest.raises(HTTPError):
+        s.call_idempotent(func)
+    assert func.calls == 3
+    assert s.stats['failures'] == 1
+
+
+def test_call_retries_only_throttling(delays):
+    s = make_scheduler()
+    func = FakeFunc(HTTPError(429))
+    assert s.call(func) == 'ok'
+    assert func.calls == 2
+    func = FakeFunc(HTTPError(503))
+    with pytest.raises(HTTPError):
+        s.call(func)
+    assert func.calls == 1
+
+
+def test_unprocessed_retries_throttling_and_connection_errors(delays):
+    s = make_scheduler()
+    func = FakeFunc(HTTPError(429), ConnectionError())
+    assert s.call_unprocessed(func) == 'ok'
+    assert func.calls == 3
+
+
+def test_unprocessed_does_not_retry_server_errors(delays):
+    s = make_scheduler()
+    for error in [HTTPError(500), HTTPError(503), TimeoutError()]:
+        func = FakeFunc(error)
+        with pytest.raises(type(error)):
+            s.call_unprocessed(func)
+        assert func.calls == 1
+
+
+def test_exponential_backoff(delays):
+    s = make_scheduler(retries=6, base_delay=0.5, max_delay=4.0)
+    s.call_idempotent(FakeFunc(*[HTTPError(503)] * 5))
+    assert delays == [1.0, 2.0, 4.0, 4.0, 4.0]
+
+
+def test_backoff_respects_retry_after(delays):
+    s = make_scheduler(base_delay=0.5, max_delay=30.0)
+    s.call_idempotent(FakeFunc(HTTPError(429, {'Retry-After': '7'}), HTTPError(429, {'Retry-After': '60'})))
+    assert delays == [7.0, 30.0]
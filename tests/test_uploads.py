@@ -0,0 +1,108 @@
+"""Tests of uploads, the upload manifest and the operation journal against MockServer"""
+
+import os
+import pytest
+from prismscpfe_mcapi.mock_server import MockServer
+from prismscpfe_mcapi.manifest import UploadManifest
+from prismscpfe_mcapi.journal import begin_operation
+from prismscpfe_mcapi.uploads import upload_files, upload_and_attach, replace_changed_files
+
+
+@pytest.fixture
+def server():
+    with MockServer() as server, server.install():
+        yield server
+
+
+@pytest.fixture
+def proj(server, tmp_path):
+    return server.create_project(str(tmp_path))
+
+
+@pytest.fixture
+def proc(proj):
+    return proj.create_experiment('run', '').create_process_from_template('template')
+
+
+def write(proj, path, text):
+    path = os.path.join(proj.local_path, path)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+
+def test_upload_files_creates_directories_once(server, proj):
+    paths = [write(proj, os.path.join('run0', 'input', str(i) + '.txt'), str(i)) for i in range(4)]
+    files = upload_files(proj, paths, workers=4)
+    assert [file.name for file in files] == ['0.txt', '1.txt', '2.txt', '3.txt']
+    assert set(server.files[file.id]['path'] for file in files) == set('/run0/input/' + str(i) + '.txt' for i in range(4))
+    assert sorted(proj.directories) == ['/', '/run0', '/run0/input']
+
+
+def test_manifest_reuses_same_name_and_contents(server, proj):
+    a = write(proj, os.path.join('run0', 'parameters.in'), 'set x = 1\n')
+    b = write(proj, os.path.join('run1', 'parameters.in'), 'set x = 1\n')
+    manifest = UploadManifest.for_project(proj)
+    try:
+        first = upload_files(proj, [a], manifest=manifest)
+        before = server.requests
+        second = upload_files(proj, [b], manifest=manifest)
+    finally:
+        manifest.close()
+    assert second[0].id == first[0].id
+    assert server.requests == before
+    assert len(server.files) == 1
+
+
+def test_manifest_uploads_other_names_and_contents(server, proj):
+    a = write(proj, 'solution-0001.vtu', 'same')
+    b = write(proj, 'solution-0002.vtu', 'same')
+    c = write(proj, os.path.join('run1', 'solution-0001.vtu'), 'other')
+    manifest = UploadManifest.for_project(proj)
+    try:
+        files = upload_files(proj, [a, b, c], manifest=manifest)
+    finally:
+        manifest.close()
+    assert len(set(file.id for file in files)) == 3
+
+
+def test_upload_and_attach_direction(proj, proc):
+    paths = [write(proj, 'a.txt', 'a'), write(proj, 'b.txt', 'b')]
+    upload_and_attach(proj, proc, paths, direction='in')
+    assert sorted(file.name for file in proc.files) == ['a.txt', 'b.txt']
+    assert set(file.direction for file in proc.files) == set(['in'])
+
+
+def test_resume_attaches_remaining_files_only(server, proj, proc):
+    expt = proc.experiment
+    a, b, c = [write(proj, name, name) for name in ['a.txt', 'b.txt', 'c.txt']]
+    operation = begin_operation(expt, 'test', proj.local_path)
+    operation.set_process(proc.id)
+    first = upload_and_attach(proj, proc, [a, b], operation=operation)
+    operation.journal.close()
+
+    operation = begin_operation(expt, 'test', proj.local_path, resume=True)
+    assert operation.process_id == proc.id
+    files = upload_and_attach(proj, proc, [a, b, c], use_manifest=False, operation=operation)
+    operation.finish()
+
+    assert [file.id for file in files[:2]] == [file.id for file in first]
+    assert len(server.files) == 3
+    assert sorted(file.name for file in proc.files) == ['a.txt', 'b.txt', 'c.txt']
+
+
+def test_replace_changed_files(server, proj, proc):
+    a = write(proj, 'parameters.in', 'set x = 1\n')
+    b = write(proj, 'slipNormals.txt', '1 1 1\n')
+    upload_and_attach(proj, proc, [a, b])
+    old = dict((file.name, file.id) for file in proc.files)
+
+    write(proj, 'parameters.in', 'set x = 2\n')
+    uploaded = replace_changed_files(proj, proc, [a, b])
+    assert [file.name for file in uploaded] == ['parameters.in']
+    current = dict((file.name, file.id) for file in proc.files)
+    assert len(proc.files) == 2
+    assert current['slipNormals.txt'] == old['slipNormals.txt']
+    assert current['parameters.in'] != old['parameters.in']
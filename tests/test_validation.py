@@ -0,0 +1,51 @@
+"""Tests of the app directory consistency checks"""
+
+import os
+import sys
+import shutil
+import pytest
+from prismscpfe_mcapi.validation import validate_app_directory, check_app_directory
+
+TEST_FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'TestFiles')
+
+
+@pytest.fixture
+def app_dir(tmp_path):
+    path = str(tmp_path / 'app')
+    shutil.copytree(TEST_FILES, path)
+    return path
+
+
+def set_parameter(app_dir, line):
+    with open(os.path.join(app_dir, 'parameters.in'), 'a') as f:
+        f.write("\n" + line + "\n")
+
+
+def test_example_app_directory_is_consistent(app_dir):
+    assert validate_app_directory(app_dir) == []
+
+
+def test_slip_system_count(app_dir):
+    set_parameter(app_dir, "set Number of Slip Systems = 12")
+    errors = validate_app_directory(app_dir)
+    assert len(errors) > 0
+    assert validate_app_directory(app_dir, checks=['GrainId dimensions']) == []
+
+
+def test_missing_boundary_conditions_file(app_dir):
+    set_parameter(app_dir, "set Number of boundary conditions = 3")
+    assert validate_app_directory(app_dir, checks=['boundary conditions']) == ["BCinfo.txt ('Boundary condition filename') does not exist"]
+
+
+def test_boundary_conditions_count(app_dir):
+    set_parameter(app_dir, "set Number of boundary conditions = 3")
+    set_parameter(app_dir, "set Boundary condition filename = boundaryconditions.txt")
+    set_parameter(app_dir, "set BC file number of header lines = 0")
+    errors = validate_app_directory(app_dir, checks=['boundary conditions'])
+    assert len(errors) == 1 and errors[0].startswith('boundaryconditions.txt has ')
+
+
+def test_check_app_directory(app_dir):
+    set_parameter(app_dir, "set Number of Slip Systems = 12")
+    assert not check_app_directory('numerical-parameters', app_dir=app_dir, out=sys.stdout)
+    assert check_app_directory('BoundaryConditions', app_dir=app_dir, out=sys.stdout)
@@ -0,0 +1,32 @@
+"""Tests of the VTK XML header reader"""
+
+import os
+import numpy as np
+from prismscpfe_mcapi.benchmark import _write_vtu
+from prismscpfe_mcapi.vtu_data import read_vtu_header, read_vtu_headers, time_step_of
+
+TEST_FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'TestFiles')
+
+
+def test_read_header(tmp_path):
+    path = str(tmp_path / 'solution-0003.vtu')
+    _write_vtu(path, 3, 4 << 20, np.random.RandomState(0))
+    header = read_vtu_header(path)
+    assert header['type'] == 'UnstructuredGrid'
+    assert header['number_of_points'] > 0
+    assert [a['name'] for a in header['point_data']] == ['Displacement']
+    assert header['time_step'] == 3
+    # the appended data after the XML header is not read
+    assert header['bytes_read'] < os.path.getsize(path) // 2
+
+
+def test_time_step_of():
+    assert time_step_of('solution-0012.vtu') == 12
+
+
+def test_read_headers_skips_unreadable_files(tmp_path):
+    path = str(tmp_path / 'solution-0001.vtu')
+    _write_vtu(path, 1, 4096, np.random.RandomState(0))
+    headers = read_vtu_headers([path, os.path.join(TEST_FILES, '123.vtu')])
+    assert headers[0]['time_step'] == 1
+    assert headers[1] is None